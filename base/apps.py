@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .metrics import record_query
+
+        # Time the queries of every database connection (see base/metrics.py).
+        def install_query_timer(sender, connection, **kwargs):
+            if record_query not in connection.execute_wrappers:
+                connection.execute_wrappers.append(record_query)
+
+        connection_created.connect(install_query_timer, weak=False)
+
+        from . import auth  # noqa: F401 (connects the invalidation of cached users)
@@ -0,0 +1,164 @@
+import time
+from functools import wraps
+
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.views.decorators.cache import cache_control
+
+from . import events, roomstate
+from .http import JsonResponse
+from .models import Room, RoomMember, RoomRequest
+from .polling import poll_hint
+from .routers import replica_reads
+from .views import (
+    JOIN_STATUS_MAX_WAIT, JOIN_STATUS_RECHECK_INTERVAL, format_participants, format_pending_requests, format_room_etag,
+    is_long_poll, join_status_response, pending_requests_query, requested_wait,
+)
+
+
+# Async versions of the polling endpoints of base/views.py, served instead of them under ASGI (see ASYNC_VIEWS
+# in settings.py). They use the async ORM and `request.auser()`, so a waiting or polling client holds no thread:
+# one worker can serve thousands of connected room clients. Responses are the same as the sync views': both build
+# them, their queries and their ETags with the helpers of base/views.py.
+
+
+# Like django.views.decorators.http.condition(etag_func=...), for an async ETag function
+# (Django's decorator calls it synchronously, which can't use the async ORM).
+def async_condition(etag_func):
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag = None
+            if request.method in ('GET', 'HEAD'):
+                etag = await etag_func(request, *args, **kwargs)
+                etag = quote_etag(etag) if etag else None
+                if etag:
+                    response = get_conditional_response(request, etag=etag)
+                    if response is not None:
+                        return response
+
+            response = await view(request, *args, **kwargs)
+            if etag and not response.has_header('ETag'):
+                response.headers['ETag'] = etag
+            return response
+
+        return inner
+
+    return decorator
+
+
+# Same as base.views.room_etag.
+async def room_etag(room_name, *parts):
+    return format_room_etag(await roomstate.aroom_version(room_name), *parts)
+
+
+async def participants_etag(request, room_name):
+    return await room_etag(room_name)
+
+
+async def pending_requests_etag(request, room_name):
+    return await room_etag(room_name, (await request.auser()).id)
+
+
+async def join_request_status_etag(request, room_name, user_id):
+    if is_long_poll(request):
+        return None
+    return await room_etag(room_name, user_id)
+
+
+# Async version of base.views.getMember.
+@login_required(login_url='/login/')
+@replica_reads
+async def getMember(request):
+    uid = request.GET.get('UID')
+    room_name = request.GET.get('room_name')
+
+    member = await RoomMember.objects.aget(
+        uid=uid,
+        room__room_name=room_name,
+    )
+    return JsonResponse({'name': member.name}, safe=False)
+
+
+# Async version of base.views.check_pending_requests.
+@login_required(login_url='/login/')
+@replica_reads
+@cache_control(no_cache=True)
+@poll_hint
+@async_condition(etag_func=pending_requests_etag)
+async def check_pending_requests(request, room_name):
+    try:
+        room = await Room.objects.aget(room_name=room_name)
+        is_host = (await request.auser()).id == room.current_host_id
+
+        requests_data = []
+        if is_host:
+            requests_data = format_pending_requests([row async for row in pending_requests_query(room)])
+
+        return JsonResponse({"status": "success", "pending_requests": requests_data, "is_host": is_host})
+
+    except Room.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "Room not found"})
+    except Exception as e:
+        return JsonResponse({"status": "error", "message": str(e)})
+
+
+# Async version of base.views.check_join_request_status: the long-poll waits on the event loop.
+@login_required(login_url='/login/')
+@replica_reads
+@cache_control(no_cache=True)
+@poll_hint
+@async_condition(etag_func=join_request_status_etag)
+async def check_join_request_status(request, room_name, user_id):
+    deadline = time.monotonic() + requested_wait(request, JOIN_STATUS_MAX_WAIT)
+
+    while True:
+        sequence = events.hub.sequence(room_name)
+
+        join_request = await RoomRequest.objects.filter(user_id=user_id, room__room_name=room_name).afirst()
+        if join_request is None:
+            raise Http404('No RoomRequest matches the given query.')
+
+        remaining = deadline - time.monotonic()
+        if join_request.status != RoomRequest.Status.PENDING or remaining <= 0:
+            break
+
+        await events.hub.wait_async(room_name, sequence, min(remaining, JOIN_STATUS_RECHECK_INTERVAL))
+
+    return join_status_response(join_request)
+
+
+# Async version of base.views.get_participants.
+@login_required(login_url='/login/')
+@replica_reads
+@cache_control(no_cache=True)
+@poll_hint
+@async_condition(etag_func=participants_etag)
+async def get_participants(request, room_name):
+    try:
+        room = await Room.objects.aget(room_name=room_name)
+    except Room.DoesNotExist:
+        return JsonResponse({"status": "error", "message": "Room not found"}, status=404)
+
+    participants = format_participants(room, [row async for row in room.participants.values_list('id', 'username')])
+    return JsonResponse({"status": "success", "participants": participants})
+
+
+# Async version of base.views.getUidByUsername.
+@login_required(login_url='/login/')
+@replica_reads
+async def getUidByUsername(request):
+    username = request.GET.get('username')
+    room_name = request.GET.get('room_name')
+
+    try:
+        member = await RoomMember.objects.aget(
+            name=username,
+            room__room_name=room_name,
+        )
+        return JsonResponse({'uid': member.uid}, safe=False)
+
+    except RoomMember.DoesNotExist:
+        return JsonResponse({'error': 'Member not found'}, status=404)
@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+
+
+# Fast-path user resolution for polling requests.
+#
+# Every request of a logged-in user looks the user up again (after reading the session). With FAST_AUTH on,
+# this backend keeps users in the cache for AUTH_USER_CACHE_TTL seconds, so a client polling every few seconds
+# costs no user query; the session itself comes from the cache too (SESSION_ENGINE is cached_db).
+# Cached users are dropped whenever they are saved (which includes password changes and deactivation),
+# deleted or logged out. The cache is the one shared by the worker processes (CACHE_URL), so the other workers
+# see the change on their next request; settings.py refuses FAST_AUTH without it. The TTL stays short anyway,
+# for changes made without the ORM.
+
+
+def _cache_key(user_id):
+    return f'auth_user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        if not settings.FAST_AUTH:
+            return super().get_user(user_id)
+
+        key = _cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, settings.AUTH_USER_CACHE_TTL)
+        return user
+
+
+# Drop a user's cached copy, so the next request loads it from the database again.
+def invalidate_user(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _user_changed(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def _user_logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
@@ -0,0 +1,56 @@
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from ... import dbpool
+
+
+# PostgreSQL backend taking its connections from a bounded pool per worker process (see base/dbpool.py),
+# selected by settings.py when DB_POOL_SIZE is set. Django's own pooling needs psycopg 3; this one works with
+# psycopg2 as well. Connections go back to the pool when Django closes them at the end of each request
+# (CONN_MAX_AGE is 0), instead of being opened and closed by every request.
+# The pool's options come from the database's POOL settings: size, max_overflow, timeout and max_idle.
+
+# Transaction states of a connection (the same in psycopg2 and psycopg 3).
+TRANSACTION_STATUS_IDLE = 0
+TRANSACTION_STATUS_ACTIVE = 1
+TRANSACTION_STATUS_UNKNOWN = 4
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    @property
+    def connection_pool(self):
+        if self.alias == NO_DB_ALIAS:
+            return None  # Django's connection to the `postgres` database (creating the test database, etc.).
+        return dbpool.get_pool(self.alias, self.settings_dict['NAME'], self.settings_dict['POOL'])
+
+    def get_new_connection(self, conn_params):
+        pool = self.connection_pool
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        try:
+            connection = pool.checkout(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        except dbpool.PoolTimeout as error:
+            raise self.Database.OperationalError(str(error)) from error  # Becomes django.db.OperationalError.
+        # Connections from the pool were opened with these settings, and super() set the isolation level then.
+        self.isolation_level = IsolationLevel(self.settings_dict['OPTIONS'].get('isolation_level', IsolationLevel.READ_COMMITTED))
+        return connection
+
+    def _close(self):
+        pool = self.connection_pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            pool.checkin(self.connection, reset_connection)
+            self.connection = None  # Given back: this wrapper can't use it anymore.
+
+
+# Make a returned connection reusable: roll back whatever transaction it was left in, and refuse broken ones.
+def reset_connection(connection):
+    if connection.closed:
+        raise ConnectionError('The connection is closed')
+    status = connection.info.transaction_status
+    if status in (TRANSACTION_STATUS_ACTIVE, TRANSACTION_STATUS_UNKNOWN):
+        raise ConnectionError('The connection is busy or broken')
+    if status != TRANSACTION_STATUS_IDLE:
+        connection.rollback()
@@ -0,0 +1,303 @@
+import os
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, resolve
+
+from . import roomstate
+from .models import Room, RoomMember, RoomRequest, User
+
+
+# Endpoint benchmarks.
+#
+# seed() fills the database with a realistic load: thousands of rooms, tens of participants (and members) each,
+# and a queue of pending join requests per room. run() then drives every route of base/urls.py through the
+# test client against the first room, recording per endpoint the queries issued, the p50/p99 latency and the
+# memory allocated, and checks them against the endpoint's budget. Budgets are the baseline new changes must
+# hold (or improve on): raise one only with a reason.
+#
+# The test suite runs a scaled-down version on every test run; `manage.py bench` runs the full-size one.
+
+
+# Dummy Agora credentials for get_token when none are configured; the tokens are never used.
+BENCH_AGORA_CREDENTIALS = {'AGORA_APP_ID': '0' * 32, 'AGORA_APP_CERTIFICATE': '1' * 32}
+
+# Dummy token turning /metrics/ on when METRICS_TOKEN isn't configured.
+BENCH_METRICS_TOKEN = 'bench'
+
+
+# Fill the database with `rooms` rooms of `participants` participants and members each, plus `pending`
+# pending join requests per room. Returns the named users and room the endpoints are driven with.
+def seed(rooms=2000, participants=20, pending=5, batch_size=5000):
+    password = make_password(None)  # Unusable, and hashed only once.
+    pool = participants * 50  # Users taking part in rooms; each takes part in several.
+    requesters = pending * 50  # Users waiting in lobbies; never participants of the rooms they wait for.
+
+    users = User.objects.bulk_create(
+        [User(username=f'user{i}', password=password) for i in range(pool)]
+        + [User(username=f'requester{i}', password=password) for i in range(requesters)],
+        batch_size=batch_size,
+    )
+    users, requesters = users[:pool], users[pool:]
+
+    room_objects = []
+    for i in range(rooms):
+        room_objects.append(Room(
+            room_name=f'BENCH{i}',
+            current_host=users[(i * participants) % pool],
+            uid_bitmap=((1 << participants) - 1).to_bytes((participants + 7) // 8, 'little'),
+        ))
+    room_objects = Room.objects.bulk_create(room_objects, batch_size=batch_size)
+
+    through, members, requests = [], [], []
+    for i, room in enumerate(room_objects):
+        for j in range(participants):
+            user = users[(i * participants + j) % pool]
+            through.append(Room.participants.through(room_id=room.pk, user_id=user.pk))
+            members.append(RoomMember(name=user.username.title(), uid=str(j + 1), room=room, user=user))
+        for j in range(pending):
+            requests.append(RoomRequest(room=room, user=requesters[(i * pending + j) % len(requesters)]))
+    Room.participants.through.objects.bulk_create(through, batch_size=batch_size)
+    RoomMember.objects.bulk_create(members, batch_size=batch_size)
+    RoomRequest.objects.bulk_create(requests, batch_size=batch_size)
+
+    # Users with a role in the endpoints that change the room, so each iteration can be set up the same way.
+    room = room_objects[0]
+    extra = {
+        name: User.objects.create(username=name, password=password)
+        for name in ('leaver', 'kicked', 'joiner', 'approvee', 'waiting')
+    }
+    RoomRequest.objects.create(room=room, user=extra['waiting'])
+    return SimpleNamespace(room=room, host=users[0], guest=users[1], **extra)
+
+
+# Queries an authenticated request spends on its session and user when FAST_AUTH is off (see base/auth.py).
+AUTH_QUERIES = 2
+
+# Query a request changing a room spends on publishing its new version to the room state store, when one is
+# configured (see base/roomstate.py).
+PUBLISH_QUERIES = 1
+
+
+# How to drive one route: who sends it, how, and what it may cost.
+# `path`, `data` and `headers` may be callables taking the benchmark data and the value returned by `prepare`,
+# which runs (untimed) before every request to put the room back into the state the request expects.
+class Endpoint:
+    def __init__(self, name, method, path, user='guest', data=None, headers=None, prepare=None, queries=None, p99_ms=50, changes_room=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.user = user
+        self.data = data
+        self.headers = headers
+        self.prepare = prepare
+        self.queries = queries  # Most queries one request may issue with FAST_AUTH on.
+        self.p99_ms = p99_ms  # Slowest p99 latency allowed, in milliseconds.
+        self.changes_room = changes_room  # Whether the request bumps a room's version.
+
+    # Most queries one request may issue with the current settings.
+    def query_budget(self):
+        if self.queries is None or self.user is None:
+            return self.queries
+        budget = self.queries
+        if not settings.FAST_AUTH:
+            budget += AUTH_QUERIES
+        if self.changes_room and roomstate.store.enabled:
+            budget += PUBLISH_QUERIES
+        return budget
+
+    def request(self, client, bench, state):
+        path = self.path(bench, state) if callable(self.path) else self.path
+        data = self.data(bench, state) if callable(self.data) else self.data
+        headers = self.headers(bench, state) if callable(self.headers) else self.headers
+        if self.method == 'get':
+            return client.get(path, data, headers=headers)
+        return client.post(path, data, content_type='application/json', headers=headers)
+
+
+def _member_payload(name, uid):
+    return lambda bench, state: {'name': name, 'UID': uid, 'room_name': bench.room.room_name}
+
+
+def _join_room(user, uid):
+    def prepare(bench):
+        bench.room.participants.add(user(bench))
+        RoomMember.objects.get_or_create(room=bench.room, name=user(bench).username.title(), uid=uid, defaults={'user': user(bench)})
+    return prepare
+
+
+def _reset_request(user):
+    def prepare(bench):
+        RoomRequest.objects.filter(room=bench.room, user=user(bench)).delete()
+        return RoomRequest.objects.create(room=bench.room, user=user(bench))
+    return prepare
+
+
+def _new_channel():
+    counter = iter(range(10 ** 9))
+    return lambda bench, state: {'channel': f'NEWROOM{next(counter)}', 'actionType': 'host'}
+
+
+def _new_uid():
+    counter = iter(range(10 ** 9))
+    return lambda bench, state: {'name': 'Newcomer', 'UID': str(10000 + next(counter)), 'room_name': bench.room.room_name}
+
+
+# Every route of base/urls.py with its budget. Query budgets are for FAST_AUTH (session and user cached), without a
+# room state store.
+ENDPOINTS = [
+    Endpoint('home', 'get', '/', user=None, queries=0),
+    Endpoint('about', 'get', '/about/', user=None, queries=0),
+    Endpoint('contact', 'get', '/contact/', user=None, queries=0),
+    Endpoint('login', 'get', '/login/', user=None, queries=0),
+    Endpoint('logout', 'post', '/logout/', queries=3),
+    Endpoint('signup', 'get', '/signup/', user=None, queries=0),
+    Endpoint('lobby', 'get', '/lobby', queries=0),
+    Endpoint('room', 'get', '/room/', queries=0),
+    Endpoint('get_token (host)', 'get', '/get_token/', data=_new_channel(), queries=9, p99_ms=100, changes_room=True),
+    Endpoint('get_token (join)', 'get', '/get_token/', data=lambda bench, state: {'channel': bench.room.room_name, 'actionType': 'join'}, queries=6, p99_ms=100),
+    Endpoint('create_member', 'post', '/create_member/', data=_new_uid(), queries=9, changes_room=True),
+    Endpoint('get_member', 'get', '/get_member/', data=lambda bench, state: {'UID': '2', 'room_name': bench.room.room_name}, queries=1),
+    Endpoint('get_members', 'get', '/get_members/', data=lambda bench, state: {'UID': ['1', '2', '3'], 'room_name': bench.room.room_name}, queries=1),
+    Endpoint('get_member_map', 'get', lambda bench, state: f'/get_member_map/{bench.room.room_name}/', queries=2),
+    Endpoint('delete_member', 'post', '/delete_member/', user='leaver', data=_member_payload('Leaver', '900'),
+             prepare=_join_room(lambda bench: bench.leaver, '900'), queries=7, changes_room=True),
+    Endpoint('heartbeat', 'post', '/heartbeat/', data=_member_payload('User1', '2'), queries=1),
+    Endpoint('join_room', 'post', lambda bench, state: f'/join_room/{bench.room.room_name}/', user='joiner',
+             prepare=lambda bench: RoomRequest.objects.filter(room=bench.room, user=bench.joiner).delete(), queries=8, changes_room=True),
+    Endpoint('check_pending_requests', 'get', lambda bench, state: f'/check_pending_requests/{bench.room.room_name}/', user='host', queries=3),
+    Endpoint('approve_join_request', 'post', lambda bench, state: f'/approve_join_request/{bench.room.room_name}/{state.pk}/', user='host',
+             data={'approve': False}, prepare=_reset_request(lambda bench: bench.approvee), queries=4, changes_room=True),
+    Endpoint('check_join_request_status', 'get', lambda bench, state: f'/check_join_request_status/{bench.room.room_name}/{bench.waiting.pk}/',
+             user='waiting', queries=2),
+    Endpoint('get_participants', 'get', lambda bench, state: f'/get_participants/{bench.room.room_name}/', queries=3),
+    Endpoint('room_snapshot (host)', 'get', lambda bench, state: f'/room_snapshot/{bench.room.room_name}/', user='host', queries=5),
+    Endpoint('room_snapshot (guest)', 'get', lambda bench, state: f'/room_snapshot/{bench.room.room_name}/', queries=4),
+    Endpoint('get_uid_by_username', 'get', '/get_uid_by_username/', data=lambda bench, state: {'username': 'User1', 'room_name': bench.room.room_name}, queries=1),
+    Endpoint('remove_participant_by_name', 'post', '/remove_participant_by_name/', user='host', data=_member_payload('Kicked', '901'),
+             prepare=_join_room(lambda bench: bench.kicked, '901'), queries=8, changes_room=True),
+    Endpoint('change_host', 'post', '/change_host/', user='host', data=lambda bench, state: {'name': bench.guest.username, 'room_name': bench.room.room_name},
+             prepare=lambda bench: Room.objects.filter(pk=bench.room.pk).update(current_host=bench.host), queries=5, changes_room=True),
+    Endpoint('metrics', 'get', '/metrics/', user=None, headers=lambda bench, state: {'Authorization': f'Bearer {settings.METRICS_TOKEN}'}, queries=0),
+]
+
+
+# Set dummy Agora credentials for the duration of a run, unless real ones are configured.
+@contextmanager
+def _agora_credentials():
+    missing = {name: value for name, value in BENCH_AGORA_CREDENTIALS.items() if not os.environ.get(name)}
+    os.environ.update(missing)
+    try:
+        yield
+    finally:
+        for name in missing:
+            del os.environ[name]
+
+
+# Turn /metrics/ on for the duration of a run, unless it already is.
+@contextmanager
+def _metrics_token():
+    if settings.METRICS_TOKEN:
+        yield
+        return
+    with override_settings(METRICS_TOKEN=BENCH_METRICS_TOKEN):
+        yield
+
+
+def _percentile(samples, percent):
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[percent - 1]
+
+
+# Drive every endpoint `iterations` times against the seeded data and return one result per endpoint.
+# A first request records the endpoint's queries and allocations; the timed requests run without query
+# capture or allocation tracing, which would distort the latencies.
+def run(bench, endpoints=ENDPOINTS, iterations=20):
+    results = []
+
+    with _agora_credentials(), _metrics_token():
+        for endpoint in endpoints:
+            client = Client(raise_request_exception=False)  # A crashing view is reported as a 500 result.
+            user = getattr(bench, endpoint.user) if endpoint.user else None
+
+            # Log in once, and again only after logging out: logging in drops the user from the cache of
+            # base/auth.py, and a polling client is measured with its session and user already cached.
+            def prepare():
+                session = client.cookies.get(settings.SESSION_COOKIE_NAME)
+                if user is not None and not (session and session.value):
+                    client.force_login(user)
+                return endpoint.prepare(bench) if endpoint.prepare else None
+
+            endpoint.request(client, bench, prepare())  # Warm up.
+            state = prepare()
+            tracemalloc.start()
+            try:
+                with CaptureQueriesContext(connection) as queries:
+                    response = endpoint.request(client, bench, state)
+                query_count = len(queries)  # Read now: every request clears the connection's query log.
+                allocated_kib = tracemalloc.get_traced_memory()[1] / 1024
+            finally:
+                tracemalloc.stop()
+
+            timings = []
+            for _ in range(iterations):
+                state = prepare()
+                start = time.perf_counter()
+                endpoint.request(client, bench, state)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            results.append(BenchResult(endpoint, response.status_code, query_count, timings, allocated_kib))
+    return results
+
+
+# Measurements of one endpoint.
+class BenchResult:
+    def __init__(self, endpoint, status, queries, timings, allocated_kib):
+        self.endpoint = endpoint
+        self.status = status
+        self.queries = queries
+        self.p50_ms = statistics.median(timings)
+        self.p99_ms = _percentile(timings, 99)
+        self.allocated_kib = allocated_kib  # Peak memory allocated while handling one request.
+
+    # Budgets this endpoint went over, as readable messages. `latency=False` leaves out the latency budget, which
+    # depends on the machine running the benchmark.
+    def violations(self, latency=True):
+        problems = []
+        if self.status >= 500:
+            problems.append(f'{self.endpoint.name}: failed with status {self.status}')
+        budget = self.endpoint.query_budget()
+        if budget is not None and self.queries > budget:
+            problems.append(f'{self.endpoint.name}: {self.queries} queries, budget {budget}')
+        if latency and self.p99_ms > self.endpoint.p99_ms:
+            problems.append(f'{self.endpoint.name}: p99 {self.p99_ms:.1f} ms, budget {self.endpoint.p99_ms} ms')
+        return problems
+
+
+# Table of the results, one endpoint per line.
+def report(results):
+    lines = [f'{"endpoint":<30} {"status":>6} {"queries":>7} {"p50 ms":>8} {"p99 ms":>8} {"peak KiB":>9}']
+    for result in results:
+        lines.append(
+            f'{result.endpoint.name:<30} {result.status:>6} {result.queries:>7} '
+            f'{result.p50_ms:>8.2f} {result.p99_ms:>8.2f} {result.allocated_kib:>9.1f}'
+        )
+    return '\n'.join(lines)
+
+
+# Routes of base/urls.py that no endpoint benchmark drives.
+def uncovered_routes(bench, endpoints=ENDPOINTS):
+    driven = set()
+    for endpoint in endpoints:
+        path = endpoint.path(bench, SimpleNamespace(pk=0)) if callable(endpoint.path) else endpoint.path  # Any id resolves.
+        driven.add(resolve(path).route)
+    return {str(pattern.pattern) for pattern in get_resolver('base.urls').url_patterns} - driven
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import re
+from http.cookies import SimpleCookie
+from importlib import import_module
+from types import SimpleNamespace
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+
+from . import events
+from .models import Room
+from .views import participants_data, pending_requests_data
+
+
+# WebSocket route for the participant roster of a room.
+ROOM_SOCKET_PATH = re.compile(r'^/ws/rooms/(?P<room_name>[^/]+)/$')
+
+
+# Resolve the logged-in user from the session cookie sent with the WebSocket handshake.
+def _get_user(session_key):
+    close_old_connections()
+    engine = import_module(settings.SESSION_ENGINE)
+    session = engine.SessionStore(session_key)
+    return get_user(SimpleNamespace(session=session))
+
+
+# Load the current roster of a room, or None if the room does not exist.
+def _get_roster(room_name):
+    room = Room.objects.filter(room_name=room_name).first()
+    return participants_data(room) if room else None
+
+
+# Load the pending join requests of a room for its host.
+def _get_pending_requests(room_name):
+    room = Room.objects.filter(room_name=room_name).first()
+    return pending_requests_data(room) if room else []
+
+
+def _session_key(scope):
+    cookies = SimpleCookie()
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.load(value.decode('latin-1'))
+    morsel = cookies.get(settings.SESSION_COOKIE_NAME)
+    return morsel.value if morsel else None
+
+
+# ASGI application pushing roster diffs (join, leave, host change) to room clients.
+# The client first receives the full roster, then one message per change published by the views.
+# Only the room's participants may connect; other users are turned away, like anonymous ones.
+# The host's connection also gets the pending join requests, first as a list and then as they come in;
+# when the host changes, the new host is sent the current list.
+async def room_socket(scope, receive, send, room_name):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    user = await sync_to_async(_get_user)(_session_key(scope))
+    if not user.is_authenticated:
+        await send({'type': 'websocket.close', 'code': 4401})  # Same as @login_required for HTTP views.
+        return
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=settings.EVENT_QUEUE_SIZE)  # Bounded: see events.RoomEventHub.
+
+    # Subscribe before reading the roster so no change can slip in between the snapshot and the stream.
+    events.get_bus()  # WebSockets don't go through Django's request handling, which connects the bus.
+    events.hub.subscribe(room_name, loop, queue)
+    try:
+        roster = await sync_to_async(_get_roster)(room_name)
+        if roster is None:
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        if not any(participant["username"] == user.username for participant in roster):
+            await send({'type': 'websocket.close', 'code': 4403})  # Only the room's participants get its events.
+            return
+
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.send', 'text': json.dumps({"type": "roster", "participants": roster})})
+
+        # Track the host from the roster and the host events, so host-only events go to the right connection
+        host = next((participant["username"] for participant in roster if participant["is_host"]), None)
+
+        async def send_pending_requests():
+            pending_requests = await sync_to_async(_get_pending_requests)(room_name)
+            await send({'type': 'websocket.send', 'text': json.dumps({"type": "pending_requests", "pending_requests": pending_requests})})
+
+        if host == user.username:
+            await send_pending_requests()
+
+        receiver = asyncio.ensure_future(receive())
+        getter = asyncio.ensure_future(queue.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait({receiver, getter}, return_when=asyncio.FIRST_COMPLETED)
+
+                if receiver in done:
+                    if receiver.result()['type'] == 'websocket.disconnect':
+                        break
+                    receiver = asyncio.ensure_future(receive())  # Clients don't send anything we act on.
+
+                if getter in done:
+                    event = getter.result()
+                    getter = asyncio.ensure_future(queue.get())
+
+                    # Events were dropped: send the whole state again.
+                    if event is events.RESYNC:
+                        roster = await sync_to_async(_get_roster)(room_name)
+                        if roster is None:
+                            break  # The room is gone.
+                        await send({'type': 'websocket.send', 'text': json.dumps({"type": "roster", "participants": roster})})
+                        host = next((participant["username"] for participant in roster if participant["is_host"]), None)
+                        if host == user.username:
+                            await send_pending_requests()
+                        continue
+
+                    if event.get("audience") == "host" and host != user.username:
+                        continue
+                    await send({'type': 'websocket.send', 'text': json.dumps(event)})
+
+                    if event["type"] == "host":
+                        host = event["username"]
+                        if host == user.username:
+                            await send_pending_requests()
+        finally:
+            receiver.cancel()
+            getter.cancel()
+    finally:
+        events.hub.unsubscribe(room_name, loop, queue)
+
+
+# Dispatch a WebSocket connection to the matching handler, rejecting unknown paths.
+async def websocket_application(scope, receive, send):
+    match = ROOM_SOCKET_PATH.match(scope['path'])
+    if match is None:
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await room_socket(scope, receive, send, match.group('room_name'))
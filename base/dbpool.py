@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bounded pool of database connections, shared by the threads of a worker process (see
+# base/backends/postgresql/base.py, enabled with DB_POOL_SIZE).
+#
+# Up to `size` connections are kept open between requests. When they are all in use, up to `max_overflow` more
+# are opened for the burst, and closed as soon as they are given back. Past that, requests wait up to `timeout`
+# seconds for a connection to be returned, then fail with PoolTimeout rather than piling up on the database.
+# Connections left idle for more than `max_idle` seconds are closed instead of reused, since servers and
+# firewalls drop idle connections.
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, size, max_overflow, timeout, max_idle):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._returned = threading.Condition(self._lock)
+        self._idle = []  # (connection, when it was returned) pairs, the most recently returned last.
+        self._open = 0  # Connections open, idle or in use (or being opened).
+        # Counters, for /metrics/.
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    @property
+    def in_use(self):
+        return self._open - len(self._idle)
+
+    @property
+    def overflow(self):
+        return max(0, self._open - self.size)
+
+    # Take a connection: an idle one, or a new one from `connect()` when the pool may still grow.
+    def checkout(self, connect):
+        stale = []
+        deadline = None
+        try:
+            with self._returned:
+                self.checkouts += 1
+                while True:
+                    while self._idle:
+                        connection, returned_at = self._idle.pop()  # The most recently used is the least likely stale.
+                        if time.monotonic() - returned_at > self.max_idle:
+                            self._open -= 1
+                            stale.append(connection)
+                            continue
+                        return connection
+                    if self._open < self.size + self.max_overflow:
+                        self._open += 1
+                        break
+
+                    now = time.monotonic()
+                    if deadline is None:
+                        deadline = now + self.timeout
+                        self.waits += 1
+                    if now >= deadline:
+                        self.timeouts += 1
+                        raise PoolTimeout(f'No database connection available after {self.timeout} seconds')
+                    start = now
+                    self._returned.wait(deadline - now)
+                    self.wait_seconds += time.monotonic() - start
+        finally:
+            for connection in stale:
+                _close(connection)
+
+        try:
+            return connect()
+        except BaseException:
+            self._discarded()
+            raise
+
+    # Give a connection back. `reset(connection)` puts it back in a reusable state, and raises if it can't.
+    def checkin(self, connection, reset):
+        try:
+            reset(connection)
+        except Exception:
+            _close(connection)
+            self._discarded()
+            return
+
+        with self._returned:
+            if self._open <= self.size:
+                self._idle.append((connection, time.monotonic()))
+                self._returned.notify()
+                return
+            self._open -= 1  # An overflow connection: close it now that the burst is served.
+            self._returned.notify()
+        _close(connection)
+
+    # Forget a connection that was closed (or never opened), making room for a new one.
+    def _discarded(self):
+        with self._returned:
+            self._open -= 1
+            self._returned.notify()
+
+    # Close the idle connections (the ones in use are closed when given back).
+    def close(self):
+        with self._returned:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self.size = 0
+        for connection, _ in idle:
+            _close(connection)
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except Exception:
+        logger.warning('Could not close a pooled database connection', exc_info=True)
+
+
+# Pools of this process, by (database alias, database name).
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, name, options):
+    key = (alias, name)
+    pool = pools.get(key)
+    if pool is None:
+        with pools_lock:
+            pool = pools.get(key)
+            if pool is None:
+                pool = pools[key] = ConnectionPool(**options)
+    return pool
+
+
+# Pool metrics in the Prometheus text format, added to /metrics/.
+def metric_lines():
+    if not pools:
+        return []
+    gauges = (
+        ('livecollab_db_pool_connections_idle', 'Open connections waiting in the pool.', 'idle'),
+        ('livecollab_db_pool_connections_in_use', 'Pooled connections in use.', 'in_use'),
+        ('livecollab_db_pool_overflow', 'Connections open beyond the pool size.', 'overflow'),
+    )
+    counters = (
+        ('livecollab_db_pool_checkouts_total', 'Connections taken from the pool.', 'checkouts'),
+        ('livecollab_db_pool_waits_total', 'Checkouts that had to wait for a connection.', 'waits'),
+        ('livecollab_db_pool_wait_seconds_total', 'Time spent waiting for a connection.', 'wait_seconds'),
+        ('livecollab_db_pool_timeouts_total', 'Checkouts that gave up waiting.', 'timeouts'),
+    )
+    lines = []
+    for kind, families in (('gauge', gauges), ('counter', counters)):
+        for name, help_text, attribute in families:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (alias, database), pool in sorted(pools.items(), key=lambda item: item[0]):
+                lines.append(f'{name}{{alias="{alias}",database="{database}"}} {getattr(pool, attribute)}')
+    return lines
+
+
+metrics.registry.collectors.append(metric_lines)
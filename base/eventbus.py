@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import socket
+import threading
+import uuid
+from urllib.parse import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+
+# Event buses carrying room events between worker processes.
+#
+# Every process delivers its own events to its hub (base/events.py) straight away, and sends them over the bus;
+# a listener thread hands the events coming from other processes to the local hub, in batches of whatever
+# arrived together. Chosen with EVENT_BUS_URL:
+#
+# - unset: LocalEventBus, for a single process.
+# - `local://`: LocalEventBus too, declaring that the deployment runs a single process, so this hub sees every
+#   event (base/polling.py then backs idle rooms off).
+# - `redis://host:6379/0`: RedisEventBus, over Redis pub/sub (needs the redis package).
+# - `relay://127.0.0.1:7390`: RelayEventBus, through `manage.py event_relay`. Meant for running several workers
+#   on one machine (locally, and in the tests) without Redis.
+#
+# Events published while a process is disconnected from the bus are lost for the other processes, so after
+# reconnecting, a bus tells its local subscribers to resync (reload their rooms' state).
+
+
+# Seconds to wait before reconnecting to the bus.
+RECONNECT_DELAY = 1
+
+
+# Bus for a single process: events only go to its own hub.
+class LocalEventBus:
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, room_name, event):
+        self.hub.publish(room_name, event)
+
+    def close(self):
+        pass
+
+
+# Base for the buses relaying events between processes: keeps a listener thread (re)connected to the bus.
+class RemoteEventBus(LocalEventBus):
+    def __init__(self, hub):
+        super().__init__(hub)
+        self._closed = threading.Event()
+        self._connected = threading.Event()
+        self._listener = threading.Thread(target=self._listen_forever, name=f'{type(self).__name__} listener', daemon=True)
+        self._listener.start()
+
+    def publish(self, room_name, event):
+        super().publish(room_name, event)  # Local connections first, without a round trip.
+        try:
+            self.send(json.dumps({'room': room_name, 'event': event}))
+        except Exception:
+            logger.exception('Could not send a room event to the event bus')
+
+    # Block until the listener is connected (for tests and startup checks). Returns whether it is.
+    def wait_connected(self, timeout):
+        return self._connected.wait(timeout)
+
+    def close(self):
+        self._closed.set()
+        self.disconnect()
+        self._listener.join(timeout=5)
+
+    def _listen_forever(self):
+        reconnecting = False
+        while not self._closed.is_set():
+            try:
+                self.connect()
+                self._connected.set()
+                if reconnecting:
+                    self.hub.resync_all()
+                for messages in self.receive():
+                    self.hub.publish_many([(message['room'], message['event']) for message in map(json.loads, messages)])
+            except Exception:
+                if not self._closed.is_set():
+                    logger.exception('Lost the connection to the event bus, reconnecting')
+            self._connected.clear()
+            self.disconnect()
+            reconnecting = True
+            self._closed.wait(RECONNECT_DELAY)
+
+    # Implemented by the transports: connect(), disconnect(), send(text), and receive(), yielding lists of the
+    # texts sent by other processes until the connection ends.
+
+
+# Bus over Redis pub/sub, through a redis-py compatible client (`redis.Redis`, or any object with the same
+# publish and pubsub methods). Redis echoes messages back to their publisher, so each carries its origin.
+class RedisEventBus(RemoteEventBus):
+    def __init__(self, hub, client, channel='livecollab:events'):
+        self.client = client
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._pubsub = None
+        super().__init__(hub)
+
+    def connect(self):
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.channel)
+
+    def disconnect(self):
+        pubsub, self._pubsub = self._pubsub, None
+        if pubsub is not None:
+            pubsub.close()
+
+    def send(self, text):
+        self.client.publish(self.channel, f'{self.origin} {text}')
+
+    def receive(self):
+        while not self._closed.is_set():
+            pubsub = self._pubsub
+            if pubsub is None:
+                return
+            message = pubsub.get_message(timeout=1.0)
+            batch = []
+            while message is not None:
+                origin, _, text = _text(message['data']).partition(' ')
+                if origin != self.origin:
+                    batch.append(text)
+                message = pubsub.get_message(timeout=0.0)
+            if batch:
+                yield batch
+
+
+# Bus through an EventRelay, over a TCP connection carrying one JSON message per line.
+class RelayEventBus(RemoteEventBus):
+    def __init__(self, hub, host, port):
+        self.address = (host, port)
+        self._socket = None
+        self._send_lock = threading.Lock()
+        super().__init__(hub)
+
+    def connect(self):
+        self._socket = socket.create_connection(self.address)
+
+    def disconnect(self):
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    def send(self, text):
+        sock = self._socket
+        if sock is None:
+            raise ConnectionError('Not connected to the event relay')
+        with self._send_lock:
+            sock.sendall(text.encode() + b'\n')
+
+    def receive(self):
+        buffer = b''
+        while True:
+            sock = self._socket
+            data = sock.recv(65536) if sock is not None else b''
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            if lines:
+                yield [line.decode() for line in lines]
+
+
+def _text(data):
+    return data.decode() if isinstance(data, bytes) else data
+
+
+# Relay forwarding every line a client sends to all the other clients (run with `manage.py event_relay`).
+# A client that doesn't read fast enough is disconnected once `max_buffer` bytes are waiting for it; its bus
+# reconnects and resyncs, instead of the relay buffering for it without limit.
+class EventRelay:
+    def __init__(self, max_buffer=1024 * 1024):
+        self.max_buffer = max_buffer
+        self._writers = set()
+
+    # Start listening (port 0 picks a free port: see the returned server's sockets).
+    async def start(self, host, port):
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def serve(self, host, port):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while line := await reader.readline():
+                for other in list(self._writers):
+                    if other is writer:
+                        continue
+                    if other.transport.get_write_buffer_size() > self.max_buffer:
+                        logger.warning('Disconnecting an event relay client that is too far behind')
+                        self._writers.discard(other)
+                        other.close()
+                        continue
+                    other.write(line)
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+def create_bus(url, hub):
+    parsed = urlparse(url)
+    if parsed.scheme in ('', 'local'):
+        return LocalEventBus(hub)
+    if parsed.scheme in ('redis', 'rediss', 'unix'):
+        import redis  # Only needed for this bus.
+        return RedisEventBus(hub, redis.Redis.from_url(url))
+    if parsed.scheme == 'relay':
+        return RelayEventBus(hub, parsed.hostname or '127.0.0.1', parsed.port or 7390)
+    raise ValueError(f'Unsupported EVENT_BUS_URL scheme: {parsed.scheme!r}')
@@ -0,0 +1,192 @@
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import transaction
+from django.dispatch import receiver
+
+from . import eventbus
+
+
+# In-process hub that fans room events out to the push connections held by this worker.
+# Views publish from whatever thread they run in; each subscriber is an asyncio queue owned by
+# the event loop serving its WebSocket, so delivery is handed over with call_soon_threadsafe,
+# once per event loop for a whole batch of events and subscribers.
+# Long-polling views block on the hub's condition instead, waiting for the room's sequence to move.
+#
+# Subscriber queues are bounded (EVENT_QUEUE_SIZE): when a slow connection falls that far behind, its backlog
+# is dropped and replaced by a single RESYNC event, telling it to reload the room's state instead. A stalled
+# client thus costs a bounded amount of memory, and never holds up delivery to anyone else.
+#
+# Events published by other worker processes reach the hub through the event bus (see base/eventbus.py).
+class RoomEventHub:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._subscribers = defaultdict(set)  # Maps a room name to the set of (loop, queue) pairs listening to it.
+        self._sequences = {}  # Maps a room name to the number of events published for it by this process.
+        self._published_at = {}  # Maps a room name to when its last event was published (time.monotonic()).
+        self._started = time.monotonic()
+
+    # Register a queue to receive every event published for the given room.
+    def subscribe(self, room_name, loop, queue):
+        with self._lock:
+            self._subscribers[room_name].add((loop, queue))
+
+    # Stop delivering events for the given room to the queue.
+    def unsubscribe(self, room_name, loop, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(room_name)
+            if subscribers is None:
+                return
+            subscribers.discard((loop, queue))
+            if not subscribers:
+                del self._subscribers[room_name]  # Drop empty rooms so the map doesn't grow forever.
+
+    # Return the room's current sequence number, to be passed to wait() after reading the room's state.
+    def sequence(self, room_name):
+        with self._lock:
+            return self._sequences.get(room_name, 0)
+
+    # Seconds since the room's last event (or since this process started, if it had none).
+    def idle_time(self, room_name):
+        with self._lock:
+            return time.monotonic() - self._published_at.get(room_name, self._started)
+
+    # Block until an event is published for the room after `since`, or until the timeout passes.
+    # Returns True if the room changed.
+    def wait(self, room_name, since, timeout):
+        with self._changed:
+            return self._changed.wait_for(lambda: self._sequences.get(room_name, 0) != since, timeout)
+
+    # Same as wait(), for coroutines: waits on the event loop instead of blocking a thread.
+    async def wait_async(self, room_name, since, timeout):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=1)  # Any event wakes it up.
+        self.subscribe(room_name, loop, queue)
+        try:
+            if self.sequence(room_name) != since:
+                return True
+            try:
+                await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return False
+            return True
+        finally:
+            self.unsubscribe(room_name, loop, queue)
+
+    # Deliver an event to every queue subscribed to the room and wake up the long-polls waiting on it.
+    def publish(self, room_name, event):
+        self.publish_many([(room_name, event)])
+
+    # Deliver a batch of (room name, event) pairs, waking each event loop up once for all of them.
+    def publish_many(self, events):
+        deliveries = defaultdict(lambda: defaultdict(list))  # Maps a loop to its queues and the events they get.
+        now = time.monotonic()
+        with self._lock:
+            for room_name, event in events:
+                self._sequences[room_name] = self._sequences.get(room_name, 0) + 1
+                self._published_at[room_name] = now
+                for loop, queue in self._subscribers.get(room_name, ()):
+                    deliveries[loop][queue].append(event)
+            self._changed.notify_all()
+
+        for loop, queues in deliveries.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, queues)
+            except RuntimeError:
+                # The loop was closed under us (worker shutting down); its sockets are gone anyway.
+                pass
+
+    # Tell every subscriber to reload its room's state, after events may have been missed
+    # (e.g. while the event bus was disconnected).
+    def resync_all(self):
+        with self._lock:
+            room_names = list(self._subscribers)
+        self.publish_many([(room_name, RESYNC) for room_name in room_names])
+
+
+# Sent instead of the events a subscriber couldn't keep up with.
+RESYNC = {"type": "resync"}
+
+
+# Runs on a subscriber's event loop: queue the events, replacing the backlog of queues that are full.
+def _deliver(queues):
+    for queue, queued_events in queues.items():
+        for event in queued_events:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(RESYNC)
+                break  # The resync covers the rest of the batch too.
+
+
+# Shared hub for this process.
+hub = RoomEventHub()
+
+# Event bus carrying events to the hubs of the other worker processes (see base/eventbus.py).
+# It is created by the first request a process handles (or the first event it publishes), not when this module is
+# imported: management commands importing the views don't connect to it, and a master process loading the app
+# before forking its workers (gunicorn --preload) doesn't start a listener thread, which wouldn't survive the fork.
+# A process forked after creating it creates its own.
+_bus = None
+_bus_pid = None
+_bus_lock = threading.Lock()
+
+
+def get_bus():
+    global _bus, _bus_pid
+    pid = os.getpid()
+    if _bus_pid != pid:
+        with _bus_lock:
+            if _bus_pid != pid:
+                _bus = eventbus.create_bus(settings.EVENT_BUS_URL, hub)
+                _bus_pid = pid
+    return _bus
+
+
+# Connect a worker to the bus when it starts serving, so it gets the other workers' events before publishing any.
+@receiver(request_started)
+def _connect_bus(**kwargs):
+    get_bus()
+
+
+# Publish an event once the surrounding transaction commits, so listeners never see a change that
+# was rolled back. Outside a transaction this publishes immediately.
+def publish(room_name, event):
+    transaction.on_commit(lambda: get_bus().publish(room_name, event))
+
+
+# Helpers building the roster diffs sent to room clients.
+# Events marked with the "host" audience are only forwarded to the connection of the room's current host.
+def participant_joined(room_name, username, is_host=False):
+    publish(room_name, {"type": "join", "username": username, "is_host": is_host})
+
+
+def member_added(room_name, uid, name):
+    publish(room_name, {"type": "member", "uid": uid, "name": name})  # Lets clients label the member's video without a lookup.
+
+
+def participant_left(room_name, username):
+    publish(room_name, {"type": "leave", "username": username})
+
+
+def host_changed(room_name, username):
+    publish(room_name, {"type": "host", "username": username})  # username is None when the room has no host.
+
+
+def join_request_created(room_name, request_id, username):
+    publish(room_name, {"type": "join_request", "audience": "host", "request_id": request_id, "name": username})
+
+
+def join_request_decided(room_name, request_id, user_id, status):
+    publish(room_name, {
+        "type": "join_request_decided", "audience": "host",
+        "request_id": request_id, "user_id": user_id, "status": status,
+    })
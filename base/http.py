@@ -0,0 +1,10 @@
+from django import http
+
+from .metrics import timed
+
+
+# JsonResponse timing its serialization, for the Server-Timing header and /metrics/ (see base/metrics.py).
+class JsonResponse(http.JsonResponse):
+    def __init__(self, *args, **kwargs):
+        with timed('json'):
+            super().__init__(*args, **kwargs)
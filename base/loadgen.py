@@ -0,0 +1,304 @@
+import http.client
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import defaultdict
+from http.cookies import SimpleCookie
+
+
+# Load generator replaying what the browser client does, against a running server.
+#
+# Every simulated user signs up, opens the lobby and goes through the same requests as lobby.html and
+# streams.js: the host creates the room with get_token and enters it; guests get a token, ask to join and
+# wait in the lobby until the host (who approves every request it sees) lets them in. In the room, each
+# user polls the room every 3 seconds and sends a heartbeat every 15 seconds until the run ends, then leaves.
+#
+# The "current" client is today's: room_snapshot polls revalidated with ETags, and a lobby long-poll.
+# The "legacy" client is the one before them: get_participants every 3 seconds, check_pending_requests
+# every 5 seconds for the host and a 5 second lobby status poll, for comparing the two.
+
+
+ROOM_POLL_INTERVAL = 3
+LEGACY_LOBBY_POLL_INTERVAL = 5
+HEARTBEAT_INTERVAL = 15
+LOBBY_WAIT = 25
+
+# Query count in the Server-Timing header sent by base.middleware.InstrumentationMiddleware (when SERVER_TIMING is on).
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+
+# Latencies, statuses and query counts of every request made during a run, per endpoint.
+class LoadStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)  # Maps an endpoint to the latencies of its requests, in milliseconds.
+        self.errors = defaultdict(int)  # Maps an endpoint to its number of failed requests (5xx or no response).
+        self.queries = defaultdict(int)  # Maps an endpoint to the queries its requests made, as reported by the server.
+
+    def record(self, endpoint, latency_ms, status, queries):
+        with self._lock:
+            self.latencies[endpoint].append(latency_ms)
+            if status is None or status >= 500:
+                self.errors[endpoint] += 1
+            if queries is not None:
+                self.queries[endpoint] += queries
+
+    # Summary of the run: throughput, latency percentiles and histogram, and query rates, overall and per endpoint.
+    def summary(self, duration):
+        with self._lock:
+            endpoints = {name: list(latencies) for name, latencies in self.latencies.items()}
+            errors = dict(self.errors)
+            queries = dict(self.queries)
+
+        def describe(latencies, error_count, query_count):
+            latencies = sorted(latencies)
+            return {
+                'requests': len(latencies),
+                'errors': error_count,
+                'throughput': len(latencies) / duration,
+                'p50_ms': _percentile(latencies, 50),
+                'p90_ms': _percentile(latencies, 90),
+                'p99_ms': _percentile(latencies, 99),
+                'max_ms': latencies[-1] if latencies else 0,
+                'queries_per_request': query_count / len(latencies) if latencies else 0,
+                'queries_per_second': query_count / duration,
+                'histogram': _histogram(latencies),
+            }
+
+        every_latency = [latency for latencies in endpoints.values() for latency in latencies]
+        return {
+            'duration': duration,
+            'total': describe(every_latency, sum(errors.values()), sum(queries.values())),
+            'endpoints': {
+                name: describe(latencies, errors.get(name, 0), queries.get(name, 0))
+                for name, latencies in sorted(endpoints.items())
+            },
+        }
+
+
+def _percentile(ordered, percent):
+    if not ordered:
+        return 0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def _histogram(latencies):
+    counts = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+    for latency in latencies:
+        index = next((i for i, bound in enumerate(HISTOGRAM_BUCKETS_MS) if latency <= bound), len(HISTOGRAM_BUCKETS_MS))
+        counts[index] += 1
+    return dict(zip([f'<={bound}ms' for bound in HISTOGRAM_BUCKETS_MS] + ['>30000ms'], counts))
+
+
+# Readable report of a run summary.
+def report(summary):
+    total = summary['total']
+    lines = [
+        f'{total["requests"]} requests in {summary["duration"]:.1f} s: {total["throughput"]:.1f} req/s, '
+        f'{total["errors"]} errors, {total["queries_per_second"]:.1f} queries/s',
+        '',
+        f'{"endpoint":<28} {"requests":>8} {"errors":>6} {"req/s":>7} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8} {"q/req":>6}',
+    ]
+    for name, stats in summary['endpoints'].items():
+        lines.append(
+            f'{name:<28} {stats["requests"]:>8} {stats["errors"]:>6} {stats["throughput"]:>7.2f} {stats["p50_ms"]:>8.1f} '
+            f'{stats["p90_ms"]:>8.1f} {stats["p99_ms"]:>8.1f} {stats["max_ms"]:>8.1f} {stats["queries_per_request"]:>6.1f}'
+        )
+    lines += ['', 'Latency histogram (all requests):']
+    widest = max(total['histogram'].values()) or 1
+    for bucket, count in total['histogram'].items():
+        lines.append(f'{bucket:>10} {count:>8} {"#" * round(40 * count / widest)}')
+    return '\n'.join(lines)
+
+
+# Minimal browser: keeps cookies and the CSRF token, and records every request it makes.
+# Each request uses a new connection, as gunicorn's sync workers close them anyway.
+class Browser:
+    def __init__(self, base_url, stats, timeout=60):
+        url = urllib.parse.urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = {}
+
+    def request(self, endpoint, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        if method == 'POST' and 'csrftoken' in self.cookies:
+            headers['X-CSRFToken'] = self.cookies['csrftoken']
+
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+        except (OSError, http.client.HTTPException):
+            self.stats.record(endpoint, (time.perf_counter() - start) * 1000, None, None)
+            return None, {}, b''
+        finally:
+            connection.close()
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        for header in response.headers.get_all('Set-Cookie') or []:
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        queries = SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+        self.stats.record(endpoint, latency_ms, response.status, int(queries.group(1)) if queries else None)
+        return response.status, response.headers, content
+
+    def get(self, endpoint, path, headers=None):
+        return self.request(endpoint, 'GET', path, headers=headers)
+
+    def post_json(self, endpoint, path, data):
+        return self.request(endpoint, 'POST', path, json.dumps(data), {'Content-Type': 'application/json'})
+
+    def post_form(self, endpoint, path, data):
+        return self.request(endpoint, 'POST', path, urllib.parse.urlencode(data), {'Content-Type': 'application/x-www-form-urlencoded'})
+
+
+def _json(content):
+    try:
+        return json.loads(content)
+    except ValueError:
+        return {}
+
+
+# One simulated user, running in its own thread until `stop` is set.
+class SimulatedUser(threading.Thread):
+    def __init__(self, base_url, stats, room_name, username, is_host, stop, client='current'):
+        super().__init__(daemon=True)
+        self.browser = Browser(base_url, stats)
+        self.room_name = room_name
+        self.username = username
+        self.is_host = is_host
+        self.stop = stop
+        self.legacy = client == 'legacy'
+        self.etag = None  # ETag of the last room snapshot
+        self.next_pending_poll = 0  # When the legacy host checks its pending requests next
+
+    def run(self):
+        if not self.sign_up():
+            return
+        status, _, content = self.browser.get('lobby', '/lobby?actionType=' + ('host' if self.is_host else 'join'))
+        user_id = re.search(rb'userId = "(\d+)"', content) if status == 200 else None
+        if user_id is None:
+            return
+
+        uid = self.get_token()
+        if uid is None:
+            return
+        if not self.is_host and not self.wait_for_approval(user_id.group(1).decode()):
+            return
+        self.in_room(uid)
+
+    def sign_up(self):
+        self.browser.get('signup', '/signup/')  # Sets the CSRF cookie.
+        password = uuid.uuid4().hex
+        status, _, _ = self.browser.post_form('signup', '/signup/', {
+            'csrfmiddlewaretoken': self.browser.cookies.get('csrftoken', ''),
+            'username': self.username, 'password1': password, 'password2': password,
+        })
+        return status == 302
+
+    # Get a token, retrying while the room doesn't exist yet (its host is still on the way).
+    def get_token(self):
+        action = 'host' if self.is_host else 'join'
+        while not self.stop.is_set():
+            status, _, content = self.browser.get('get_token', f'/get_token/?channel={self.room_name}&actionType={action}')
+            if status == 200:
+                return _json(content).get('uid')
+            self.stop.wait(1)
+        return None
+
+    # Ask to join and wait in the lobby for the host's decision. Returns True once approved.
+    def wait_for_approval(self, user_id):
+        status, _, content = self.browser.post_json('join_room', f'/join_room/{self.room_name}/', {'name': self.username})
+        if _json(content).get('status') == 'approved':
+            return True
+
+        while not self.stop.is_set():
+            if self.legacy:
+                path = f'/check_join_request_status/{self.room_name}/{user_id}/'
+            else:
+                path = f'/check_join_request_status/{self.room_name}/{user_id}/?wait={LOBBY_WAIT}'
+            status, _, content = self.browser.get('check_join_request_status', path)
+            join_status = _json(content).get('join_status')
+            if join_status == 'approved':
+                return True
+            if join_status == 'denied' or status == 404:
+                return False
+            if self.legacy or status != 200:
+                self.stop.wait(LEGACY_LOBBY_POLL_INTERVAL)
+        return False
+
+    def in_room(self, uid):
+        member = {'name': self.username.title(), 'room_name': self.room_name, 'UID': uid}
+        self.browser.get('room', '/room/')
+        self.browser.post_json('create_member', '/create_member/', member)
+        if not self.legacy:
+            self.browser.get('get_member_map', f'/get_member_map/{self.room_name}/')
+
+        next_heartbeat = time.monotonic() + HEARTBEAT_INTERVAL
+        while not self.stop.wait(ROOM_POLL_INTERVAL):
+            pending = self.poll_legacy() if self.legacy else self.poll()
+            for request_id in pending:
+                self.browser.post_json('approve_join_request', f'/approve_join_request/{self.room_name}/{request_id}/', {'approve': True})
+
+            if not self.legacy and time.monotonic() >= next_heartbeat:
+                self.browser.post_json('heartbeat', '/heartbeat/', member)
+                next_heartbeat += HEARTBEAT_INTERVAL
+
+        self.browser.post_json('delete_member', '/delete_member/', member)
+
+    # Poll the room snapshot; returns the ids of the pending join requests the host should answer.
+    def poll(self):
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        status, response_headers, content = self.browser.get('room_snapshot', f'/room_snapshot/{self.room_name}/', headers)
+        if status != 200:
+            return []
+        self.etag = response_headers.get('ETag')
+        return [request['user_id'] for request in _json(content).get('pending_requests', [])]
+
+    def poll_legacy(self):
+        self.browser.get('get_participants', f'/get_participants/{self.room_name}/')
+        if not self.is_host or time.monotonic() < self.next_pending_poll:
+            return []
+        self.next_pending_poll = time.monotonic() + LEGACY_LOBBY_POLL_INTERVAL
+        _, _, content = self.browser.get('check_pending_requests', f'/check_pending_requests/{self.room_name}/')
+        return [request['user_id'] for request in _json(content).get('pending_requests', [])]
+
+
+# Run `rooms` rooms of `users` users (the first one hosting) against the server for `duration` seconds,
+# starting the users evenly over `ramp` seconds. Returns the run summary.
+def run(base_url, rooms, users, duration, ramp=10, client='current'):
+    stats = LoadStats()
+    stop = threading.Event()
+    run_id = uuid.uuid4().hex[:6]
+
+    simulated = []
+    for room in range(rooms):
+        room_name = f'LOAD{run_id}{room}'.upper()
+        for user in range(users):
+            simulated.append(SimulatedUser(base_url, stats, room_name, f'load{run_id}r{room}u{user}', user == 0, stop, client))
+
+    start = time.monotonic()
+    # Hosts first, so guests mostly find their room already open.
+    simulated.sort(key=lambda user: not user.is_host)
+    for user in simulated:
+        user.start()
+        time.sleep(ramp / len(simulated))
+
+    stop.wait(max(0, duration - (time.monotonic() - start)))
+    stop.set()
+    for user in simulated:
+        user.join(LOBBY_WAIT + 35)  # Long enough for a lobby long-poll to come back.
+    return stats.summary(time.monotonic() - start)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from base import bench
+
+
+# Run the endpoint benchmarks (see base/bench.py) at full size, in a throwaway test database.
+class Command(BaseCommand):
+    help = 'Benchmark every endpoint against seeded data and check the query and latency budgets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=2000)
+        parser.add_argument('--participants', type=int, default=20, help='Participants (and members) per room.')
+        parser.add_argument('--pending', type=int, default=5, help='Pending join requests per room.')
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint.')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        databases = setup_databases(verbosity=0, interactive=False)
+        try:
+            data = bench.seed(options['rooms'], options['participants'], options['pending'])
+            results = bench.run(data, iterations=options['iterations'])
+        finally:
+            teardown_databases(databases, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(bench.report(results))
+        violations = [problem for result in results for problem in result.violations()]
+        if violations:
+            raise CommandError('Over budget:\n' + '\n'.join(violations))
@@ -0,0 +1,19 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from base.eventbus import EventRelay
+
+
+# Relay room events between the worker processes of one machine, for EVENT_BUS_URL=relay://HOST:PORT
+# (see base/eventbus.py). Use Redis instead when the workers run on several machines.
+class Command(BaseCommand):
+    help = 'Relay room events between local worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=7390)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Relaying room events on {options['host']}:{options['port']}")
+        asyncio.run(EventRelay().serve(options['host'], options['port']))
@@ -0,0 +1,98 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from base import loadgen
+from base.bench import BENCH_AGORA_CREDENTIALS
+
+
+# Replay the browser client's traffic (see base/loadgen.py) against a server, either one already running
+# (--url) or one started here on a fresh SQLite database, to compare WSGI and ASGI under the same load.
+class Command(BaseCommand):
+    help = 'Simulate rooms of users against a local gunicorn (WSGI) or uvicorn (ASGI) server.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi', help='Server to start (ignored with --url).')
+        parser.add_argument('--url', help='Base URL of an already running server to load instead.')
+        parser.add_argument('--workers', type=int, default=2, help='Worker processes of the started server.')
+        parser.add_argument('--threads', type=int, default=4, help='Threads per gunicorn worker.')
+        parser.add_argument('--port', type=int, default=0, help='Port of the started server (default: any free port).')
+        parser.add_argument('--rooms', type=int, default=10)
+        parser.add_argument('--users', type=int, default=5, help='Users per room, including its host.')
+        parser.add_argument('--duration', type=int, default=60, help='Length of the run, in seconds.')
+        parser.add_argument('--ramp', type=int, default=10, help='Seconds over which the users arrive.')
+        parser.add_argument('--client', choices=['current', 'legacy'], default='current', help='Client behaviour to simulate.')
+        parser.add_argument('--json', dest='json_path', help='Also write the summary to this file, for comparing runs.')
+
+    def handle(self, *args, **options):
+        if options['url']:
+            summary = self.load(options['url'], options)
+        else:
+            with tempfile.TemporaryDirectory() as directory:
+                server = self.start_server(options, directory)
+                try:
+                    summary = self.load(server.url, options)
+                finally:
+                    server.terminate()
+                    server.wait(30)
+
+        self.stdout.write(loadgen.report(summary))
+        if options['json_path']:
+            with open(options['json_path'], 'w') as file:
+                json.dump(summary, file, indent=2)
+
+    def load(self, url, options):
+        self.stdout.write(f'Loading {url} with {options["rooms"]} rooms x {options["users"]} users for {options["duration"]} s...')
+        return loadgen.run(url, options['rooms'], options['users'], options['duration'], options['ramp'], options['client'])
+
+    # Start the server on a new SQLite database in `directory`, reporting query counts in Server-Timing,
+    # and wait until it answers.
+    def start_server(self, options, directory):
+        port = options['port'] or _free_port()
+        env = {
+            **os.environ,
+            'DATABASE_URL': 'sqlite:///' + os.path.join(directory, 'loadgen.sqlite3'),
+            'ALLOWED_HOSTS': '127.0.0.1 localhost',
+            'DEBUG': 'False',
+            'SERVER_TIMING': 'True',
+        }
+        for name, value in BENCH_AGORA_CREDENTIALS.items():
+            env.setdefault(name, value)
+
+        subprocess.run([sys.executable, 'manage.py', 'migrate', '--verbosity', '0'], cwd=settings.BASE_DIR, env=env, check=True)
+
+        if options['server'] == 'wsgi':
+            command = ['gunicorn', 'livecollab.wsgi', '--bind', f'127.0.0.1:{port}',
+                       '--workers', str(options['workers']), '--threads', str(options['threads'])]
+        else:
+            command = ['uvicorn', 'livecollab.asgi:application', '--host', '127.0.0.1', '--port', str(port),
+                       '--workers', str(options['workers'])]
+        server = subprocess.Popen([sys.executable, '-m', *command], cwd=settings.BASE_DIR, env=env)
+        server.url = f'http://127.0.0.1:{port}'
+
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'The {options["server"]} server exited with status {server.returncode}.')
+            try:
+                urllib.request.urlopen(server.url + '/login/', timeout=2).close()
+                return server
+            except (urllib.error.URLError, OSError):
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'The {options["server"]} server did not start within 30 seconds.')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from base.presence import reap
+
+
+# Remove members that stopped sending heartbeats, and the rooms and join requests they leave behind, and give back
+# the UIDs no member joined with.
+# Run it from cron, or keep it running with --interval.
+class Command(BaseCommand):
+    help = 'Remove stale room members, empty rooms and expired join requests, and free unclaimed UIDs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0, help='Keep running, reaping every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            removed = reap()
+            self.stdout.write(', '.join(f'{count} {name}' for name, count in removed.items()))
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,33 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Copy the primary SQLite database to the replica one (DATABASE_REPLICA_URL=sqlite:///...), standing in for
+# replication when trying read-replica routing locally. Keep it running with --interval to get a lagging replica.
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database to the SQLite read replica.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Keep running, copying every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        replica = settings.REPLICA_DATABASE
+        databases = [settings.DATABASES[alias] for alias in ('default', replica) if alias]
+        if len(databases) != 2 or any(database['ENGINE'] != 'django.db.backends.sqlite3' for database in databases):
+            raise CommandError('Needs SQLite primary and replica databases (set DATABASE_REPLICA_URL=sqlite:///...).')
+        primary, replica = (database['NAME'] for database in databases)
+
+        while True:
+            source, target = sqlite3.connect(primary), sqlite3.connect(replica)
+            try:
+                source.backup(target)  # Consistent copy, even while the primary is being written to.
+            finally:
+                source.close()
+                target.close()
+            self.stdout.write(f'Copied {primary} to {replica}')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,196 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates
+
+
+# Per-request timings and per-route histograms.
+#
+# While a request is handled (see base.middleware.InstrumentationMiddleware), a RequestTimings object sits in a
+# context variable; database queries, template rendering and JSON serialization add their time to it, from
+# whichever thread they run in. When the request ends, its timings are added to the histograms of its route.
+#
+# Each thread records into its own shard of the histograms, so recording takes no lock; the /metrics/ endpoint
+# sums the shards of every thread of the worker when it is scraped.
+
+
+# Upper bounds of the histogram buckets.
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# Histograms recorded for every request: name, help text, buckets, and the RequestTimings attribute they observe.
+HISTOGRAMS = (
+    ('livecollab_view_seconds', 'Time spent handling the request in Django.', SECONDS_BUCKETS, 'view'),
+    ('livecollab_db_seconds', 'Time spent in database queries.', SECONDS_BUCKETS, 'db'),
+    ('livecollab_db_queries', 'Number of database queries.', QUERIES_BUCKETS, 'queries'),
+    ('livecollab_template_seconds', 'Time spent rendering templates.', SECONDS_BUCKETS, 'template'),
+    ('livecollab_json_seconds', 'Time spent serializing JSON responses.', SECONDS_BUCKETS, 'json'),
+)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.view = 0.0
+        self.db = 0.0
+        self.queries = 0
+        self.template = 0.0
+        self.json = 0.0
+
+    # Server-Timing header value (durations in milliseconds).
+    def server_timing(self):
+        return (
+            f'view;dur={self.view * 1000:.2f}, db;dur={self.db * 1000:.2f};desc="{self.queries} queries", '
+            f'tpl;dur={self.template * 1000:.2f}, json;dur={self.json * 1000:.2f}'
+        )
+
+
+_current = ContextVar('request_timings', default=None)
+
+
+# Start collecting timings for the current request. Returns the timings and a token for stop_request().
+def start_request():
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def stop_request(token):
+    _current.reset(token)
+
+
+# Add the time spent in the block to the given attribute of the current request's timings.
+@contextmanager
+def timed(attribute):
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timings, attribute, getattr(timings, attribute) + time.perf_counter() - start)
+
+
+# Database execute wrapper timing every query of the current request (installed on each connection in apps.py).
+def record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - start
+        timings.queries += 1
+
+
+# Django template backend timing the rendering of its templates.
+class TimedDjangoTemplates(DjangoTemplates):
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class TimedTemplate:
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return self.template.render(context, request)
+
+
+# Histograms of one thread: maps (histogram name, route) to per-bucket counts (the last one is +Inf),
+# followed by the sum and the count of the observations.
+class _Shard:
+    def __init__(self):
+        self.histograms = {}
+        self.requests = {}  # Maps (route, status) to a request count.
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()  # Only taken when a thread records for the first time, and on scrape.
+        self._local = threading.local()
+        self._shards = []
+        self.collectors = []  # Functions returning more metric lines (in the text format) for render().
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    # Add a finished request's timings to the histograms of its route.
+    def observe(self, route, status, timings):
+        shard = self._shard()
+        for name, _, buckets, attribute in HISTOGRAMS:
+            value = getattr(timings, attribute)
+            histogram = shard.histograms.get((name, route))
+            if histogram is None:
+                histogram = shard.histograms[name, route] = [0] * (len(buckets) + 3)
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+        shard.requests[route, status] = shard.requests.get((route, status), 0) + 1
+
+    # Sum of the shards of every thread.
+    def merged(self):
+        with self._lock:
+            shards = list(self._shards)
+        histograms, requests = {}, {}
+        for shard in shards:
+            for key, values in list(shard.histograms.items()):
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+            for key, count in list(shard.requests.items()):
+                requests[key] = requests.get(key, 0) + count
+        return histograms, requests
+
+    # All metrics in the Prometheus text exposition format.
+    def render(self):
+        histograms, requests = self.merged()
+        lines = []
+        for name, help_text, buckets, _ in HISTOGRAMS:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (histogram_name, route), values in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                label = f'route="{_escape(route)}"'
+                cumulative = 0
+                for bound, count in zip([*buckets, '+Inf'], values):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{label}}} {values[-2]}')
+                lines.append(f'{name}_count{{{label}}} {values[-1]}')
+        lines += ['# HELP livecollab_requests_total Requests handled.', '# TYPE livecollab_requests_total counter']
+        for (route, status), count in sorted(requests.items()):
+            lines.append(f'livecollab_requests_total{{route="{_escape(route)}",status="{status}"}} {count}')
+        for collect in self.collectors:
+            lines += collect()
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self._lock:
+            for shard in self._shards:
+                shard.histograms.clear()
+                shard.requests.clear()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# Shared registry for this process.
+registry = MetricsRegistry()
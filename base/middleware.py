@@ -0,0 +1,120 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from django.conf import settings
+
+from . import metrics, polling, routers
+
+
+# Measures each request (see base/metrics.py): time spent in Django, in database queries (and how many),
+# rendering templates and serializing JSON. Adds them to the histograms of the request's route, served on
+# /metrics/, and sends them to the client in a Server-Timing header when SERVER_TIMING is on.
+# Also counts the requests per second polling hints are stretched by (see base/polling.py).
+# Works with both sync and async views, so it doesn't force async requests through a thread.
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        polling.requests.hit()
+        timings, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.stop_request(token)
+        return self.finish(request, response, timings, start)
+
+    async def __acall__(self, request):
+        polling.requests.hit()
+        timings, token = metrics.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.stop_request(token)
+        return self.finish(request, response, timings, start)
+
+    def finish(self, request, response, timings, start):
+        timings.view = time.perf_counter() - start
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timings.server_timing()
+
+        # Label by URL pattern rather than path, so a route is one series however many rooms there are.
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match else 'unmatched'
+        metrics.registry.observe(route, response.status_code, timings)
+        return response
+
+
+# Tracks whether each request writes to the database (see base/routers.py), and pins the clients of those that do
+# to the primary database for REPLICA_PIN_SECONDS, so their next polls see their change even if the replica lags.
+class ReplicaPinMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, token = routers.start_request(pinned=routers.PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.stop_request(token)
+        return self.finish(state, response)
+
+    async def __acall__(self, request):
+        state, token = routers.start_request(pinned=routers.PIN_COOKIE in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routers.stop_request(token)
+        return self.finish(state, response)
+
+    def finish(self, state, response):
+        if state.wrote and state.pins and settings.REPLICA_DATABASE:
+            response.set_cookie(
+                routers.PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+# WhiteNoise's static file serving, usable in an async middleware chain. WhiteNoise's own middleware is
+# sync-only, which would make Django run every request under ASGI (async views included) through a thread.
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)  # Opens the file.
+        return await self.get_response(request)
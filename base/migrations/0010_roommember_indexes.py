@@ -0,0 +1,38 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+# Keep the oldest row of each (room_name, uid, name) group, so the unique constraint can be created.
+def remove_duplicate_members(apps, schema_editor):
+    db_alias = schema_editor.connection.alias  # The database being migrated.
+    RoomMember = apps.get_model('base', 'RoomMember')
+    keep = models.Min('id')
+    duplicates = (
+        RoomMember.objects.using(db_alias).values('room_name', 'uid', 'name')
+        .annotate(keep=keep, count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        RoomMember.objects.using(db_alias).filter(
+            room_name=duplicate['room_name'], uid=duplicate['uid'], name=duplicate['name'],
+        ).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_room_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_members, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='roommember',
+            index=models.Index(fields=['room_name', 'name'], name='roommember_room_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='roommember',
+            constraint=models.UniqueConstraint(fields=('room_name', 'uid', 'name'), name='unique_room_member'),
+        ),
+    ]
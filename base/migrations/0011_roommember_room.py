@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# First of three steps moving RoomMember from a room name to a foreign key: add the key, nullable. The rows are
+# linked by 0012 and the key made required by 0013, in transactions of their own (PostgreSQL refuses to alter a
+# table with foreign key checks still pending from a data migration in the same transaction).
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_roommember_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='roommember',
+            name='unique_room_member',
+        ),
+        migrations.RemoveIndex(
+            model_name='roommember',
+            name='roommember_room_name_idx',
+        ),
+        migrations.AddField(
+            model_name='roommember',
+            name='room',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='members', to='base.room'),
+        ),
+        migrations.AlterField(
+            model_name='roommember',
+            name='room_name',
+            field=models.CharField(default='', max_length=200),
+        ),
+    ]
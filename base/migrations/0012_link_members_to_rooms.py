@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:20
+
+from django.db import migrations
+
+
+# Point every member at the Room with the same name; members whose room is already gone are orphans and are dropped.
+def link_members_to_rooms(apps, schema_editor):
+    db_alias = schema_editor.connection.alias  # The database being migrated.
+    Room = apps.get_model('base', 'Room')
+    RoomMember = apps.get_model('base', 'RoomMember')
+    for room_id, room_name in Room.objects.using(db_alias).values_list('id', 'room_name'):
+        RoomMember.objects.using(db_alias).filter(room_name=room_name).update(room_id=room_id)
+    RoomMember.objects.using(db_alias).filter(room__isnull=True).delete()
+
+
+def copy_room_names_back(apps, schema_editor):
+    db_alias = schema_editor.connection.alias  # The database being migrated.
+    RoomMember = apps.get_model('base', 'RoomMember')
+    for member in RoomMember.objects.using(db_alias).select_related('room'):
+        member.room_name = member.room.room_name
+        member.save(update_fields=['room_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_roommember_room'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_members_to_rooms, copy_room_names_back),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_link_members_to_rooms'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='roommember',
+            name='room_name',
+        ),
+        migrations.AlterField(
+            model_name='roommember',
+            name='room',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='members', to='base.room'),
+        ),
+        migrations.AddIndex(
+            model_name='roommember',
+            index=models.Index(fields=['room', 'name'], name='roommember_room_name_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='roommember',
+            constraint=models.UniqueConstraint(fields=('room', 'uid', 'name'), name='unique_room_member'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Concurrent join clicks could create several requests for the same user and room; keep the latest one.
+def remove_duplicate_requests(apps, schema_editor):
+    db_alias = schema_editor.connection.alias  # The database being migrated.
+    RoomRequest = apps.get_model('base', 'RoomRequest')
+    duplicates = (
+        RoomRequest.objects.using(db_alias).values('room', 'user')
+        .annotate(keep=models.Max('id'), count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        RoomRequest.objects.using(db_alias).filter(room=duplicate['room'], user=duplicate['user']).exclude(id=duplicate['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0013_roommember_room_required'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_requests, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='roomrequest',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('approved', 'Approved'), ('denied', 'Denied')], db_index=True, default='pending', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='roomrequest',
+            index=models.Index(fields=['room', 'status', 'created_at'], name='roomrequest_room_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='roomrequest',
+            constraint=models.UniqueConstraint(fields=('room', 'user'), name='unique_room_request'),
+        ),
+    ]
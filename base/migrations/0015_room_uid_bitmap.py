@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+# Mark the UIDs already held by members of existing rooms as taken, so new allocations don't collide with them.
+def mark_existing_uids(apps, schema_editor):
+    db_alias = schema_editor.connection.alias  # The database being migrated.
+    Room = apps.get_model('base', 'Room')
+    RoomMember = apps.get_model('base', 'RoomMember')
+    bitmaps = {}
+    for room_id, uid in RoomMember.objects.using(db_alias).values_list('room_id', 'uid'):
+        if uid.isdigit() and int(uid) >= 1:
+            bitmaps[room_id] = bitmaps.get(room_id, 0) | (1 << (int(uid) - 1))
+    for room_id, bits in bitmaps.items():
+        Room.objects.using(db_alias).filter(pk=room_id).update(uid_bitmap=bits.to_bytes((bits.bit_length() + 7) // 8, 'little'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0014_roomrequest_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='uid_bitmap',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(mark_existing_uids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Link existing members to the room participant whose username matches their name, as the kick path does.
+def link_member_users(apps, schema_editor):
+    db_alias = schema_editor.connection.alias  # The database being migrated.
+    RoomMember = apps.get_model('base', 'RoomMember')
+    Room = apps.get_model('base', 'Room')
+    participants = {}
+    for room_id, user_id, username in Room.participants.through.objects.using(db_alias).values_list('room_id', 'user_id', 'user__username'):
+        participants[room_id, username.lower()] = user_id
+    for member in RoomMember.objects.using(db_alias).filter(user__isnull=True):
+        user_id = participants.get((member.room_id, member.name.lower()))
+        if user_id is not None:
+            RoomMember.objects.using(db_alias).filter(pk=member.pk).update(user_id=user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_room_uid_bitmap'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roommember',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='roommember',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='roommember',
+            index=models.Index(fields=['last_seen'], name='roommember_last_seen_idx'),
+        ),
+        migrations.RunPython(link_member_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 15:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0016_roommember_presence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UidAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uid', models.PositiveIntegerField()),
+                ('allocated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uid_allocations', to='base.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['allocated_at'], name='uidallocation_allocated_idx')],
+                'constraints': [models.UniqueConstraint(fields=('room', 'uid'), name='unique_uid_allocation')],
+            },
+        ),
+    ]
@@ -1,12 +1,25 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 
 # Create your models here.
 class RoomMember(models.Model):
     name = models.CharField(max_length=200)  # Field to store the member's name.
     uid = models.CharField(max_length=200)    # Field to store a unique identifier for the member (User ID).
-    room_name = models.CharField(max_length=200)  # Field to store the name of the room the member belongs to.
+    room = models.ForeignKey('Room', on_delete=models.CASCADE, related_name='members')  # Room the member belongs to; members are deleted with it.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='memberships', null=True, blank=True)  # Account the member joined with.
+    last_seen = models.DateTimeField(default=timezone.now)   # Last heartbeat from the member's page; stale members are reaped (see base/presence.py).
+
+    class Meta:
+        constraints = [
+            # One row per member session; also the index for lookups by (room, uid) and (room, uid, name).
+            models.UniqueConstraint(fields=['room', 'uid', 'name'], name='unique_room_member'),
+        ]
+        indexes = [
+            models.Index(fields=['room', 'name'], name='roommember_room_name_idx'),  # Lookups by username within a room.
+            models.Index(fields=['last_seen'], name='roommember_last_seen_idx'),  # The reaper's search for stale members.
+        ]
 
     def __str__(self):
         return self.name  # Returns the member's name when the object is printed or represented. 
@@ -19,17 +32,52 @@ class Room(models.Model):
     token = models.CharField(max_length=255, null=True)                    # Field to store the generated token for the room.
     uid = models.IntegerField(null=True)                                 # Field to store the user ID associated with the room.
     created_at = models.DateTimeField(auto_now_add=True)        # Automatically records the timestamp when the room token is created.
+    version = models.PositiveIntegerField(default=0)             # Bumped on every change to the room's roster, host or join requests (used for ETags).
+    uid_bitmap = models.BinaryField(default=b'')                 # Agora UIDs handed out in this room: bit n set means UID n + 1 is taken (see base/uids.py).
 
     def __str__(self):
         return self.room_name  # Returns the room name when the object is printed or represented.
     
 
 class RoomRequest(models.Model):
+    # Possible states of a join request
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        APPROVED = 'approved', 'Approved'
+        DENIED = 'denied', 'Denied'
+
     room = models.ForeignKey(Room, on_delete=models.CASCADE)  # Link to the Room model
     user = models.ForeignKey(User, on_delete=models.CASCADE)  # Link to the user who is making the request
-    status = models.CharField(max_length=20, default='pending')  # status can be 'pending', 'approved', 'denied'
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING, db_index=True)  # status can be 'pending', 'approved', 'denied'
     created_at = models.DateTimeField(auto_now_add=True)  # Track when the request was made
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'user'], name='unique_room_request'),  # One request per user and room
+        ]
+        indexes = [
+            models.Index(fields=['room', 'status', 'created_at'], name='roomrequest_room_status_idx'),  # The host's queue of pending requests
+        ]
+
     def __str__(self):
         return f"Request from {self.user.username} for room {self.room.room_name} ({self.status})"  # Returns the username, room name and status when the object is printed or represented.
-    
\ No newline at end of file
+    
+
+
+# A UID handed out by get_token that no member has joined with yet. createMember deletes it; the ones left over
+# (guests denied or gone before joining) are given back by the reaper (see base/presence.py).
+class UidAllocation(models.Model):
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='uid_allocations')  # Room whose pool the UID was taken from.
+    uid = models.PositiveIntegerField()  # The UID handed out.
+    allocated_at = models.DateTimeField(default=timezone.now)  # When it was handed out.
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'uid'], name='unique_uid_allocation'),
+        ]
+        indexes = [
+            models.Index(fields=['allocated_at'], name='uidallocation_allocated_idx'),  # The reaper's search for abandoned UIDs.
+        ]
+
+    def __str__(self):
+        return f"UID {self.uid} in room {self.room_id}"  # Returns the UID and room id when the object is printed or represented.
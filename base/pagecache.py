@@ -0,0 +1,64 @@
+import gzip
+import re
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.response import SimpleTemplateResponse
+from django.utils.cache import patch_vary_headers
+
+
+# Whole-page cache for the pages every visitor sees the same way: home, about, contact, and the login and
+# sign-up forms. Their only differences are whether the visitor is logged in (the header's login/logout link)
+# and the CSRF token of their forms. Each page is rendered once per variant with the tokens left empty, and
+# served gzipped from the cache for PAGE_CACHE_TIMEOUT seconds after that, without rendering a template.
+#
+# The tokens are punched back in by the browser: a cached page sets the CSRF cookie, and main.html fills the
+# empty token fields from it (Django accepts the cookie's secret as a form token). Requests with a query string
+# (such as the login page's `?next=`) are rendered normally, since their forms may carry it.
+
+CSRF_INPUT = re.compile(rb'(<input type="hidden" name="csrfmiddlewaretoken" value=")[^"]*(")')
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
+# Response headers not stored with a page: the cookies and the length are the current response's own.
+UNCACHED_HEADERS = {'content-length', 'set-cookie', 'vary'}
+
+
+def _cache_key(request):
+    variant = 'user' if request.user.is_authenticated else 'anonymous'
+    return f'page:{request.path}:{variant}'
+
+
+def cache_page_variant(view):
+    @wraps(view)
+    def inner(request, *args, **kwargs):
+        if (
+            request.method not in ('GET', 'HEAD') or request.GET or not settings.PAGE_CACHE_TIMEOUT
+            or settings.CSRF_COOKIE_HTTPONLY or settings.CSRF_USE_SESSIONS  # The browser couldn't read the token.
+        ):
+            return view(request, *args, **kwargs)
+
+        key = _cache_key(request)
+        page = cache.get(key)
+        if page is None:
+            response = view(request, *args, **kwargs)
+            if isinstance(response, SimpleTemplateResponse):
+                response.render()
+            if response.status_code == 200 and not response.streaming:
+                headers = {name: value for name, value in response.headers.items() if name.lower() not in UNCACHED_HEADERS}
+                cache.set(key, (headers, gzip.compress(CSRF_INPUT.sub(rb'\1\2', response.content))), settings.PAGE_CACHE_TIMEOUT)
+            return response
+
+        headers, body = page
+        get_token(request)  # Sets the CSRF cookie the page's forms are filled from.
+        if ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response = HttpResponse(body, headers=headers)
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(body), headers=headers)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    return inner
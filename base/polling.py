@@ -0,0 +1,90 @@
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+from . import events
+
+
+# Poll-interval hints: every response of a polling endpoint (304s included) carries a Retry-After header telling
+# the client how many seconds to wait before its next poll, and the room pages schedule their polls with it.
+#
+# - Busy rooms are polled every POLL_INTERVAL_MIN seconds. The longer a room goes without an event (see
+#   base/events.py), the longer the hint, up to POLL_INTERVAL_MAX: idle rooms cost a poll every half minute
+#   instead of every few seconds. This needs the hub to see every event: an event bus (EVENT_BUS_URL), or
+#   `local://` for a single process. Without either, events published by other worker processes may never reach
+#   this one's hub, so a busy room could look idle here and its clients would miss changes for up to
+#   POLL_INTERVAL_MAX. Every room is polled every POLL_INTERVAL_MIN seconds then.
+# - When this worker handles more than POLL_LOAD_CAPACITY requests per second, hints are stretched in proportion
+#   (still capped at POLL_INTERVAL_MAX), so polling clients back off and the server sheds load during spikes.
+#
+# Long-polls (`?wait=`) to async views already wait for the room to change, so their hint is 0 unless the server is
+# overloaded. Sync views only wait a couple of seconds (they hold a thread meanwhile), so their clients get the usual hint.
+
+
+# Requests started per second by this process, over a sliding window of about a second.
+class RequestRate:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._second = 0  # Current whole second (of time.monotonic()).
+        self._current = 0  # Requests started during it.
+        self._previous = 0  # Requests started during the second before.
+
+    def _roll(self, second):
+        if second != self._second:
+            self._previous = self._current if second == self._second + 1 else 0
+            self._current = 0
+            self._second = second
+
+    def hit(self):
+        now = time.monotonic()
+        with self._lock:
+            self._roll(int(now))
+            self._current += 1
+
+    def rate(self):
+        now = time.monotonic()
+        with self._lock:
+            self._roll(int(now))
+            # Weigh the previous second by how much of it is still inside the window.
+            return self._current + self._previous * (1 - (now - self._second))
+
+
+# Shared rate for this process, counted by base.middleware.InstrumentationMiddleware.
+requests = RequestRate()
+
+
+# Seconds a client should wait before polling the room again (`waited` for long-polls).
+def poll_delay(room_name, waited=False):
+    if waited:
+        delay = 0
+    elif not settings.EVENT_BUS_URL:
+        delay = settings.POLL_INTERVAL_MIN  # This hub may not see every event.
+    else:
+        delay = max(settings.POLL_INTERVAL_MIN, events.hub.idle_time(room_name) * settings.POLL_IDLE_BACKOFF)
+
+    load = requests.rate() / settings.POLL_LOAD_CAPACITY
+    if load > 1:
+        delay = max(delay, settings.POLL_INTERVAL_MIN) * load
+    return min(round(delay), settings.POLL_INTERVAL_MAX)  # Retry-After takes whole seconds.
+
+
+# Decorator adding the Retry-After hint to the responses of a polling view (sync or async) taking a room_name.
+# Put it above @condition, so answers to unchanged polls get it too.
+def poll_hint(view):
+    def add_hint(response, room_name, waited):
+        response.headers['Retry-After'] = str(poll_delay(room_name, waited))
+        return response
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, room_name, *args, **kwargs):
+            return add_hint(await view(request, room_name, *args, **kwargs), room_name, 'wait' in request.GET)
+    else:
+        @wraps(view)
+        def inner(request, room_name, *args, **kwargs):
+            return add_hint(view(request, room_name, *args, **kwargs), room_name, False)
+
+    return inner
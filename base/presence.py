@@ -0,0 +1,120 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import CharField, Exists, F, OuterRef, Subquery
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from . import events, roomstate
+from .models import Room, RoomMember, RoomRequest, UidAllocation
+from .uids import parse_uid, release_uids
+
+
+# Heartbeat-based presence for room members.
+#
+# Room pages send a heartbeat every few seconds, which only stamps RoomMember.last_seen. Members whose page
+# crashed or lost its network stop sending them, and the reaper (`manage.py reap_rooms`) removes them in bulk
+# together with everything they leave behind: their participant entries, their UIDs, their hosting role,
+# rooms that end up empty and join requests nobody is waiting on anymore. It also gives back the UIDs handed out
+# by get_token that no member joined with (guests denied, or gone from the lobby), once PRESENCE_REQUEST_TIMEOUT
+# has passed: no join request can still be waiting on them then.
+
+
+# Record a heartbeat for a member. Returns False if the member is gone (left, kicked or reaped).
+# Heartbeats arriving soon after the last one written are only acknowledged (see base/roomstate.py).
+def heartbeat(room_name, name, uid):
+    if not roomstate.store.heartbeat_due(room_name, name, uid):
+        return True
+    room_id = Subquery(Room.objects.filter(room_name=room_name).values('pk'))
+    return RoomMember.objects.filter(room_id=room_id, name=name, uid=uid).update(last_seen=timezone.now()) > 0
+
+
+# Remove stale members, participants, rooms and join requests, with a fixed number of set-based queries per step.
+# Returns how many of each were removed.
+def reap(now=None):
+    now = now or timezone.now()
+    member_cutoff = now - timedelta(seconds=settings.PRESENCE_MEMBER_TIMEOUT)
+    room_cutoff = now - timedelta(seconds=settings.PRESENCE_EMPTY_ROOM_GRACE)
+    request_cutoff = now - timedelta(seconds=settings.PRESENCE_REQUEST_TIMEOUT)
+    participants = Room.participants.through.objects
+
+    with transaction.atomic():
+        # Members that stopped sending heartbeats.
+        stale = list(RoomMember.objects.filter(last_seen__lt=member_cutoff).values_list('id', 'room_id', 'uid', 'user_id', 'name'))
+        RoomMember.objects.filter(pk__in=[member_id for member_id, _, _, _, _ in stale]).delete()
+        room_ids = {room_id for _, room_id, _, _, _ in stale}
+        user_ids = {user_id for _, _, _, user_id, _ in stale if user_id is not None}
+
+        # UIDs handed out by get_token long ago that no member holds.
+        allocations = UidAllocation.objects.filter(allocated_at__lt=request_cutoff)
+        taken = RoomMember.objects.filter(room_id=OuterRef('room_id'), uid=Cast(OuterRef('uid'), CharField()))
+        unclaimed = list(allocations.exclude(Exists(taken)).values_list('room_id', 'uid'))
+        allocations.delete()
+
+        rooms = {
+            room.pk: room
+            for room in Room.objects.filter(pk__in=room_ids | {room_id for room_id, _ in unclaimed}).only('id', 'room_name')
+        }
+
+        # Their participant entries, unless the same user is still in the room from another page.
+        still_present = RoomMember.objects.filter(room_id=OuterRef('room_id'), user_id=OuterRef('user_id'))
+        gone = list(
+            participants.filter(room_id__in=room_ids, user_id__in=user_ids)
+            .exclude(Exists(still_present))
+            .values_list('id', 'room_id', 'user__username')
+        )
+        participants.filter(pk__in=[entry_id for entry_id, _, _ in gone]).delete()
+
+        # Hand the rooms whose host left over to their longest-present remaining member, or leave them without a host.
+        host_present = participants.filter(room_id=OuterRef('pk'), user_id=OuterRef('current_host_id'))
+        orphaned = list(
+            Room.objects.filter(pk__in=room_ids, current_host_id__in=user_ids)
+            .exclude(Exists(host_present))
+            .values_list('pk', flat=True)
+        )
+        next_host = RoomMember.objects.filter(room_id=OuterRef('pk'), user__isnull=False).order_by('id').values('user_id')[:1]
+        Room.objects.filter(pk__in=orphaned).update(current_host=Subquery(next_host))
+        Room.objects.filter(pk__in=room_ids).update(version=F('version') + 1)
+        new_hosts = Room.objects.filter(pk__in=orphaned).values_list('room_name', 'current_host__username')
+
+        # Free the UIDs of the reaped members and the unclaimed ones, one update per room.
+        uids = defaultdict(list)
+        for _, room_id, uid, _, _ in stale:
+            uid = parse_uid(uid)
+            if uid is not None:
+                uids[room_id].append(uid)
+        for room_id, uid in unclaimed:
+            uids[room_id].append(uid)
+        for room_id, room_uids in uids.items():
+            release_uids(rooms[room_id], room_uids)
+
+        # Rooms left without members once their grace period is over (including rooms nobody ever joined).
+        has_members = RoomMember.objects.filter(room_id=OuterRef('pk'))
+        empty = Room.objects.filter(created_at__lt=room_cutoff).exclude(Exists(has_members))
+        empty_names = list(empty.values_list('room_name', flat=True)) if roomstate.store.enabled else []
+        _, deleted = empty.delete()
+
+        # Join requests that have been pending for too long.
+        expired = RoomRequest.objects.filter(status=RoomRequest.Status.PENDING, created_at__lt=request_cutoff)
+        expired_rooms = set(expired.values_list('room_id', flat=True))
+        requests_expired, _ = expired.delete()
+        Room.objects.filter(pk__in=expired_rooms).update(version=F('version') + 1)
+
+        # Published once the transaction commits.
+        roomstate.rooms_changed(names=empty_names, ids=room_ids | expired_rooms)
+        roomstate.members_left((rooms[room_id].room_name, name, uid) for _, room_id, uid, _, name in stale if room_id in rooms)
+        for _, room_id, username in gone:
+            events.participant_left(rooms[room_id].room_name, username)
+        for room_name, username in new_hosts:
+            events.host_changed(room_name, username)
+
+    return {
+        'members': len(stale),
+        'participants': len(gone),
+        'hosts': len(orphaned),
+        'rooms': deleted.get(Room._meta.label, 0),
+        'requests': requests_expired,
+        'uids': len(unclaimed),
+    }
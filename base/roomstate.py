@@ -0,0 +1,215 @@
+import threading
+import time
+from urllib.parse import urlparse
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Room
+
+
+# Hot room state shared by every worker process: what polling requests and heartbeats would otherwise read from
+# (or write to) the database on every hit.
+#
+# - Roster versions: each room's id and version, from which the polling endpoints build their ETags. Unchanged
+#   polls are answered with a 304 straight from the store. Writers publish a room's new version once their
+#   transaction commits (rooms_changed()), and a version only ever replaces an older one, so a reader that
+#   loaded a version just before a change can't put it back.
+# - Presence: when each member's heartbeat was last written to the database. Heartbeats arriving within
+#   PRESENCE_WRITE_INTERVAL of the last write are acknowledged without touching the database.
+#
+# The database stays the source of truth: the store only holds copies that can be rebuilt from it, and UID
+# allocations and join requests, which change inside transactions, are still read and written there.
+#
+# Backends are chosen with ROOM_STATE_URL: unset keeps nothing (every read goes to the database), `memory://`
+# keeps the state in this process (only for single-process deployments: other workers wouldn't see its updates),
+# and `redis://...` keeps it in Redis, shared by every worker of every server.
+
+
+# Store keeping nothing: every version lookup misses and every heartbeat is written.
+class RoomStateStore:
+    enabled = False  # Whether the store keeps anything (writers then publish their changes to it).
+    blocking = False  # Whether calls do network I/O (async views then run them in a thread).
+
+    # The room's (id, version), or None if the store doesn't know it.
+    def room_version(self, room_name):
+        return None
+
+    # Record (room name, id, version) triples, keeping each room's newest version.
+    def publish_versions(self, rooms):
+        pass
+
+    def forget_rooms(self, room_names):
+        pass
+
+    # Whether a heartbeat of this member has to be written to the database (it hasn't been in a while).
+    def heartbeat_due(self, room_name, name, uid):
+        return True
+
+    # Make the next heartbeat of these (room name, name, uid) members go to the database.
+    def forget_members(self, members):
+        pass
+
+
+# Store keeping the state in this process.
+class InMemoryRoomState(RoomStateStore):
+    enabled = True
+
+    def __init__(self, ttl, heartbeat_interval):
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self._lock = threading.Lock()
+        self._rooms = {}  # Maps a room name to (id, expiry).
+        self._versions = {}  # Maps a room id to its version.
+        self._heartbeats = {}  # Maps (room name, name, uid) to when the next heartbeat is due.
+
+    def room_version(self, room_name):
+        with self._lock:
+            entry = self._rooms.get(room_name)
+            if entry is None or entry[1] <= time.monotonic():
+                return None
+            version = self._versions.get(entry[0])
+            return None if version is None else (entry[0], version)
+
+    def publish_versions(self, rooms):
+        expiry = time.monotonic() + self.ttl
+        with self._lock:
+            for room_name, pk, version in rooms:
+                self._rooms[room_name] = (pk, expiry)
+                if version > self._versions.get(pk, -1):
+                    self._versions[pk] = version
+
+    def forget_rooms(self, room_names):
+        with self._lock:
+            for room_name in room_names:
+                entry = self._rooms.pop(room_name, None)
+                if entry is not None:
+                    self._versions.pop(entry[0], None)
+
+    def heartbeat_due(self, room_name, name, uid):
+        now = time.monotonic()
+        key = (room_name, name, str(uid))  # Clients send UIDs as strings or numbers.
+        with self._lock:
+            if self._heartbeats.get(key, 0) > now:
+                return False
+            self._heartbeats[key] = now + self.heartbeat_interval
+            if len(self._heartbeats) > 10000:  # Drop members that stopped sending heartbeats.
+                self._heartbeats = {key: due for key, due in self._heartbeats.items() if due > now}
+            return True
+
+    def forget_members(self, members):
+        with self._lock:
+            for room_name, name, uid in members:
+                self._heartbeats.pop((room_name, name, str(uid)), None)
+
+
+# Store keeping the state in Redis, through a redis-py compatible client (`redis.Redis`, or any object with
+# the same get/set/delete/zadd/zscore/zrem methods).
+#
+# room:<name> holds the room's id (expiring after `ttl`, so entries left behind by a deleted room go away),
+# the room_versions sorted set scores each room id with its version (ZADD GT keeps the newest), and
+# heartbeat:<room>:<uid>:<name> exists while the member's last heartbeat write is recent.
+class RedisRoomState(RoomStateStore):
+    enabled = True
+    blocking = True
+
+    def __init__(self, client, ttl, heartbeat_interval, prefix='livecollab:'):
+        self.client = client
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.prefix = prefix
+
+    def _room_key(self, room_name):
+        return f'{self.prefix}room:{room_name}'
+
+    def _heartbeat_key(self, room_name, name, uid):
+        return f'{self.prefix}heartbeat:{room_name}:{uid}:{name}'
+
+    def room_version(self, room_name):
+        pk = self.client.get(self._room_key(room_name))
+        if pk is None:
+            return None
+        version = self.client.zscore(f'{self.prefix}room_versions', pk)
+        return None if version is None else (int(pk), int(version))
+
+    def publish_versions(self, rooms):
+        for room_name, pk, version in rooms:
+            self.client.zadd(f'{self.prefix}room_versions', {str(pk): version}, gt=True)
+            self.client.set(self._room_key(room_name), str(pk), ex=self.ttl)
+
+    def forget_rooms(self, room_names):
+        for room_name in room_names:
+            key = self._room_key(room_name)
+            pk = self.client.get(key)
+            self.client.delete(key)
+            if pk is not None:
+                self.client.zrem(f'{self.prefix}room_versions', pk)
+
+    def heartbeat_due(self, room_name, name, uid):
+        return bool(self.client.set(self._heartbeat_key(room_name, name, uid), '1', nx=True, ex=self.heartbeat_interval))
+
+    def forget_members(self, members):
+        keys = [self._heartbeat_key(*member) for member in members]
+        if keys:
+            self.client.delete(*keys)
+
+
+def create_store(url):
+    scheme = urlparse(url).scheme
+    if not scheme:
+        return RoomStateStore()
+    if scheme == 'memory':
+        return InMemoryRoomState(settings.ROOM_STATE_TTL, settings.PRESENCE_WRITE_INTERVAL)
+    if scheme in ('redis', 'rediss', 'unix'):
+        import redis  # Only needed for this backend.
+        return RedisRoomState(redis.Redis.from_url(url), settings.ROOM_STATE_TTL, settings.PRESENCE_WRITE_INTERVAL)
+    raise ValueError(f'Unsupported ROOM_STATE_URL scheme: {scheme!r}')
+
+
+# Shared store for this process.
+store = create_store(settings.ROOM_STATE_URL)
+
+
+# The room's (id, version): from the store, or from the database (and then stored for the next lookups).
+def room_version(room_name):
+    version = store.room_version(room_name)
+    if version is None:
+        version = Room.objects.filter(room_name=room_name).values_list('pk', 'version').first()
+        if version is not None and store.enabled:
+            store.publish_versions([(room_name, *version)])
+    return version
+
+
+# Async version of room_version().
+async def aroom_version(room_name):
+    version = await sync_to_async(store.room_version)(room_name) if store.blocking else store.room_version(room_name)
+    if version is None:
+        version = await Room.objects.filter(room_name=room_name).values_list('pk', 'version').afirst()
+        if version is not None and store.enabled:
+            published = [(room_name, *version)]
+            await sync_to_async(store.publish_versions)(published) if store.blocking else store.publish_versions(published)
+    return version
+
+
+# Publish the new versions of the given rooms (by name or id) once the current transaction commits.
+# Rooms named here that no longer exist are dropped from the store.
+def rooms_changed(names=(), ids=()):
+    names, ids = set(names), set(ids)
+
+    def publish():
+        rows = list(Room.objects.filter(Q(room_name__in=names) | Q(pk__in=ids)).values_list('room_name', 'pk', 'version'))
+        store.publish_versions(rows)
+        store.forget_rooms(names - {room_name for room_name, _, _ in rows})
+
+    if store.enabled:
+        transaction.on_commit(publish)
+
+
+# Make the next heartbeat of these (room name, name, uid) members go to the database once the current
+# transaction commits, so members that left or were removed get told on their next heartbeat.
+def members_left(members):
+    members = list(members)
+    if store.enabled and members:
+        transaction.on_commit(lambda: store.forget_members(members))
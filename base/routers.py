@@ -0,0 +1,118 @@
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+
+# Read-replica routing (REPLICA_DATABASE, set by DATABASE_REPLICA_URL).
+#
+# Only the polling views marked with @replica_reads read from the replica; everything else, writes included,
+# goes to the primary. Polls are most of the traffic, and can live with the replica's lag, except right after
+# the client's own change (approving a request, changing the host...): it would poll the state from before it.
+# So a request that writes pins its client to the primary: base.middleware.ReplicaPinMiddleware sets a cookie
+# lasting REPLICA_PIN_SECONDS, and the polls of a client holding it read from the primary. Views marked with
+# @no_pin write without pinning: their writes don't change anything the client polls (heartbeats, say), and room
+# pages send them every few seconds, which would keep their clients on the primary for good.
+#
+# The state of the current request sits in a context variable, so it follows async views into the threads
+# their queries run in.
+
+# Cookie pinning a client to the primary.
+PIN_COOKIE = 'primary_pin'
+
+
+class RoutingState:
+    def __init__(self, pinned):
+        self.pinned = pinned  # The client wrote something recently.
+        self.wrote = False  # This request wrote something.
+        self.replica_reads = False  # A view reading from the replica is running.
+        self.pins = True  # This request's writes pin the client (see no_pin).
+
+    @property
+    def use_replica(self):
+        return self.replica_reads and not (self.pinned or self.wrote)
+
+
+_current = ContextVar('routing_state', default=None)
+
+
+# Start routing the current request's queries. Returns the state and a token for stop_request().
+def start_request(pinned):
+    state = RoutingState(pinned)
+    return state, _current.set(state)
+
+
+def stop_request(token):
+    _current.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _current.get()
+        if state is not None and state.use_replica and settings.REPLICA_DATABASE:
+            return settings.REPLICA_DATABASE
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _current.get()
+        if state is not None:
+            state.wrote = True
+        return None
+
+    # Rows read from the replica are the primary's rows.
+    def allow_relation(self, obj1, obj2, **hints):
+        if settings.REPLICA_DATABASE and {obj1._state.db, obj2._state.db} <= {'default', settings.REPLICA_DATABASE}:
+            return True
+        return None
+
+
+# Decorator letting a read-only view (sync or async) read from the replica.
+# Put it under @login_required, so the user is loaded from the primary (a new session may not be replicated yet).
+def replica_reads(view):
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            state = _current.get()
+            if state is None:
+                return await view(request, *args, **kwargs)
+            state.replica_reads = True
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                state.replica_reads = False
+    else:
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            state = _current.get()
+            if state is None:
+                return view(request, *args, **kwargs)
+            state.replica_reads = True
+            try:
+                return view(request, *args, **kwargs)
+            finally:
+                state.replica_reads = False
+
+    return inner
+
+
+# Decorator for a view (sync or async) whose writes don't change what the client reads back: they don't pin it
+# to the primary. The view's own reads still go to the primary.
+def no_pin(view):
+    def unpin():
+        state = _current.get()
+        if state is not None:
+            state.pins = False
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            unpin()
+            return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            unpin()
+            return view(request, *args, **kwargs)
+
+    return inner
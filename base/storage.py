@@ -0,0 +1,14 @@
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+# Static files storage of the static pipeline (STATIC_PIPELINE in settings.py): collectstatic gives every file a
+# content-hashed name and writes gzip and brotli variants next to it (brotli needs the Brotli package), and
+# WhiteNoise serves the hashed names with far-future immutable caching and the smallest variant the browser accepts.
+#
+# Until collectstatic has written the manifest (in a fresh checkout, or when running the tests), files are referred
+# to by their plain names, instead of every {% static %} tag failing.
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
@@ -1,3 +1,1488 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.cache import cache, caches
+from django.db import IntegrityError, connection, connections
+from django.db.models.query import QuerySet
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import include, path
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import RoomMember, Room, RoomRequest, UidAllocation
+from .uids import allocate_uid, claim_uid, release_uid
+from .tokens import TokenCache
+from .presence import reap
+from . import async_views, bench, dbpool, events, polling, roomstate
+from .auth import _cache_key
+from .backends.postgresql.base import reset_connection
+from .routers import PIN_COOKIE
+from .eventbus import EventRelay, LocalEventBus, RedisEventBus, RelayEventBus, create_bus
+from .events import RESYNC, RoomEventHub
+from .loadgen import LoadStats
+from .metrics import registry
+from .middleware import StaticFilesMiddleware
+from .consumers import room_socket
+
+
+# FAST_AUTH as deployed with CACHE_URL, which the query counts of the polling tests assume. A LocMemCache location
+# is shared by the cache instances of a process: it stands in for the workers' shared cache.
+SHARED_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'}}
+fast_auth = override_settings(FAST_AUTH=True, SESSION_ENGINE='django.contrib.sessions.backends.cached_db', CACHES=SHARED_CACHE)
+
+
+# Drives base.consumers.room_socket the way an ASGI server does: `incoming` holds what the browser sends,
+# `sent` what the consumer sends back.
+class SocketClient:
+    def __init__(self, cookie, room_name='ROOM'):
+        self.scope = {'type': 'websocket', 'path': f'/ws/rooms/{room_name}/', 'headers': [(b'cookie', cookie.encode())]}
+        self.room_name = room_name
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue()
+        self.task = None
+
+    # Open the socket; returns the consumer's answer (websocket.accept or websocket.close).
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        self.task = asyncio.ensure_future(room_socket(self.scope, self.incoming.get, self.sent.put, self.room_name))
+        return await self.receive()
+
+    async def receive(self):
+        return await asyncio.wait_for(self.sent.get(), 5)
+
+    async def receive_json(self):
+        message = await self.receive()
+        assert message['type'] == 'websocket.send', message
+        return json.loads(message['text'])
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+# Runs on committed data, since the views publish their events when their transaction commits.
+class RoomSocketTests(TransactionTestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.guest = User.objects.create_user('guest')
+        self.stranger = User.objects.create_user('stranger')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        self.room.participants.add(self.host, self.guest)
+        RoomMember.objects.create(name='Host', uid='1', room=self.room, user=self.host)
+
+    # Session cookie of a logged-in user, as the browser sends it with the handshake.
+    def cookie(self, user):
+        client = Client()
+        client.force_login(user)
+        return f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+
+    async def open_socket(self, user):
+        socket = SocketClient(await sync_to_async(self.cookie)(user))
+        self.assertEqual(await socket.connect(), {'type': 'websocket.accept'})
+        return socket
+
+    async def post(self, user, path, data):
+        client = Client()
+        await sync_to_async(client.force_login)(user)
+        return await sync_to_async(client.post)(path, json.dumps(data), content_type='application/json')
+
+    async def test_sends_roster_on_connect(self):
+        socket = await self.open_socket(self.guest)
+        self.assertEqual(await socket.receive_json(), {'type': 'roster', 'participants': [
+            {'username': 'host', 'is_host': True},
+            {'username': 'guest', 'is_host': False},
+        ]})
+        await socket.disconnect()
+
+    async def test_sends_roster_diffs(self):
+        socket = await self.open_socket(self.guest)
+        await socket.receive_json()
+
+        await self.post(self.guest, '/create_member/', {'name': 'Guest', 'UID': '2', 'room_name': 'ROOM'})
+        self.assertEqual(await socket.receive_json(), {'type': 'join', 'username': 'guest', 'is_host': False})
+        self.assertEqual(await socket.receive_json(), {'type': 'member', 'uid': '2', 'name': 'Guest'})
+
+        await self.post(self.host, '/delete_member/', {'name': 'Host', 'UID': '1', 'room_name': 'ROOM'})
+        self.assertEqual(await socket.receive_json(), {'type': 'leave', 'username': 'host'})
+        self.assertEqual(await socket.receive_json(), {'type': 'host', 'username': None})
+        await socket.disconnect()
+
+    async def test_pending_requests_go_to_the_host_only(self):
+        waiting = await User.objects.acreate(username='waiting')
+        host_socket = await self.open_socket(self.host)
+        guest_socket = await self.open_socket(self.guest)
+        await host_socket.receive_json()
+        self.assertEqual(await host_socket.receive_json(), {'type': 'pending_requests', 'pending_requests': []})
+        await guest_socket.receive_json()
+
+        await self.post(waiting, '/join_room/ROOM/', {})
+        join_request = await RoomRequest.objects.aget(user=waiting)
+        self.assertEqual(await host_socket.receive_json(), {
+            'type': 'join_request', 'audience': 'host', 'request_id': join_request.pk, 'name': 'waiting',
+        })
+
+        await self.post(self.host, f'/approve_join_request/ROOM/{join_request.pk}/', {'approve': True})
+        self.assertEqual((await host_socket.receive_json())['type'], 'join')
+        self.assertEqual((await host_socket.receive_json())['type'], 'join_request_decided')
+
+        # The guest got the public event only: the next thing it receives is this marker.
+        events.hub.publish('ROOM', {'type': 'marker'})
+        self.assertEqual(await guest_socket.receive_json(), {'type': 'join', 'username': 'waiting', 'is_host': False})
+        self.assertEqual(await guest_socket.receive_json(), {'type': 'marker'})
+        await host_socket.disconnect()
+        await guest_socket.disconnect()
+
+    async def test_new_host_gets_pending_requests(self):
+        waiting = await User.objects.acreate(username='waiting')
+        join_request = await RoomRequest.objects.acreate(room=self.room, user=waiting)
+        guest_socket = await self.open_socket(self.guest)
+        await guest_socket.receive_json()
+
+        await self.post(self.host, '/change_host/', {'name': 'guest', 'room_name': 'ROOM'})
+        self.assertEqual(await guest_socket.receive_json(), {'type': 'host', 'username': 'guest'})
+        self.assertEqual(await guest_socket.receive_json(), {
+            'type': 'pending_requests', 'pending_requests': [{'name': 'waiting', 'user_id': join_request.pk}],
+        })
+        await guest_socket.disconnect()
+
+    async def test_rejects_anonymous_sockets(self):
+        socket = SocketClient(f'{settings.SESSION_COOKIE_NAME}=unknown')
+        self.assertEqual(await socket.connect(), {'type': 'websocket.close', 'code': 4401})
+
+    async def test_rejects_non_members(self):
+        socket = SocketClient(await sync_to_async(self.cookie)(self.stranger))
+        self.assertEqual(await socket.connect(), {'type': 'websocket.close', 'code': 4403})
+
+    async def test_rejects_unknown_rooms(self):
+        socket = SocketClient(await sync_to_async(self.cookie)(self.guest), room_name='MISSING')
+        self.assertEqual(await socket.connect(), {'type': 'websocket.close', 'code': 4404})
+
+
+class PollETagTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.guest = User.objects.create_user('guest')
+        self.waiting = User.objects.create_user('waiting')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        self.room.participants.add(self.host, self.guest)
+        self.join_request = RoomRequest.objects.create(room=self.room, user=self.waiting)
+
+    # Poll `path` as `user`, then poll again with the ETag it got; returns both responses.
+    def poll_twice(self, user, path):
+        self.client.force_login(user)
+        first = self.client.get(path)
+        return first, self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_unchanged_polls_are_not_modified(self):
+        for user, path in (
+            (self.guest, '/get_participants/ROOM/'),
+            (self.host, '/check_pending_requests/ROOM/'),
+            (self.waiting, f'/check_join_request_status/ROOM/{self.waiting.pk}/'),
+        ):
+            with self.subTest(path=path):
+                first, second = self.poll_twice(user, path)
+                self.assertEqual(first.status_code, 200)
+                self.assertEqual(second.status_code, 304)
+                self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_polls_after_a_change_get_the_new_state(self):
+        participants, _ = self.poll_twice(self.guest, '/get_participants/ROOM/')
+        status, _ = self.poll_twice(self.waiting, f'/check_join_request_status/ROOM/{self.waiting.pk}/')
+
+        self.client.force_login(self.host)
+        self.client.post(f'/approve_join_request/ROOM/{self.join_request.pk}/', json.dumps({'approve': True}), content_type='application/json')
+
+        self.client.force_login(self.guest)
+        response = self.client.get('/get_participants/ROOM/', HTTP_IF_NONE_MATCH=participants['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], participants['ETag'])
+        self.assertIn({'username': 'waiting', 'is_host': False}, response.json()['participants'])
+
+        self.client.force_login(self.waiting)
+        response = self.client.get(f'/check_join_request_status/ROOM/{self.waiting.pk}/', HTTP_IF_NONE_MATCH=status['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], status['ETag'])
+        self.assertEqual(response.json()['join_status'], 'approved')
+
+    def test_host_and_guests_get_different_etags(self):
+        host_poll, _ = self.poll_twice(self.host, '/check_pending_requests/ROOM/')
+        guest_poll, _ = self.poll_twice(self.guest, '/check_pending_requests/ROOM/')
+        self.assertNotEqual(host_poll['ETag'], guest_poll['ETag'])
+
+        # The guest's copy (no pending requests) is never taken for the host's.
+        self.client.force_login(self.host)
+        response = self.client.get('/check_pending_requests/ROOM/', HTTP_IF_NONE_MATCH=guest_poll['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['pending_requests']), 1)
+
+
+# Checks that the RoomMember lookups made by the member views are served by an index rather than a table scan.
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Query plans are checked with SQLite\'s EXPLAIN QUERY PLAN')
+class RoomMemberQueryPlanTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.client.force_login(self.user)
+
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.user)
+        self.room.participants.add(self.user)
+
+        # Enough unrelated members that SQLite's planner would notice a scan.
+        others = Room.objects.bulk_create(Room(room_name=f'OTHER{i}') for i in range(50))
+        RoomMember.objects.bulk_create(
+            RoomMember(name=f'User{i}', uid=str(i), room=others[i % 50]) for i in range(500)
+        )
+        RoomMember.objects.create(name='Alice', uid='7', room=self.room)
+        RoomMember.objects.create(name='Bob', uid='8', room=self.room)
+
+    # Run a view and return the plan of every statement it issued against the RoomMember table.
+    def member_query_plans(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'get':
+                response = self.client.get(path, data)
+            else:
+                response = self.client.post(path, json.dumps(data), content_type='application/json')
+        self.assertLess(response.status_code, 400, response.content)
+
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries.captured_queries:
+                sql = query['sql']
+                if 'base_roommember' not in sql or sql.startswith('INSERT'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plans.append((sql, ' / '.join(row[-1] for row in cursor.fetchall())))
+        self.assertTrue(plans, 'The view did not query RoomMember')
+        return plans
+
+    def assertIndexed(self, plans):
+        for sql, plan in plans:
+            self.assertNotRegex(plan, r'SCAN (base_roommember|TABLE base_roommember)\b', f'{sql}\n{plan}')
+            self.assertRegex(plan, r'USING (COVERING )?INDEX|USING INTEGER PRIMARY KEY', f'{sql}\n{plan}')
+
+    def test_get_member(self):
+        self.assertIndexed(self.member_query_plans('get', '/get_member/', {'UID': '7', 'room_name': 'ROOM'}))
+
+    def test_get_uid_by_username(self):
+        self.assertIndexed(self.member_query_plans('get', '/get_uid_by_username/', {'username': 'Alice', 'room_name': 'ROOM'}))
+
+    def test_create_member(self):
+        self.assertIndexed(self.member_query_plans('post', '/create_member/', {'name': 'Alice', 'UID': '9', 'room_name': 'ROOM'}))
+
+    def test_delete_member(self):
+        self.assertIndexed(self.member_query_plans('post', '/delete_member/', {'name': 'Alice', 'UID': '7', 'room_name': 'ROOM'}))
+
+    def test_remove_participant_by_name(self):
+        User.objects.create_user('bob')
+        self.assertIndexed(self.member_query_plans('post', '/remove_participant_by_name/', {'name': 'Bob', 'UID': '8', 'room_name': 'ROOM'}))
+
+
+class RoomRequestConstraintTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.guest = User.objects.create_user('guest')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        self.room.participants.add(self.host)
+        self.client.force_login(self.guest)
+
+    def test_one_request_per_room_and_user(self):
+        RoomRequest.objects.create(room=self.room, user=self.guest)
+        with self.assertRaises(IntegrityError):
+            RoomRequest.objects.create(room=self.room, user=self.guest, status=RoomRequest.Status.DENIED)
+
+    def test_repeated_join_keeps_one_request(self):
+        first = self.client.post('/join_room/ROOM/')
+        second = self.client.post('/join_room/ROOM/')
+        self.assertEqual(first.json()['message'], 'Waiting for host approval')
+        self.assertEqual(second.json()['message'], 'Already waiting for host approval')
+        self.assertEqual(RoomRequest.objects.filter(room=self.room, user=self.guest).count(), 1)
+
+    # A concurrent join inserts the row between get_or_create's lookup and its insert: the insert hits the
+    # constraint, and get_or_create returns the other join's row instead of failing.
+    def test_duplicate_join_falls_back_to_the_existing_request(self):
+        existing = RoomRequest.objects.create(room=self.room, user=self.guest)
+        original_get = QuerySet.get
+        lookups = []
+
+        def get(queryset, *args, **kwargs):
+            if queryset.model is RoomRequest and not lookups:
+                lookups.append(kwargs)
+                raise RoomRequest.DoesNotExist  # The lookup ran before the other join's insert.
+            return original_get(queryset, *args, **kwargs)
+
+        with mock.patch.object(QuerySet, 'get', get):
+            response = self.client.post('/join_room/ROOM/')
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(response.json()['message'], 'Already waiting for host approval')
+        self.assertEqual(list(RoomRequest.objects.filter(room=self.room, user=self.guest)), [existing])
+
+
+class UidAllocatorTests(TestCase):
+    def setUp(self):
+        self.room = Room.objects.create(room_name='ROOM')
+
+    def test_allocates_distinct_uids(self):
+        uids = [allocate_uid(self.room) for _ in range(300)]
+        self.assertEqual(uids, list(range(1, 301)))
+
+    def test_released_uid_is_reused_first(self):
+        for _ in range(5):
+            allocate_uid(self.room)
+        release_uid(self.room, 3)
+        self.assertEqual(allocate_uid(self.room), 3)
+        self.assertEqual(allocate_uid(self.room), 6)
+
+    def test_claimed_uid_is_skipped(self):
+        claim_uid(self.room, 1)
+        self.assertEqual(allocate_uid(self.room), 2)
+
+    def test_rooms_have_separate_pools(self):
+        other = Room.objects.create(room_name='OTHER')
+        self.assertEqual(allocate_uid(self.room), 1)
+        self.assertEqual(allocate_uid(other), 1)
+
+    @mock.patch.dict(os.environ, {'AGORA_APP_ID': '0' * 32, 'AGORA_APP_CERTIFICATE': '1' * 32})
+    def test_get_token_hands_out_unique_uids(self):
+        host = User.objects.create_user('host')
+        self.client.force_login(host)
+        host_uid = self.client.get('/get_token/', {'channel': 'MEETING', 'actionType': 'host'}).json()['uid']
+
+        guests = []
+        for i in range(20):
+            self.client.force_login(User.objects.create_user(f'guest{i}'))
+            guests.append(self.client.get('/get_token/', {'channel': 'MEETING', 'actionType': 'join'}).json()['uid'])
+
+        self.assertEqual(len({host_uid, *guests}), 21)
+
+    @mock.patch('base.views.RtcTokenBuilder.buildTokenWithUid', side_effect=ValueError('bad certificate'))
+    def test_failed_token_build_leaves_nothing_behind(self, build):
+        self.client.force_login(User.objects.create_user('host'))
+        with self.assertRaises(ValueError):
+            self.client.get('/get_token/', {'channel': 'MEETING', 'actionType': 'host'})
+        self.assertFalse(Room.objects.filter(room_name='MEETING').exists())
+
+        with self.assertRaises(ValueError):
+            self.client.get('/get_token/', {'channel': 'ROOM', 'actionType': 'join'})
+        self.assertEqual(allocate_uid(self.room), 1)  # The UID taken for the failed token was given back.
+
+
+class TokenCacheTests(TestCase):
+    def build(self, privilege_expired_ts):
+        self.built += 1
+        return f'token{self.built}'
+
+    def setUp(self):
+        self.built = 0
+        self.cache = TokenCache(max_size=2, refresh_margin=60)
+
+    def test_reuses_valid_token(self):
+        first = self.cache.get_or_build('ROOM', 1, 1, 3600, self.build)
+        self.assertEqual(self.cache.get_or_build('ROOM', 1, 1, 3600, self.build), first)
+        self.assertEqual(self.cache.get_or_build('ROOM', 2, 1, 3600, self.build), 'token2')
+        self.assertEqual(self.cache.stats(), {'hits': 1, 'misses': 2, 'evictions': 0, 'size': 2})
+
+    def test_counters_are_exported(self):
+        with mock.patch('base.tokens.token_cache', self.cache):
+            self.cache.get_or_build('ROOM', 1, 1, 86400, self.build)
+            self.cache.get_or_build('ROOM', 1, 1, 86400, self.build)
+            text = registry.render()
+        self.assertIn('livecollab_token_cache_hits_total 1\n', text)
+        self.assertIn('livecollab_token_cache_misses_total 1\n', text)
+        self.assertIn('livecollab_token_cache_size 1\n', text)
+
+    def test_rebuilds_token_near_expiry(self):
+        self.cache.get_or_build('ROOM', 1, 1, 30, self.build)  # Expires within the refresh margin.
+        self.assertEqual(self.cache.get_or_build('ROOM', 1, 1, 3600, self.build), 'token2')
+
+    def test_evicts_least_recently_used(self):
+        self.cache.get_or_build('ROOM', 1, 1, 3600, self.build)
+        self.cache.get_or_build('ROOM', 2, 1, 3600, self.build)
+        self.cache.get_or_build('ROOM', 1, 1, 3600, self.build)  # Refreshes UID 1, so UID 2 is evicted next.
+        self.cache.get_or_build('ROOM', 3, 1, 3600, self.build)
+        self.assertEqual(self.cache.get_or_build('ROOM', 1, 1, 3600, self.build), 'token1')
+        self.assertEqual(self.cache.get_or_build('ROOM', 2, 1, 3600, self.build), 'token4')
+        self.assertEqual(self.cache.stats()['evictions'], 2)
+
+
+@fast_auth
+class MemberLookupTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('alice'))
+        room = Room.objects.create(room_name='ROOM')
+        other = Room.objects.create(room_name='OTHER')
+        RoomMember.objects.bulk_create([
+            RoomMember(name='Alice', uid='1', room=room),
+            RoomMember(name='Bob', uid='2', room=room),
+            RoomMember(name='Carol', uid='3', room=room),
+            RoomMember(name='Dave', uid='1', room=other),
+        ])
+
+    def test_get_members_returns_requested_uids_in_one_query(self):
+        with self.assertNumQueries(2):  # User (the session is cached), members.
+            response = self.client.get('/get_members/', {'room_name': 'ROOM', 'UID': ['1', '3', '9']})
+        self.assertEqual(response.json(), {'members': {'1': 'Alice', '3': 'Carol'}})
+
+    def test_get_member_map_returns_whole_room(self):
+        response = self.client.get('/get_member_map/ROOM/')
+        self.assertEqual(response.json(), {'members': {'1': 'Alice', '2': 'Bob', '3': 'Carol'}})
+
+
+@fast_auth
+class RoomSnapshotTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        guests = [User.objects.create_user(f'guest{i}') for i in range(20)]
+        self.room.participants.add(self.host, *guests)
+        RoomMember.objects.bulk_create(
+            RoomMember(name=user.username.title(), uid=str(i + 1), room=self.room) for i, user in enumerate([self.host, *guests])
+        )
+        for i in range(5):
+            RoomRequest.objects.create(room=self.room, user=User.objects.create_user(f'waiting{i}'))
+
+    def test_host_snapshot_has_everything_in_fixed_queries(self):
+        self.client.force_login(self.host)
+        with self.assertNumQueries(6):  # User, room ETag, room, participants, members, pending requests.
+            data = self.client.get('/room_snapshot/ROOM/').json()
+        self.assertTrue(data['is_host'])
+        self.assertEqual(len(data['participants']), 21)
+        self.assertEqual(len(data['members']), 21)
+        self.assertEqual(len(data['pending_requests']), 5)
+        self.assertEqual(data['version'], 0)
+
+    def test_guest_snapshot_has_no_pending_requests(self):
+        self.client.force_login(User.objects.get(username='guest0'))
+        with self.assertNumQueries(5):
+            data = self.client.get('/room_snapshot/ROOM/').json()
+        self.assertFalse(data['is_host'])
+        self.assertEqual(data['pending_requests'], [])
+
+    def test_unchanged_snapshot_is_not_modified(self):
+        self.client.force_login(self.host)
+        etag = self.client.get('/room_snapshot/ROOM/')['ETag']
+        with self.assertNumQueries(1):  # Room ETag (session and user are cached).
+            response = self.client.get('/room_snapshot/ROOM/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+@fast_auth
+class LeaveRoomTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.guest = User.objects.create_user('guest')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host, uid_bitmap=b'\x07')
+        self.room.participants.add(self.host, self.guest)
+        RoomMember.objects.bulk_create([
+            RoomMember(name='Host', uid='1', room=self.room),
+            RoomMember(name='Guest', uid='2', room=self.room),
+            RoomMember(name='Other', uid='3', room=self.room),
+        ])
+
+    def leave(self, user, name, uid):
+        self.client.force_login(user)
+        return self.client.post('/delete_member/', json.dumps({'name': name, 'UID': uid, 'room_name': 'ROOM'}), content_type='application/json')
+
+    def test_leave_runs_in_fixed_queries(self):
+        self.client.force_login(self.guest)
+        with self.assertNumQueries(8):  # User, savepoint, room, member, participant, members left, room update, release.
+            response = self.client.post('/delete_member/', json.dumps({'name': 'Guest', 'UID': '2', 'room_name': 'ROOM'}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.version, 1)
+        self.assertEqual(bytes(self.room.uid_bitmap), b'\x05')
+        self.assertEqual(list(self.room.participants.all()), [self.host])
+
+    def test_leave_is_idempotent(self):
+        self.leave(self.guest, 'Guest', '2')
+        response = self.leave(self.guest, 'Guest', '2')
+        self.assertEqual(response.status_code, 200)
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.version, 1)  # The repeated leave changed nothing.
+
+    def test_host_leaving_clears_host(self):
+        self.leave(self.host, 'Host', '1')
+        self.room.refresh_from_db()
+        self.assertIsNone(self.room.current_host)
+
+    def test_kick_removes_participant_by_name(self):
+        self.client.force_login(self.host)
+        for _ in range(2):
+            response = self.client.post('/remove_participant_by_name/', json.dumps({'name': 'GUEST', 'UID': '2', 'room_name': 'ROOM'}), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.room.participants.filter(pk=self.guest.pk).exists())
+
+    def test_last_leave_deletes_room(self):
+        self.leave(self.host, 'Host', '1')
+        self.leave(self.guest, 'Guest', '2')
+        self.leave(self.guest, 'Other', '3')
+        self.assertFalse(Room.objects.filter(room_name='ROOM').exists())
+        self.assertEqual(self.leave(self.guest, 'Other', '3').status_code, 200)
+
+
+# Runs the test class on a file copy of the SQLite test database. The test database lives in memory, shared
+# between threads through SQLite's shared cache, whose table locks fail at once instead of waiting for the busy
+# timeout, and which has no write-ahead log: tests racing writers from several threads, or checking the file
+# pragmas, need a file.
+class FileDatabaseMixin:
+    @classmethod
+    def setUpClass(cls):
+        cls.memory_database = None
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            cls.database_directory = tempfile.TemporaryDirectory()
+            path = os.path.join(cls.database_directory.name, 'test.sqlite3')
+            connection.ensure_connection()
+            copy = sqlite3.connect(path)
+            connection.connection.backup(copy)
+            copy.close()
+            # Set the in-memory database aside (closing its last connection would drop it) and point at the copy.
+            cls.memory_database = (connection.settings_dict['NAME'], connection.connection)
+            connection.connection = None
+            connection.settings_dict['NAME'] = path
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if cls.memory_database is not None:
+            connection.close()
+            connection.settings_dict['NAME'], connection.connection = cls.memory_database
+            cls.database_directory.cleanup()
+
+
+# Runs on a real database connection per thread, so the leaves genuinely race each other.
+class ConcurrentLeaveTests(FileDatabaseMixin, TransactionTestCase):
+    def test_simultaneous_leaves_empty_the_room(self):
+        users = [User.objects.create_user(f'user{i}') for i in range(12)]
+        room = Room.objects.create(room_name='ROOM', current_host=users[0])
+        room.participants.add(*users)
+        RoomMember.objects.bulk_create(RoomMember(name=user.username, uid=str(i + 1), room=room) for i, user in enumerate(users))
+
+        barrier = threading.Barrier(len(users) * 2)
+        statuses = []
+
+        def leave(user, uid):
+            client = Client()
+            client.force_login(user)
+            barrier.wait()
+            try:
+                response = client.post('/delete_member/', json.dumps({'name': user.username, 'UID': uid, 'room_name': 'ROOM'}), content_type='application/json')
+                statuses.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        # Every user leaves twice at once, as the leave button and the page unload both do.
+        threads = [threading.Thread(target=leave, args=(user, str(i + 1))) for i, user in enumerate(users) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [200] * len(threads))
+        self.assertFalse(Room.objects.exists())
+        self.assertFalse(RoomMember.objects.exists())
+        self.assertFalse(Room.participants.through.objects.exists())
+
+
+# The lobby's long-poll through the sync view, held in a thread while the host approves from another connection.
+class JoinStatusLongPollTests(TransactionTestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.waiting = User.objects.create_user('waiting')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        self.room.participants.add(self.host)
+        self.join_request = RoomRequest.objects.create(room=self.room, user=self.waiting)
+        self.path = f'/check_join_request_status/ROOM/{self.waiting.pk}/'
+
+    def test_long_poll_returns_when_the_host_approves(self):
+        answers = []
+
+        def poll():
+            client = Client()
+            client.force_login(self.waiting)
+            try:
+                answers.append((client.get(self.path, {'wait': '25'}), time.monotonic()))
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=poll)
+        thread.start()
+        time.sleep(0.3)
+        self.client.force_login(self.host)
+        approved_at = time.monotonic()
+        self.client.post(f'/approve_join_request/ROOM/{self.join_request.pk}/', json.dumps({'approve': True}), content_type='application/json')
+        thread.join(5)
+
+        response, answered_at = answers[0]
+        self.assertEqual(response.json()['join_status'], 'approved')
+        self.assertLess(answered_at - approved_at, 1)  # Woken by the approval, not the periodic recheck.
+
+    @mock.patch('base.views.JOIN_STATUS_MAX_SYNC_WAIT', 0.1)
+    def test_sync_wait_is_clamped(self):
+        self.client.force_login(self.waiting)
+        start = time.monotonic()
+        response = self.client.get(self.path, {'wait': '25'})
+        self.assertEqual(response.json()['join_status'], 'pending')
+        self.assertLess(time.monotonic() - start, 1)
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.guest = User.objects.create_user('guest')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host, uid_bitmap=b'\x03')
+        self.room.participants.add(self.host, self.guest)
+        self.host_member = RoomMember.objects.create(name='Host', uid='1', room=self.room, user=self.host)
+        self.guest_member = RoomMember.objects.create(name='Guest', uid='2', room=self.room, user=self.guest)
+        Room.objects.filter(pk=self.room.pk).update(created_at=timezone.now() - timedelta(hours=1))
+
+    def make_stale(self, *members):
+        RoomMember.objects.filter(pk__in=[member.pk for member in members]).update(last_seen=timezone.now() - timedelta(minutes=5))
+
+    def test_heartbeat_keeps_member_alive(self):
+        self.make_stale(self.guest_member)
+        self.client.force_login(self.guest)
+        response = self.client.post('/heartbeat/', json.dumps({'name': 'Guest', 'UID': '2', 'room_name': 'ROOM'}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(reap()['members'], 0)
+
+    def test_heartbeat_for_removed_member_is_not_found(self):
+        self.client.force_login(self.guest)
+        response = self.client.post('/heartbeat/', json.dumps({'name': 'Guest', 'UID': '9', 'room_name': 'ROOM'}), content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_stale_host_is_replaced(self):
+        self.make_stale(self.host_member)
+        self.assertEqual(reap(), {'members': 1, 'participants': 1, 'hosts': 1, 'rooms': 0, 'requests': 0, 'uids': 0})
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.current_host, self.guest)
+        self.assertEqual(list(self.room.participants.all()), [self.guest])
+        self.assertEqual(bytes(self.room.uid_bitmap), b'\x02')
+        self.assertEqual(self.room.version, 1)
+
+    def test_room_left_empty_is_deleted(self):
+        self.make_stale(self.host_member, self.guest_member)
+        self.assertEqual(reap()['rooms'], 1)
+        self.assertFalse(Room.objects.exists())
+
+    def test_new_empty_room_is_kept(self):
+        Room.objects.create(room_name='NEW')
+        reap()
+        self.assertTrue(Room.objects.filter(room_name='NEW').exists())
+
+    def test_old_pending_requests_expire(self):
+        waiting = RoomRequest.objects.create(room=self.room, user=User.objects.create_user('waiting'))
+        RoomRequest.objects.filter(pk=waiting.pk).update(created_at=timezone.now() - timedelta(hours=1))
+        RoomRequest.objects.create(room=self.room, user=User.objects.create_user('recent'))
+        self.assertEqual(reap()['requests'], 1)
+        self.assertEqual(RoomRequest.objects.get().user.username, 'recent')
+
+    @mock.patch.dict(os.environ, {'AGORA_APP_ID': '0' * 32, 'AGORA_APP_CERTIFICATE': '1' * 32})
+    def test_uids_of_denied_guests_are_given_back(self):
+        denied = User.objects.create_user('denied')
+        self.client.force_login(denied)
+        uid = self.client.get('/get_token/', {'channel': 'ROOM', 'actionType': 'join'}).json()['uid']
+        self.assertEqual(uid, 3)
+        self.client.post('/join_room/ROOM/', json.dumps({'uid': uid, 'name': 'Denied'}), content_type='application/json')
+        self.client.force_login(self.host)
+        join_request = RoomRequest.objects.get(user=denied)
+        self.client.post(f'/approve_join_request/ROOM/{join_request.pk}/', json.dumps({'approve': False}), content_type='application/json')
+
+        self.assertEqual(reap()['uids'], 0)  # The guest may still be waiting for the host.
+        UidAllocation.objects.update(allocated_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(reap()['uids'], 1)
+        self.room.refresh_from_db()
+        self.assertEqual(bytes(self.room.uid_bitmap), b'\x03')
+
+    @mock.patch.dict(os.environ, {'AGORA_APP_ID': '0' * 32, 'AGORA_APP_CERTIFICATE': '1' * 32})
+    def test_uids_members_joined_with_are_kept(self):
+        self.client.force_login(self.guest)
+        uid = self.client.get('/get_token/', {'channel': 'ROOM', 'actionType': 'join'}).json()['uid']
+        self.client.post('/create_member/', json.dumps({'name': 'Guest', 'UID': uid, 'room_name': 'ROOM'}), content_type='application/json')
+        self.assertFalse(UidAllocation.objects.exists())
+        self.assertEqual(reap()['uids'], 0)
+
+    def test_reap_queries_do_not_grow_with_rooms(self):
+        def count_queries(rooms):
+            for i in range(rooms):
+                room = Room.objects.create(room_name=f'STALE{rooms}-{i}', current_host=self.host, uid_bitmap=b'\x01')
+                room.participants.add(self.host)
+                RoomMember.objects.create(name='Host', uid='1', room=room, user=self.host, last_seen=timezone.now() - timedelta(minutes=5))
+            with CaptureQueriesContext(connection) as queries:
+                reap()
+            return len(queries)
+
+        # Only the UID release (a read and a write) is repeated per room; everything else is set-based.
+        self.assertEqual(count_queries(10) - count_queries(1), 2 * 9)
+
+
+# Drives every route against a scaled-down version of the benchmark data (`manage.py bench` runs the full size),
+# failing when an endpoint goes over its query budget (latency budgets are left to `manage.py bench`).
+class EndpointBudgetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bench = bench.seed(rooms=1000, participants=20, pending=5)
+
+    def test_every_route_is_benchmarked(self):
+        self.assertEqual(bench.uncovered_routes(self.bench), set())
+
+    # Query budgets only: latencies vary with the machine and its load, `manage.py bench` checks them.
+    def test_endpoints_stay_within_query_budget(self):
+        results = bench.run(self.bench, iterations=1)
+        violations = [problem for result in results for problem in result.violations(latency=False)]
+        self.assertEqual(violations, [], '\n' + bench.report(results))
+
+
+class LoadgenTests(TestCase):
+    def test_summary(self):
+        stats = LoadStats()
+        for latency in range(1, 101):
+            stats.record('room_snapshot', latency, 200, 3)
+        stats.record('get_token', 5000, 500, None)
+
+        summary = stats.summary(duration=10)
+        snapshot = summary['endpoints']['room_snapshot']
+        self.assertEqual((snapshot['p50_ms'], snapshot['p99_ms'], snapshot['max_ms']), (51, 100, 100))
+        self.assertEqual(snapshot['queries_per_request'], 3)
+        self.assertEqual(summary['endpoints']['get_token']['errors'], 1)
+        self.assertEqual(summary['total']['throughput'], 10.1)
+        self.assertEqual(summary['total']['histogram']['<=100ms'], 50)
+
+
+@fast_auth
+class FastAuthTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('alice', password='secret')
+        self.client.force_login(self.user)
+        room = Room.objects.create(room_name='ROOM')
+        room.participants.add(self.user)
+        self.client.get('/get_participants/ROOM/')  # Caches the user.
+
+    def test_poll_costs_no_session_or_user_query(self):
+        with self.assertNumQueries(3):  # Room ETag, room, participants.
+            self.client.get('/get_participants/ROOM/')
+
+    @override_settings(FAST_AUTH=False)
+    def test_user_cache_can_be_turned_off(self):
+        with self.assertNumQueries(4):  # User, room ETag, room, participants.
+            self.client.get('/get_participants/ROOM/')
+
+    def test_password_change_logs_out_immediately(self):
+        self.user.set_password('changed')
+        self.user.save()
+        response = self.client.get('/get_participants/ROOM/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_logout_drops_cached_user(self):
+        self.assertIsNotNone(cache.get(_cache_key(self.user.pk)))
+        self.client.post('/logout/')
+        self.assertIsNone(cache.get(_cache_key(self.user.pk)))
+
+    def test_logout_is_seen_by_other_workers(self):
+        other_worker = caches.create_connection('default')  # Its own connection to the shared cache.
+        session_key = SessionStore.cache_key_prefix + self.client.session.session_key
+        self.assertIsNotNone(other_worker.get(session_key))
+        self.assertIsNotNone(other_worker.get(_cache_key(self.user.pk)))
+        self.client.post('/logout/')
+        self.assertIsNone(other_worker.get(session_key))
+        self.assertIsNone(other_worker.get(_cache_key(self.user.pk)))
+
+    def test_sign_up_logs_in(self):
+        client = Client()
+        response = client.post('/signup/', {'username': 'bob', 'password1': 'a-long-passphrase', 'password2': 'a-long-passphrase'}, follow=True)
+        self.assertRedirects(response, '/')
+        self.assertEqual(client.session['_auth_user_id'], str(User.objects.get(username='bob').pk))
+        self.assertIn(b'Logout', response.content)
+
+    def test_refused_without_shared_cache(self):
+        env = {name: value for name, value in os.environ.items() if name != 'CACHE_URL'}
+        result = subprocess.run(
+            [sys.executable, '-c', 'import livecollab.settings'], cwd=settings.BASE_DIR, env={**env, 'FAST_AUTH': 'True'},
+            capture_output=True, text=True,
+        )
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('FAST_AUTH needs a cache shared by the workers', result.stderr)
+
+
+@override_settings(SERVER_TIMING=True)  # Template time is read from Server-Timing.
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_page_is_not_rendered_again(self):
+        first = self.client.get('/')
+        self.assertNotRegex(first['Server-Timing'], r'tpl;dur=0.00\b')
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertRegex(response['Server-Timing'], r'tpl;dur=0.00\b')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), re.sub(rb'(name="csrfmiddlewaretoken" value=")[^"]*', rb'\1', first.content))
+
+    def test_variants_by_login_state(self):
+        self.client.get('/about/')
+        self.client.force_login(User.objects.create_user('alice'))
+        self.client.get('/about/')
+        response = self.client.get('/about/')
+        self.assertIn(b'Logout', response.content)
+        self.assertNotIn(b'>Login<', response.content)
+
+    def test_login_form_uses_token_from_cookie(self):
+        User.objects.create_user('alice', password='secret')
+        client = Client(enforce_csrf_checks=True)
+        client.get('/login/')
+        client.cookies.clear()
+        response = client.get('/login/')
+        self.assertIn(b'name="csrfmiddlewaretoken" value=""', response.content)
+        response = client.post('/login/', {'username': 'alice', 'password': 'secret', 'csrfmiddlewaretoken': client.cookies['csrftoken'].value})
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+
+    def test_query_string_is_rendered(self):
+        self.client.get('/login/')
+        response = self.client.get('/login/', {'next': '/lobby'})
+        self.assertNotRegex(response['Server-Timing'], r'tpl;dur=0.00\b')
+
+
+class StaticPipelineTests(TestCase):
+    def test_room_scripts_are_preloaded(self):
+        self.client.force_login(User.objects.create_user('alice'))
+        link = self.client.get('/room/')['Link']
+        self.assertIn('</static/assets/AgoraRTC_N-4.22.1.js>; rel=preload; as=script', link)
+        self.assertIn('</static/js/streams.js>; rel=preload; as=script', link)
+        self.assertIn('rel=prefetch', self.client.get('/lobby')['Link'])
+        self.assertNotIn('AgoraRTC', self.client.get('/lobby').content.decode())
+
+    def test_collected_files_are_compressed_and_immutable(self):
+        # The pipeline's storage whatever DEBUG (and so STATIC_PIPELINE) is.
+        storages = {
+            'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+            'staticfiles': {'BACKEND': 'base.storage.StaticFilesStorage'},
+        }
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root, STORAGES=storages):
+            staticfiles_storage._setup()  # Picks up the new STATIC_ROOT.
+            try:
+                call_command('collectstatic', interactive=False, verbosity=0)
+                staticfiles_storage._setup()  # Loads the manifest.
+                url = staticfiles_storage.url('js/streams.js')
+                self.assertRegex(url, r'^/static/js/streams\.[0-9a-f]{12}\.js$')
+                self.assertTrue(os.path.exists(os.path.join(root, url.removeprefix('/static/') + '.gz')))
+
+                middleware = StaticFilesMiddleware(lambda request: None)
+                response = middleware(RequestFactory().get(url, HTTP_ACCEPT_ENCODING='gzip'))
+                self.assertEqual(response['Content-Encoding'], 'gzip')
+                self.assertIn('immutable', response['Cache-Control'])
+                response.file_to_stream.close()  # Not response.close(), which would close the database connection.
+            finally:
+                staticfiles_storage._setup()
+
+
+# Stands in for a database connection in ConnectionPoolTests.
+class FakeConnection:
+    def __init__(self, transaction_status=0):
+        self.closed = 0
+        self.info = mock.Mock(transaction_status=transaction_status)
+        self.rollback = mock.Mock()
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(TestCase):
+    def test_connections_are_reused(self):
+        pool = dbpool.ConnectionPool(size=2, max_overflow=0, timeout=1, max_idle=60)
+        connection = pool.checkout(FakeConnection)
+        pool.checkin(connection, reset_connection)
+        self.assertIs(pool.checkout(mock.Mock(side_effect=AssertionError)), connection)
+        self.assertEqual((pool.in_use, pool.idle, pool.checkouts), (1, 0, 2))
+
+    def test_overflow_connections_are_closed_when_returned(self):
+        pool = dbpool.ConnectionPool(size=1, max_overflow=1, timeout=1, max_idle=60)
+        first, second = pool.checkout(FakeConnection), pool.checkout(FakeConnection)
+        self.assertEqual(pool.overflow, 1)
+        pool.checkin(second, reset_connection)
+        pool.checkin(first, reset_connection)
+        self.assertTrue(second.closed)
+        self.assertFalse(first.closed)
+        self.assertEqual((pool.in_use, pool.idle, pool.overflow), (0, 1, 0))
+
+    def test_checkouts_wait_for_a_returned_connection(self):
+        pool = dbpool.ConnectionPool(size=1, max_overflow=0, timeout=5, max_idle=60)
+        connection = pool.checkout(FakeConnection)
+        threading.Timer(0.1, pool.checkin, (connection, reset_connection)).start()
+        self.assertIs(pool.checkout(FakeConnection), connection)
+        self.assertEqual(pool.waits, 1)
+        self.assertGreater(pool.wait_seconds, 0)
+
+    def test_checkouts_time_out(self):
+        pool = dbpool.ConnectionPool(size=1, max_overflow=0, timeout=0.05, max_idle=60)
+        pool.checkout(FakeConnection)
+        with self.assertRaises(dbpool.PoolTimeout):
+            pool.checkout(FakeConnection)
+        self.assertEqual(pool.timeouts, 1)
+
+    def test_unusable_connections_are_discarded(self):
+        pool = dbpool.ConnectionPool(size=2, max_overflow=0, timeout=1, max_idle=60)
+        broken = pool.checkout(lambda: FakeConnection(transaction_status=4))
+        pool.checkin(broken, reset_connection)
+        self.assertTrue(broken.closed)
+        self.assertEqual((pool.in_use, pool.idle), (0, 0))
+
+        failed = pool.checkout(lambda: FakeConnection(transaction_status=3))
+        pool.checkin(failed, reset_connection)
+        failed.rollback.assert_called_once()  # Left in a failed transaction: rolled back, then reused.
+        self.assertEqual(pool.idle, 1)
+
+        with mock.patch('base.dbpool.time.monotonic', return_value=time.monotonic() + 120):
+            fresh = pool.checkout(FakeConnection)
+        self.assertIsNot(fresh, failed)
+        self.assertTrue(failed.closed)  # Idle for too long.
+
+        with self.assertRaises(ConnectionRefusedError):
+            pool.checkout(mock.Mock(side_effect=ConnectionRefusedError))
+        self.assertEqual(pool.in_use, 1)
+
+    def test_metrics(self):
+        pool = dbpool.ConnectionPool(size=1, max_overflow=0, timeout=1, max_idle=60)
+        pool.checkout(FakeConnection)
+        with mock.patch.dict(dbpool.pools, {('default', 'livecollab'): pool}, clear=True):
+            rendered = registry.render()
+        self.assertIn('livecollab_db_pool_connections_in_use{alias="default",database="livecollab"} 1', rendered)
+        self.assertIn('livecollab_db_pool_checkouts_total{alias="default",database="livecollab"} 1', rendered)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite profile')
+class SqliteProfileTests(FileDatabaseMixin, TestCase):
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            pragmas = [cursor.execute(f'PRAGMA {name}').fetchone()[0] for name in ('journal_mode', 'synchronous', 'mmap_size')]
+        self.assertEqual(pragmas, ['wal', 1, 268435456])  # synchronous=1 is NORMAL.
+
+
+# In-process stand-in for the Redis client used by RedisRoomState (the subset of redis-py it needs).
+class FakeRedis:
+    def __init__(self):
+        self.values = {}  # Maps a key to (value, expiry or None).
+        self.sorted_sets = {}
+        self.subscribers = {}  # Maps a channel to the message queues of its subscribers.
+
+    def _live(self, key):
+        value, expiry = self.values.get(key, (None, None))
+        if expiry is not None and expiry <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    def get(self, key):
+        value = self._live(key)
+        return None if value is None else value.encode()
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and self._live(key) is not None:
+            return None
+        self.values[key] = (value, None if ex is None else time.monotonic() + ex)
+        return True
+
+    def delete(self, *keys):
+        return sum(self.values.pop(key, None) is not None for key in keys)
+
+    def zadd(self, key, mapping, gt=False):
+        scores = self.sorted_sets.setdefault(key, {})
+        for member, score in mapping.items():
+            member = member.encode() if isinstance(member, str) else member
+            if not gt or member not in scores or score > scores[member]:
+                scores[member] = float(score)
+
+    def zscore(self, key, member):
+        return self.sorted_sets.get(key, {}).get(member)
+
+    def zrem(self, key, *members):
+        for member in members:
+            self.sorted_sets.get(key, {}).pop(member, None)
+
+    def publish(self, channel, data):
+        for subscriber in list(self.subscribers.get(channel, ())):
+            subscriber.put({'type': 'message', 'data': data.encode()})
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+
+class FakePubSub:
+    def __init__(self, redis):
+        self.redis = redis
+        self.messages = queue.Queue()
+        self.channels = []
+
+    def subscribe(self, channel):
+        self.redis.subscribers.setdefault(channel, set()).add(self.messages)
+        self.channels.append(channel)
+
+    def get_message(self, timeout=0.0):
+        try:
+            return self.messages.get(timeout=timeout) if timeout else self.messages.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        for channel in self.channels:
+            self.redis.subscribers[channel].discard(self.messages)
+
+
+class InMemoryRoomStateTests(TestCase):
+    def make_store(self):
+        return roomstate.InMemoryRoomState(ttl=300, heartbeat_interval=20)
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_versions_only_move_forward(self):
+        self.store.publish_versions([('ROOM', 7, 3)])
+        self.store.publish_versions([('ROOM', 7, 2)])  # Loaded by a reader just before the change to 3.
+        self.assertEqual(self.store.room_version('ROOM'), (7, 3))
+        self.store.forget_rooms(['ROOM'])
+        self.assertIsNone(self.store.room_version('ROOM'))
+        self.store.publish_versions([('ROOM', 8, 0)])  # Created again.
+        self.assertEqual(self.store.room_version('ROOM'), (8, 0))
+
+    def test_heartbeats_are_coalesced(self):
+        self.assertTrue(self.store.heartbeat_due('ROOM', 'Alice', '1'))
+        self.assertFalse(self.store.heartbeat_due('ROOM', 'Alice', 1))
+        self.assertTrue(self.store.heartbeat_due('ROOM', 'Bob', '2'))
+        self.store.forget_members([('ROOM', 'Alice', 1)])
+        self.assertTrue(self.store.heartbeat_due('ROOM', 'Alice', '1'))
+
+
+class RedisRoomStateTests(InMemoryRoomStateTests):
+    def make_store(self):
+        return roomstate.RedisRoomState(FakeRedis(), ttl=300, heartbeat_interval=20)
+
+
+@fast_auth
+class RoomStateViewTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(roomstate, 'store', roomstate.RedisRoomState(FakeRedis(), ttl=300, heartbeat_interval=20))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.host = User.objects.create_user('host')
+        self.guest = User.objects.create_user('guest')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        self.room.participants.add(self.host, self.guest)
+        RoomMember.objects.create(name='Guest', uid='2', room=self.room, user=self.guest)
+        self.client.force_login(self.guest)
+
+    def test_unchanged_poll_is_answered_from_the_store(self):
+        etag = self.client.get('/get_participants/ROOM/')['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get('/get_participants/ROOM/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_login(self.host)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/change_host/', json.dumps({'name': 'guest', 'room_name': 'ROOM'}), content_type='application/json')
+        response = self.client.get('/get_participants/ROOM/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"%s.1"' % self.room.pk)
+
+    def test_heartbeats_are_written_once_per_interval(self):
+        payload = json.dumps({'room_name': 'ROOM', 'name': 'Guest', 'UID': '2'})
+        self.client.post('/heartbeat/', payload, content_type='application/json')
+        with self.assertNumQueries(0):
+            response = self.client.post('/heartbeat/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/delete_member/', json.dumps({'name': 'Guest', 'UID': '2', 'room_name': 'ROOM'}), content_type='application/json')
+        response = self.client.post('/heartbeat/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+# Events delivered to a subscriber, read from the calls made to a mock event loop.
+def delivered(loop):
+    return [event for call in loop.call_soon_threadsafe.call_args_list for events in call.args[1].values() for event in events]
+
+
+def wait_for_event(loop, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not loop.call_soon_threadsafe.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return delivered(loop)
+
+
+# Runs in a separate worker process: publish one event through the relay.
+def publish_through_relay(port):
+    bus = RelayEventBus(RoomEventHub(), '127.0.0.1', port)
+    bus.wait_connected(5)
+    bus.publish('ROOM', {'type': 'leave', 'username': 'bob'})
+    bus.close()
+
+
+class EventBusTests(TestCase):
+    def subscribe(self, hub, room_name='ROOM'):
+        loop = mock.Mock()
+        hub.subscribe(room_name, loop, asyncio.Queue())
+        return loop
+
+    def test_batch_wakes_each_loop_once(self):
+        hub = RoomEventHub()
+        loop = mock.Mock()
+        hub.subscribe('ROOM', loop, asyncio.Queue())
+        hub.subscribe('OTHER', loop, asyncio.Queue())
+        hub.publish_many([('ROOM', {'type': 'a'}), ('ROOM', {'type': 'b'}), ('OTHER', {'type': 'c'})])
+        self.assertEqual(loop.call_soon_threadsafe.call_count, 1)
+        self.assertEqual(sorted(event['type'] for event in delivered(loop)), ['a', 'b', 'c'])
+
+    async def test_slow_subscriber_is_resynced(self):
+        hub = RoomEventHub()
+        slow, fast = asyncio.Queue(maxsize=2), asyncio.Queue(maxsize=10)
+        hub.subscribe('ROOM', asyncio.get_running_loop(), slow)
+        hub.subscribe('ROOM', asyncio.get_running_loop(), fast)
+        for i in range(5):
+            hub.publish('ROOM', {'type': 'join', 'username': f'user{i}'})
+        await asyncio.sleep(0)
+        self.assertEqual(slow.qsize(), 1)
+        self.assertIs(slow.get_nowait(), RESYNC)
+        self.assertEqual(fast.qsize(), 5)
+
+    def test_local_url_selects_the_single_process_bus(self):
+        for url in ('', 'local://'):
+            self.assertIs(type(create_bus(url, RoomEventHub())), LocalEventBus)
+
+    def test_bus_is_created_on_first_use(self):
+        with mock.patch.object(events, '_bus_pid', None), mock.patch.object(events, '_bus', None), \
+                mock.patch('base.eventbus.create_bus', wraps=create_bus) as create:
+            call_command('reap_rooms', stdout=io.StringIO())
+            create.assert_not_called()
+            self.client.get('/login/')
+            create.assert_called_once()
+            self.assertIs(events.get_bus(), events._bus)
+            create.assert_called_once()
+            with mock.patch('base.events.os.getpid', return_value=os.getpid() + 1):  # A forked worker.
+                events.get_bus()
+            self.assertEqual(create.call_count, 2)
+
+    def test_redis_bus_reaches_other_processes(self):
+        redis, hub, other_hub = FakeRedis(), RoomEventHub(), RoomEventHub()
+        bus, other_bus = RedisEventBus(hub, redis), RedisEventBus(other_hub, redis)
+        self.addCleanup(bus.close)
+        self.addCleanup(other_bus.close)
+        self.assertTrue(bus.wait_connected(5) and other_bus.wait_connected(5))
+        loop, other_loop = self.subscribe(hub), self.subscribe(other_hub)
+
+        bus.publish('ROOM', {'type': 'host', 'username': 'alice'})
+        self.assertEqual(wait_for_event(other_loop), [{'type': 'host', 'username': 'alice'}])
+        time.sleep(0.1)
+        self.assertEqual(delivered(loop), [{'type': 'host', 'username': 'alice'}])  # Once: its own echo is ignored.
+
+    def test_relay_connects_worker_processes(self):
+        relay = EventRelay()
+        relay_loop = asyncio.new_event_loop()
+        server = relay_loop.run_until_complete(relay.start('127.0.0.1', 0))
+        threading.Thread(target=relay_loop.run_forever, daemon=True).start()
+        self.addCleanup(relay_loop.call_soon_threadsafe, relay_loop.stop)
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+
+        hub = RoomEventHub()
+        bus = RelayEventBus(hub, '127.0.0.1', port)
+        self.addCleanup(bus.close)
+        self.assertTrue(bus.wait_connected(5))
+        while not relay._writers:
+            time.sleep(0.01)
+        loop = self.subscribe(hub)
+
+        worker = multiprocessing.get_context('fork').Process(target=publish_through_relay, args=(port,))
+        worker.start()
+        worker.join(10)
+        self.assertEqual(wait_for_event(loop), [{'type': 'leave', 'username': 'bob'}])
+        self.assertEqual(hub.sequence('ROOM'), 1)  # Wakes up this process' long-polls too.
+
+
+@override_settings(SERVER_TIMING=True, METRICS_TOKEN='secret')
+@fast_auth
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        self.client.force_login(User.objects.create_user('alice'))
+        Room.objects.create(room_name='ROOM')
+
+    def test_server_timing_header(self):
+        response = self.client.get('/get_members/', {'room_name': 'ROOM', 'UID': '1'})
+        self.assertRegex(response['Server-Timing'], r'^view;dur=[\d.]+, db;dur=[\d.]+;desc="2 queries", tpl;dur=0.00, json;dur=[\d.]+$')
+
+    def test_template_time_is_measured(self):
+        response = self.client.get('/room/')
+        self.assertNotRegex(response['Server-Timing'], r'tpl;dur=0.00\b')
+
+    def test_metrics_are_aggregated_per_route(self):
+        for room_name in ('ROOM', 'OTHER'):
+            self.client.get(f'/get_member_map/{room_name}/')
+        text = self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('livecollab_db_queries_count{route="get_member_map/<str:room_name>/"} 2', text)
+        self.assertIn('livecollab_db_queries_bucket{route="get_member_map/<str:room_name>/",le="+Inf"} 2', text)
+        self.assertIn('livecollab_requests_total{route="get_member_map/<str:room_name>/",status="200"} 2', text)
+
+    def test_shards_of_all_threads_are_merged(self):
+        thread = threading.Thread(target=lambda: Client().get('/about/'))
+        thread.start()
+        thread.join()
+        self.client.get('/about/')
+        self.assertIn('livecollab_requests_total{route="about/",status="200"} 2', registry.render())
+
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/metrics/', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_are_off_without_token(self):
+        self.assertEqual(self.client.get('/metrics/').status_code, 404)
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_header_can_be_turned_off(self):
+        response = self.client.get('/get_members/', {'room_name': 'ROOM', 'UID': '1'})
+        self.assertNotIn('Server-Timing', response)
+        self.assertIn('livecollab_requests_total{route="get_members/",status="200"} 1', registry.render())  # Still measured.
+
+
+# A single process (`local://`): its hub sees every event, so idle rooms back off.
+@override_settings(
+    POLL_INTERVAL_MIN=3, POLL_INTERVAL_MAX=30, POLL_IDLE_BACKOFF=0.25, POLL_LOAD_CAPACITY=100,
+    EVENT_BUS_URL='local://',
+)
+class PollHintTests(TestCase):
+    def setUp(self):
+        self.hub = RoomEventHub()
+        events.get_bus()  # Created with the process' hub, not this one.
+        patcher = mock.patch.object(events, 'hub', self.hub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rate = mock.patch.object(polling.requests, 'rate', return_value=0)
+        self.rate.start()
+        self.addCleanup(self.rate.stop)
+
+        self.host = User.objects.create_user('host')
+        self.waiting = User.objects.create_user('waiting')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        self.room.participants.add(self.host)
+        RoomRequest.objects.create(room=self.room, user=self.waiting)
+        self.client.force_login(self.host)
+
+    def idle_for(self, seconds):
+        self.hub._started = time.monotonic() - seconds
+
+    def test_active_rooms_are_polled_at_the_shortest_interval(self):
+        response = self.client.get('/room_snapshot/ROOM/')
+        self.assertEqual(response['Retry-After'], '3')
+        response = self.client.get('/room_snapshot/ROOM/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_idle_rooms_back_off(self):
+        self.idle_for(60)
+        self.assertEqual(self.client.get('/get_participants/ROOM/')['Retry-After'], '15')
+        self.idle_for(3600)
+        self.assertEqual(self.client.get('/check_pending_requests/ROOM/')['Retry-After'], '30')
+
+        self.hub.publish('ROOM', {'type': 'join', 'username': 'guest'})
+        self.assertEqual(self.client.get('/get_participants/ROOM/')['Retry-After'], '3')
+
+    @override_settings(EVENT_BUS_URL='')
+    def test_idle_rooms_do_not_back_off_without_event_bus(self):
+        self.idle_for(3600)  # Other workers may have changed the room meanwhile.
+        self.assertEqual(self.client.get('/get_participants/ROOM/')['Retry-After'], '3')
+        polling.requests.rate.return_value = 250
+        self.assertEqual(self.client.get('/get_participants/ROOM/')['Retry-After'], '8')
+
+    def test_hints_stretch_under_load(self):
+        polling.requests.rate.return_value = 250
+        self.assertEqual(self.client.get('/get_participants/ROOM/')['Retry-After'], '8')
+        self.idle_for(3600)
+        self.assertEqual(self.client.get('/get_participants/ROOM/')['Retry-After'], '30')
+
+    @override_settings(ROOT_URLCONF=__name__)  # Only the async view holds long-polls open.
+    async def test_long_polls_wait_only_under_load(self):
+        await self.async_client.aforce_login(self.waiting)
+        path = f'/check_join_request_status/ROOM/{self.waiting.pk}/'
+        self.assertEqual((await self.async_client.get(path, {'wait': '0'}))['Retry-After'], '0')
+        polling.requests.rate.return_value = 200
+        self.assertEqual((await self.async_client.get(path, {'wait': '0'}))['Retry-After'], '6')
+
+    def test_sync_long_polls_get_the_usual_hint(self):
+        self.client.force_login(self.waiting)
+        response = self.client.get(f'/check_join_request_status/ROOM/{self.waiting.pk}/', {'wait': '0'})
+        self.assertEqual(response['Retry-After'], '3')
+
+    @override_settings(ROOT_URLCONF=__name__)  # The async views (see urlpatterns below).
+    async def test_async_views_send_hints(self):
+        self.idle_for(60)
+        await self.async_client.aforce_login(self.host)
+        response = await self.async_client.get('/get_participants/ROOM/')
+        self.assertEqual(response['Retry-After'], '15')
+
+    def test_request_rate(self):
+        self.rate.stop()
+        rate = polling.RequestRate()
+        with mock.patch('base.polling.time.monotonic', return_value=100.5):
+            for _ in range(10):
+                rate.hit()
+            self.assertEqual(rate.rate(), 10)
+        with mock.patch('base.polling.time.monotonic', return_value=101.25):
+            self.assertEqual(rate.rate(), 7.5)  # Three quarters of the previous second are still in the window.
+        with mock.patch('base.polling.time.monotonic', return_value=103.0):
+            self.assertEqual(rate.rate(), 0)
+        self.rate.start()
+
+
+# A second SQLite file standing in for the read replica in ReplicaRoutingTests. It only gets the schema, so it
+# holds none of the rows the tests create on the primary: reads routed to it find nothing.
+REPLICA = 'test_replica'
+
+
+@override_settings(REPLICA_DATABASE=REPLICA, REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    # The replica is added after TestCase's own setup, which would wrap it in a transaction (and the test
+    # runner would check and create it for the whole run).
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3')}
+        connections.settings[REPLICA] = connections.configure_settings({'default': {}, REPLICA: replica})[REPLICA]
+        cls.databases = cls.databases | {REPLICA}
+        call_command('migrate', database=REPLICA, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        cls.databases = cls.databases - {REPLICA}
+        cls.replica_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.guest = User.objects.create_user('guest')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        self.room.participants.add(self.host, self.guest)
+        self.client.force_login(self.host)
+
+    def test_polls_read_from_the_replica(self):
+        self.assertEqual(self.client.get('/get_participants/ROOM/').status_code, 404)
+        self.assertEqual(self.client.get('/room_snapshot/ROOM/').status_code, 404)
+        self.assertEqual(self.client.get('/get_member_map/ROOM/').status_code, 200)  # Other views aren't routed.
+        self.assertTrue(Room.objects.filter(room_name='ROOM').exists())  # Nor is anything outside a request.
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        response = self.client.post('/change_host/', json.dumps({'name': 'guest', 'room_name': 'ROOM'}), content_type='application/json')
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], 5)
+
+        response = self.client.get('/get_participants/ROOM/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn({'username': 'guest', 'is_host': True}, response.json()['participants'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)  # Reads don't extend the pin.
+
+        del self.client.cookies[PIN_COOKIE]  # Expired.
+        self.assertEqual(self.client.get('/get_participants/ROOM/').status_code, 404)
+
+    def test_heartbeats_do_not_pin_the_client(self):
+        RoomMember.objects.create(name='Host', uid='1', room=self.room, user=self.host)
+        payload = json.dumps({'room_name': 'ROOM', 'name': 'Host', 'UID': '1'})
+        response = self.client.post('/heartbeat/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.client.get('/get_participants/ROOM/').status_code, 404)  # Still on the replica.
+
+    @override_settings(ROOT_URLCONF=__name__)  # The async views (see urlpatterns below).
+    async def test_async_polls_read_from_the_replica(self):
+        await self.async_client.aforce_login(self.host)
+        response = await self.async_client.get('/get_participants/ROOM/')
+        self.assertEqual(response.status_code, 404)
+
+
+# The polling endpoints served by their async versions, as under ASGI, for AsyncViewTests.
+urlpatterns = [
+    path('get_member/', async_views.getMember),
+    path('check_pending_requests/<str:room_name>/', async_views.check_pending_requests),
+    path('check_join_request_status/<str:room_name>/<int:user_id>/', async_views.check_join_request_status),
+    path('get_participants/<str:room_name>/', async_views.get_participants),
+    path('get_uid_by_username/', async_views.getUidByUsername),
+    path('', include('base.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.host = User.objects.create_user('host')
+        self.guest = User.objects.create_user('guest')
+        self.waiting = User.objects.create_user('waiting')
+        self.room = Room.objects.create(room_name='ROOM', current_host=self.host)
+        self.room.participants.add(self.host, self.guest)
+        RoomMember.objects.create(name='Guest', uid='2', room=self.room, user=self.guest)
+        self.join_request = RoomRequest.objects.create(room=self.room, user=self.waiting)
+
+    # The same request through the sync view (default URLconf) and the async one; returns both responses.
+    async def both(self, user, path, data=None):
+        await self.async_client.aforce_login(user)
+        with override_settings(ROOT_URLCONF='livecollab.urls'):
+            sync_response = await self.async_client.get(path, data)
+        async_response = await self.async_client.get(path, data)
+        return sync_response, async_response
+
+    async def assertSameAsSync(self, user, path, data=None):
+        sync_response, async_response = await self.both(user, path, data)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.json(), sync_response.json())
+        self.assertEqual(async_response.get('ETag'), sync_response.get('ETag'))
+        return async_response
+
+    async def test_responses_match_sync_views(self):
+        await self.assertSameAsSync(self.guest, '/get_member/', {'UID': '2', 'room_name': 'ROOM'})
+        await self.assertSameAsSync(self.guest, '/get_uid_by_username/', {'username': 'Guest', 'room_name': 'ROOM'})
+        await self.assertSameAsSync(self.guest, '/get_uid_by_username/', {'username': 'Nobody', 'room_name': 'ROOM'})
+        await self.assertSameAsSync(self.guest, '/get_participants/ROOM/')
+        await self.assertSameAsSync(self.guest, '/get_participants/MISSING/')
+        response = await self.assertSameAsSync(self.host, '/check_pending_requests/ROOM/')
+        self.assertEqual(response.json()['pending_requests'], [{'name': 'waiting', 'user_id': self.join_request.pk}])
+        await self.assertSameAsSync(self.guest, '/check_pending_requests/ROOM/')
+        await self.assertSameAsSync(self.waiting, f'/check_join_request_status/ROOM/{self.waiting.pk}/')
+
+    async def test_unchanged_poll_is_not_modified(self):
+        await self.async_client.aforce_login(self.guest)
+        etag = (await self.async_client.get('/get_participants/ROOM/'))['ETag']
+        response = await self.async_client.get('/get_participants/ROOM/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_anonymous_poll_redirects_to_login(self):
+        response = await self.async_client.get('/get_participants/ROOM/')
+        self.assertEqual(response.status_code, 302)
+
+    async def test_long_poll_wakes_up_on_decision(self):
+        await self.async_client.aforce_login(self.waiting)
+        poll = asyncio.ensure_future(self.async_client.get(f'/check_join_request_status/ROOM/{self.waiting.pk}/', {'wait': '10'}))
+        await asyncio.sleep(0.2)
+        await RoomRequest.objects.filter(pk=self.join_request.pk).aupdate(status=RoomRequest.Status.APPROVED)
+        start = time.monotonic()
+        events.hub.publish('ROOM', {'type': 'join_request_decided'})
+
+        response = await poll
+        self.assertEqual(response.json()['join_status'], 'approved')
+        self.assertLess(time.monotonic() - start, 1)  # Woken by the event, not the periodic recheck.
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+
+
+# Bounded LRU cache of Agora RTC tokens, keyed by (channel, uid, role).
+#
+# A token only encodes the app, channel, UID, role and expiry, so any still-valid token for the same key
+# can be handed out again instead of minting a new one. That is what happens on reconnect storms, and
+# whenever the UID allocator hands a recycled UID out again. Tokens are reused until they get within
+# `refresh_margin` seconds of their expiry, so clients always receive at least that much validity.
+class TokenCache:
+    def __init__(self, max_size, refresh_margin):
+        self.max_size = max_size
+        self.refresh_margin = refresh_margin
+        self._tokens = OrderedDict()  # Maps (channel, uid, role) to (token, expiry timestamp), least recently used first.
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Return a cached token for the key, or build one with `build(privilege_expired_ts)` and cache it.
+    def get_or_build(self, channel, uid, role, lifetime, build):
+        key = (channel, uid, role)
+        now = time.time()
+
+        with self._lock:
+            cached = self._tokens.get(key)
+            if cached is not None and cached[1] - now > self.refresh_margin:
+                self._tokens.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+
+        # Build outside the lock; two concurrent misses for one key just both mint a token.
+        privilege_expired_ts = int(now + lifetime)
+        token = build(privilege_expired_ts)
+
+        with self._lock:
+            self._tokens[key] = (token, privilege_expired_ts)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+                self.evictions += 1
+        return token
+
+    # Counters showing how much minting work the cache saves.
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._tokens),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+# Shared cache for this process.
+token_cache = TokenCache(
+    max_size=getattr(settings, 'AGORA_TOKEN_CACHE_SIZE', 1024),
+    refresh_margin=getattr(settings, 'AGORA_TOKEN_REFRESH_MARGIN', 3600),
+)
+
+
+# Token cache metrics in the Prometheus text format, added to /metrics/.
+def metric_lines():
+    stats = token_cache.stats()
+    families = (
+        ('livecollab_token_cache_hits_total', 'counter', 'Tokens served from the cache.', 'hits'),
+        ('livecollab_token_cache_misses_total', 'counter', 'Tokens that had to be minted.', 'misses'),
+        ('livecollab_token_cache_evictions_total', 'counter', 'Tokens dropped to keep the cache within its size.', 'evictions'),
+        ('livecollab_token_cache_size', 'gauge', 'Tokens in the cache.', 'size'),
+    )
+    lines = []
+    for name, kind, help_text, key in families:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {stats[key]}']
+    return lines
+
+
+metrics.registry.collectors.append(metric_lines)
@@ -0,0 +1,86 @@
+from .models import Room
+
+
+# Per-room allocator for Agora UIDs.
+#
+# Each room keeps the UIDs it has handed out as a bitmap in Room.uid_bitmap: bit n set means UID n + 1 is taken.
+# Allocation takes the lowest free bit, so UIDs stay small and are reused as soon as members leave, and the
+# bitmap stays a few bytes long. Changes are applied with a compare-and-swap UPDATE (only written if the bitmap
+# is still the one we read), so concurrent get_token calls from several workers never hand out the same UID
+# and no row lock is held; a lost race simply retries against the new bitmap.
+
+
+def _to_int(bitmap):
+    return int.from_bytes(bitmap, 'little')
+
+
+def _to_bytes(bits):
+    return bits.to_bytes((bits.bit_length() + 7) // 8, 'little')  # Minimal length, so equal bitmaps compare equal in SQL.
+
+
+# Lowest clear bit of `bits`: adding one carries through the trailing ones into the first zero.
+def _lowest_free_bit(bits):
+    return ((~bits) & (bits + 1)).bit_length() - 1
+
+
+# Apply `change` (a function from the old bits to the new bits, plus a result) to the room's bitmap atomically.
+# Returns the result of the change that was written, or None if the room no longer exists.
+def _update_bitmap(room_id, change):
+    while True:
+        bitmap = Room.objects.filter(pk=room_id).values_list('uid_bitmap', flat=True).first()
+        if bitmap is None:
+            return None
+
+        bitmap = bytes(bitmap)
+        bits = _to_int(bitmap)
+        new_bits, result = change(bits)
+        if new_bits == bits:
+            return result  # Nothing to write.
+
+        if Room.objects.filter(pk=room_id, uid_bitmap=bitmap).update(uid_bitmap=_to_bytes(new_bits)):
+            return result
+
+
+# Hand out the lowest free UID of the room.
+def allocate_uid(room):
+    def take_lowest(bits):
+        bit = _lowest_free_bit(bits)
+        return bits | (1 << bit), bit + 1
+
+    return _update_bitmap(room.pk, take_lowest)
+
+
+# Mark a UID as taken again (e.g. a member reconnecting with the UID it was given before).
+def claim_uid(room, uid):
+    if uid < 1:
+        return
+    _update_bitmap(room.pk, lambda bits: (bits | (1 << (uid - 1)), None))
+
+
+# Give a UID back to the room's pool once its member has left.
+def release_uid(room, uid):
+    release_uids(room, [uid])
+
+
+# Give several UIDs back to the room's pool in one update.
+def release_uids(room, uids):
+    mask = 0
+    for uid in uids:
+        if uid >= 1:
+            mask |= 1 << (uid - 1)
+    if mask:
+        _update_bitmap(room.pk, lambda bits: (bits & ~mask, None))
+
+
+# The room's bitmap with a UID given back, for callers that hold the room row locked and write it themselves.
+def released_bitmap(bitmap, uid):
+    return _to_bytes(_to_int(bytes(bitmap)) & ~(1 << (uid - 1)))
+
+
+# Parse a UID as stored on RoomMember, or None if it isn't one of ours.
+def parse_uid(value):
+    try:
+        uid = int(value)
+    except (TypeError, ValueError):
+        return None
+    return uid if uid >= 1 else None
@@ -1,7 +1,11 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 from django.contrib.auth.views import LogoutView
 
+# Under ASGI the polling endpoints are served by their async versions (see base/async_views.py).
+polling_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
     path('', views.home, name='home'),
     path('about/', views.about, name='about'),
@@ -13,14 +17,19 @@ urlpatterns = [
     path('room/', views.room, name='room'),
     path('get_token/', views.getToken),
     path('create_member/',views.createMember),
-    path('get_member/',views.getMember),
+    path('get_member/',polling_views.getMember),
+    path('get_members/',views.getMembers),
+    path('get_member_map/<str:room_name>/', views.get_member_map),
     path('delete_member/',views.deleteMember),
+    path('heartbeat/', views.member_heartbeat),
     path('join_room/<str:room_name>/', views.handle_join_request),
-    path('check_pending_requests/<str:room_name>/', views.check_pending_requests),
+    path('check_pending_requests/<str:room_name>/', polling_views.check_pending_requests),
     path('approve_join_request/<str:room_name>/<int:request_id>/', views.approve_join_request),
-    path('check_join_request_status/<str:room_name>/<int:user_id>/', views.check_join_request_status),
-    path('get_participants/<str:room_name>/', views.get_participants),
-    path('get_uid_by_username/', views.getUidByUsername),
+    path('check_join_request_status/<str:room_name>/<int:user_id>/', polling_views.check_join_request_status),
+    path('get_participants/<str:room_name>/', polling_views.get_participants),
+    path('room_snapshot/<str:room_name>/', views.room_snapshot),
+    path('get_uid_by_username/', polling_views.getUidByUsername),
     path('remove_participant_by_name/', views.remove_participant_by_name),
     path('change_host/', views.change_host, name='change_host'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,14 +1,27 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from agora_token_builder import RtcTokenBuilder
-import random
 import time
 import json
-from .models import RoomMember, Room, RoomRequest, User
+from .models import RoomMember, Room, RoomRequest, UidAllocation, User
+from . import events, metrics, presence, roomstate
+from .http import JsonResponse
+from .uids import allocate_uid, claim_uid, parse_uid, released_bitmap
+from .tokens import token_cache
+from .pagecache import cache_page_variant
+from .polling import poll_hint
+from .routers import no_pin, replica_reads
 
 from django.urls import reverse_lazy
+from django.templatetags.static import static
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.decorators import login_required
+from django.utils.decorators import method_decorator
 from django.views.generic.edit import FormView
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login
@@ -21,23 +34,93 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
+# Longest time (in seconds) a lobby long-poll may be held open; kept under gunicorn's default 30s worker timeout.
+# This is for the async view (base/async_views.py), which waits without holding a thread.
+JOIN_STATUS_MAX_WAIT = 25
+
+# The sync view holds a WSGI worker thread while it waits, so it only waits this long (in seconds) before answering.
+JOIN_STATUS_MAX_SYNC_WAIT = 2
+
+# While long-polling, re-read the request at least this often (in seconds), so decisions made
+# by another worker process are picked up even when no event bus (EVENT_BUS_URL) brings them to this process' hub.
+JOIN_STATUS_RECHECK_INTERVAL = 2
+
+
+# Mark a room as changed, so polling clients holding its old ETag get the new state.
+def bump_room_version(room_name):
+    Room.objects.filter(room_name=room_name).update(version=F('version') + 1)
+    roomstate.rooms_changed(names=[room_name])
+
+
+# Build the ETag for a room's polled state from its id and version, plus anything else the response depends on.
+# This is a single store or indexed lookup, so unchanged polls are answered with a 304 without loading the room's data.
+def room_etag(room_name, *parts):
+    return format_room_etag(roomstate.room_version(room_name), *parts)
+
+
+# ETag from a room's (id, version), as returned by the room state store (shared with base/async_views.py).
+def format_room_etag(version, *parts):
+    if version is None:
+        return None  # Unknown room: let the view produce its error response.
+    return '"%s"' % '.'.join(str(part) for part in (*version, *parts))
+
+
+def participants_etag(request, room_name):
+    return room_etag(room_name)
+
+
+def pending_requests_etag(request, room_name):
+    return room_etag(room_name, request.user.id)  # The response depends on whether the user is the host.
+
+
+def join_request_status_etag(request, room_name, user_id):
+    if is_long_poll(request):
+        return None  # Long-polls wait for a change instead of answering "not modified".
+    return room_etag(room_name, user_id)
+
+
+def is_long_poll(request):
+    return 'wait' in request.GET
+
+
+# Seconds a lobby long-poll asks to wait (`?wait=`), capped at `limit`.
+def requested_wait(request, limit):
+    try:
+        return max(0.0, min(float(request.GET.get('wait', 0)), limit))
+    except ValueError:
+        return 0
+
+
+# Scripts of the room page, the only page using the Agora SDK.
+ROOM_SCRIPTS = ('assets/AgoraRTC_N-4.22.1.js', 'js/streams.js')
+
+
+# Link header hinting the browser to fetch the given static scripts ahead of time (`rel` is preload or prefetch).
+def link_header(scripts, rel):
+    return ', '.join(f'<{static(path)}>; rel={rel}; as=script' for path in scripts)
+
+
 # View for the homepage (render the 'home.html' template).
+@cache_page_variant  # Served from the page cache after the first render (see base/pagecache.py).
 def home(request):
     return render(request, 'base/home.html') 
 
 
 # View for the About Us page (render the 'about.html' template).
+@cache_page_variant
 def about(request):
     return render(request, 'base/about.html')
 
 
 # View for the Contact Us page (render the 'contact.html' template).
+@cache_page_variant
 def contact(request):
     return render(request, 'base/contact.html')
 
 
 # Custom view for handling user login.
 # Uses a custom template and redirects authenticated users away from the login page.
+@method_decorator(cache_page_variant, name='dispatch')  # The empty login form is served from the page cache.
 class CustomLoginView(LoginView):
     template_name = 'base/login.html'  # Specify the custom login page template
     fields = '__all__'  # Allows all fields in the form (usually not recommended for security).
@@ -49,6 +132,7 @@ class CustomLoginView(LoginView):
 
 
 # View for handling user sign-up, including account creation and automatic login.
+@method_decorator(cache_page_variant, name='dispatch')  # The empty sign-up form is served from the page cache.
 class SignUp(FormView):
     template_name = 'base/signup.html'  # Specify the template for the sign-up page.
     form_class = UserCreationForm  # Use the built-in Django UserCreationForm for new users.
@@ -59,7 +143,7 @@ class SignUp(FormView):
     def form_valid(self, form):
         user = form.save()  # Save the new user.
         if user is not None:
-            login(self.request, user)  # Log the user in immediately after signing up.
+            login(self.request, user, backend='base.auth.CachedModelBackend')  # Log the user in immediately after signing up (naming the backend, since several are configured).
         return super(SignUp, self).form_valid(form)  # Proceed with usual form handling.
     
     # Check if the user is already authenticated. If so, redirect to the home page.
@@ -81,44 +165,59 @@ def getToken(request):
     channelName = request.GET.get('channel')
     action_type = request.GET.get('actionType')
 
-    # If the user is hosting, check if a room with the given channel name already exists.
-    if action_type == 'host':
-        existing_room = Room.objects.filter(room_name=channelName).first()
-        if existing_room:
-            # Check if there are any members in the RoomMember model for the same room.
-            has_members_in_roommember = RoomMember.objects.filter(room_name=channelName).exists()
-        
-            # If no members, delete the room.
-            if not has_members_in_roommember:
-                existing_room.delete()
-            else:
-                # If members exist, return an error message.
-                return JsonResponse({'error': 'Room already exists'}, status=400)
-
-
-    # If the user is joining, ensure the room exists.
-    elif action_type == 'join':
-        existing_room = Room.objects.filter(room_name=channelName).first()
-        if not existing_room:
-            return JsonResponse({'error': 'Room does not exist'}, status=404)  # Return error if the room does not exist.
-    
-    # Generate a random UID between 1 and 230 (to simulate user identity in Agora).
-    uid = random.randint(1, 230)
-    
-    # Set the expiration time of the token to 24 hours.
-    expirationTimeInSeconds = 3600 * 24
-    currentTimeStamp = time.time()
-    privilegeExpiredTs = currentTimeStamp + expirationTimeInSeconds  # Calculate the expiration timestamp.
-    
-    role = 1  # Assign a role of 1 for the broadcaster (host).
+    # Create the room, take a UID and build the token in one transaction: if anything fails (e.g. building the
+    # token), the new room and the UID are rolled back instead of being left behind.
+    with transaction.atomic():
+        # If the user is hosting, check if a room with the given channel name already exists.
+        if action_type == 'host':
+            existing_room = Room.objects.filter(room_name=channelName).first()
+            if existing_room:
+                # Check if there are any members in the RoomMember model for the same room.
+                has_members_in_roommember = existing_room.members.exists()
+
+                # If no members, delete the room.
+                if not has_members_in_roommember:
+                    existing_room.delete()
+                else:
+                    # If members exist, return an error message.
+                    return JsonResponse({'error': 'Room already exists'}, status=400)
+
+            # Create the new room entry in the database, with the host as the first participant.
+            room = Room.objects.create(room_name=channelName, current_host=request.user)
+            room.participants.add(request.user)
+            roomstate.rooms_changed(names=[channelName])  # Replaces a deleted room of the same name in the room state store.
+
+        # If the user is joining, ensure the room exists.
+        else:
+            room = Room.objects.filter(room_name=channelName).first()
+            if not room:
+                return JsonResponse({'error': 'Room does not exist'}, status=404)  # Return error if the room does not exist.
+
+        # Take the lowest free UID of the room, so no two members of a room share one.
+        uid = allocate_uid(room)
+        if uid is None:
+            return JsonResponse({'error': 'Room does not exist'}, status=404)  # The room was deleted in the meantime.
+        # Remember it until a member joins with it, so the reaper can give it back if none does (denied or gone guests).
+        UidAllocation.objects.bulk_create(
+            [UidAllocation(room=room, uid=uid)],
+            update_conflicts=True, unique_fields=['room', 'uid'], update_fields=['allocated_at'],
+        )
 
-    # Build the Agora RTC token using the credentials, UID, and channel information.
-    token = RtcTokenBuilder.buildTokenWithUid(appId, appCertificate, channelName, uid, role, privilegeExpiredTs)
+        # Set the expiration time of the token to 24 hours.
+        expirationTimeInSeconds = 3600 * 24
 
-    # If the user is hosting, create a new room entry in the database.
-    if action_type == 'host':
-        room = Room.objects.create(room_name=channelName, current_host=request.user, token=token, uid=uid)
-        room.participants.add(request.user)  # Add the host as the first participant in the room.
+        role = 1  # Assign a role of 1 for the broadcaster (host).
+
+        # Build the Agora RTC token using the credentials, UID, and channel information,
+        # reusing a cached token for the same channel, UID and role while it is still valid long enough.
+        token = token_cache.get_or_build(
+            channelName, uid, role, expirationTimeInSeconds,
+            lambda privilegeExpiredTs: RtcTokenBuilder.buildTokenWithUid(appId, appCertificate, channelName, uid, role, privilegeExpiredTs),
+        )
+
+        # If the user is hosting, store the host's token and UID on the room.
+        if action_type == 'host':
+            Room.objects.filter(pk=room.pk).update(token=token, uid=uid)
     
     # Return the generated token and UID as a JSON response.
     return JsonResponse({'token': token, 'uid': uid}, safe=False)
@@ -128,26 +227,52 @@ def getToken(request):
 @login_required(login_url='/login/')    # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
 def lobby(request):
     action_type = request.GET.get('actionType', 'join')  # Default action is 'join' if not specified.
-    return render(request, 'base/lobby.html', {'action_type': action_type})
+    response = render(request, 'base/lobby.html', {'action_type': action_type})
+    # Let the browser download the room's scripts (the Agora SDK is over 1 MB) while the user is in the lobby.
+    response['Link'] = link_header(ROOM_SCRIPTS, 'prefetch')
+    return response
 
 
 # View to render the room page, accessible only by logged-in users.
 @login_required(login_url='/login/') # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
 def room(request):
-    return render(request, 'base/room.html')
+    response = render(request, 'base/room.html')
+    # Start downloading the scripts (loaded at the end of the page) as soon as the headers arrive.
+    response['Link'] = link_header(ROOM_SCRIPTS, 'preload')
+    return response
 
 
 # View to create a new RoomMember entry in the database.
 @login_required(login_url='/login/') # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
 def createMember(request):
     data = json.loads(request.body)  # Parse the JSON data from the request body.
+
+    # Members can only be created in an existing room.
+    room = Room.objects.filter(room_name=data['room_name']).first()
+    if room is None:
+        return JsonResponse({'error': 'Room not found'}, status=404)
     
-    # Create or get a RoomMember entry based on the user's name, UID, and room name.
+    # Create or get a RoomMember entry based on the user's name, UID, and room.
     member, created = RoomMember.objects.get_or_create(
         name=data['name'],
         uid=data['UID'],
-        room_name=data['room_name']
+        room=room,
+        defaults={'user': request.user},
     )
+    if not created:
+        presence.heartbeat(data['room_name'], data['name'], data['UID'])  # Rejoining counts as a sign of life.
+
+    # Make sure the member's UID is marked as taken (a reloading page releases it on unload and rejoins with it).
+    uid = parse_uid(member.uid)
+    if uid is not None:
+        claim_uid(room, uid)
+        UidAllocation.objects.filter(room=room, uid=uid).delete()  # Claimed: the reaper leaves it alone.
+
+    # Announce the new member to everyone connected to the room.
+    if created:
+        bump_room_version(data['room_name'])
+        events.participant_joined(data['room_name'], request.user.username, room.current_host_id == request.user.id)
+        events.member_added(data['room_name'], member.uid, member.name)
 
     # Return the member's name as a JSON response.
     return JsonResponse({'name': data['name']}, safe=False)
@@ -155,6 +280,7 @@ def createMember(request):
 
 # View to fetch a RoomMember's information based on UID and room name.
 @login_required(login_url='/login/')    # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+@replica_reads  # Read-only: may read from the read replica (see base/routers.py)
 def getMember(request):
     uid = request.GET.get('UID')  # Get UID from request query parameters.
     room_name = request.GET.get('room_name')  # Get room name from request query parameters.
@@ -162,50 +288,116 @@ def getMember(request):
     # Find the member from the database using the provided UID and room name.
     member = RoomMember.objects.get(
         uid=uid,
-        room_name=room_name,
+        room__room_name=room_name,
     )
 
     # Return the member's name as a JSON response.
     return JsonResponse({'name': member.name}, safe=False)
 
 
-# View to delete a RoomMember entry from the database.
+# View to fetch the names of several RoomMembers of a room at once, based on a list of UIDs
+# (`?room_name=...&UID=1&UID=2`). Unknown UIDs are left out of the result.
 @login_required(login_url='/login/')    # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
-def deleteMember(request):
-    data = json.loads(request.body)  # Parse the request body as JSON.
-    try:
-        # Find the RoomMember entry based on the user's name, UID, and room name.
-        member = RoomMember.objects.get(
-            name=data['name'],
-            uid=data['UID'],
-            room_name=data['room_name'],
+def getMembers(request):
+    uids = request.GET.getlist('UID')  # Get the UIDs from request query parameters.
+    room_name = request.GET.get('room_name')  # Get room name from request query parameters.
+
+    # Find all the members in one query.
+    members = RoomMember.objects.filter(room__room_name=room_name, uid__in=uids).values_list('uid', 'name')
+
+    # Return a UID -> name map as a JSON response.
+    return JsonResponse({'members': dict(members)})
+
+
+# View to fetch the names of all RoomMembers of a room, keyed by UID (fetched once by clients when they join).
+@login_required(login_url='/login/')    # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+@cache_control(no_cache=True)  # Let browsers keep the response, but revalidate it with its ETag on every request
+@condition(etag_func=participants_etag)  # Members only change along with the room's version
+def get_member_map(request, room_name):
+    members = RoomMember.objects.filter(room__room_name=room_name).values_list('uid', 'name')
+    return JsonResponse({'members': dict(members)})
+
+
+# Remove a member, and the participant it belongs to, from a room as one atomic operation.
+# The room row is locked first, so simultaneous leaves of one room run one after another instead of
+# interleaving, and the work is a fixed handful of queries whatever the room's size. Leaving twice is harmless:
+# once the member and participant are gone there is nothing left to change.
+# `participant` is the leaving user, or None to find the participant by the member's name (kicks).
+# Returns the username of the participant that was removed, or None.
+def leave_room(room_name, name, uid, participant=None):
+    with transaction.atomic():
+        room = (
+            Room.objects.select_for_update()
+            .only('id', 'current_host_id', 'uid_bitmap')
+            .filter(room_name=room_name)
+            .first()
         )
+        if room is None:
+            return None  # The room (and everyone in it) is already gone.
 
-        # Delete the RoomMember entry.
-        member.delete()
+        # Delete the RoomMember entry, if it is still there.
+        member_deleted, _ = RoomMember.objects.filter(room=room, name=name, uid=uid).delete()
 
-        # Find the Room entry associated with the specified room name.
-        room = Room.objects.get(room_name=data['room_name'])
-        
         # Remove the user from the participants list of the room.
-        room.participants.remove(request.user)
+        if participant is not None:
+            participant_id, username = participant.id, participant.username
+        else:
+            # Find the participant by the member's name (case-insensitively).
+            participant_id, username = room.participants.filter(username__iexact=name).values_list('id', 'username').first() or (None, None)
+        if participant_id is not None:
+            participant_removed, _ = Room.participants.through.objects.filter(room=room, user_id=participant_id).delete()
+            if not participant_removed:
+                username = None  # Already removed by an earlier leave.
+
+        if not member_deleted and not username:
+            return None  # Nothing changed: this leave was already handled.
+
+        host_left = username is not None and room.current_host_id == participant_id
+
+        # If no members remain in the room, delete the room entry from the database (and with it, everything that
+        # references it). Otherwise update the room in one statement: clear the host if they left, give the
+        # member's UID back and bump the version so polling clients refetch.
+        if member_deleted and not room.members.exists():
+            room.delete()
+        else:
+            changes = {'version': F('version') + 1}
+            if host_left:
+                changes['current_host'] = None
+            parsed_uid = parse_uid(uid)
+            if member_deleted and parsed_uid is not None:
+                changes['uid_bitmap'] = released_bitmap(room.uid_bitmap, parsed_uid)
+            Room.objects.filter(pk=room.pk).update(**changes)
+
+        # Published once the transaction commits.
+        roomstate.rooms_changed(names=[room_name])
+        if member_deleted:
+            roomstate.members_left([(room_name, name, uid)])
+        if username:
+            events.participant_left(room_name, username)
+        if host_left:
+            events.host_changed(room_name, None)
+        return username
 
-        # If the leaving member was the host, set the room's host to None.
-        if room.current_host == request.user:
-            room.current_host = None
-            room.save()
 
-        # If no members remain in the room, delete the room entry from the database.
-        if not RoomMember.objects.filter(room_name=data['room_name']).exists():
-            room.delete()
+# View to delete a RoomMember entry from the database.
+# Leaving is idempotent: repeating it (e.g. from both the leave button and the page unload) succeeds.
+@login_required(login_url='/login/')    # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+def deleteMember(request):
+    data = json.loads(request.body)  # Parse the request body as JSON.
+    leave_room(data['room_name'], data['name'], data['UID'], participant=request.user)
 
-        # Return a confirmation message as a JSON response.
-        return JsonResponse('Member was deleted', safe=False)
+    # Return a confirmation message as a JSON response.
+    return JsonResponse('Member was deleted', safe=False)
 
-    except RoomMember.DoesNotExist:
-        return JsonResponse({'error': 'Member not found'}, status=404)  # Return error if the member is not found.
-    except Room.DoesNotExist:
-        return JsonResponse({'error': 'Room not found'}, status=404)  # Return error if the room is not found.
+
+# Heartbeat sent by room pages every few seconds, keeping their member from being reaped (see base/presence.py).
+@login_required(login_url='/login/')    # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+@no_pin  # Its writes only keep the member alive: they don't pin the client to the primary (see base/routers.py)
+def member_heartbeat(request):
+    data = json.loads(request.body)  # Parse the request body as JSON.
+    if not presence.heartbeat(data['room_name'], data['name'], data['UID']):
+        return JsonResponse({'error': 'Member not found'}, status=404)  # The member left, was removed or was reaped.
+    return JsonResponse({'status': 'ok'})
 
 
 # Endpoint for handling join requests
@@ -221,40 +413,51 @@ def handle_join_request(request, room_name):
         room_request, created = RoomRequest.objects.get_or_create(
             room=room,
             user=user,
-            defaults={'status': 'pending'}
+            defaults={'status': RoomRequest.Status.PENDING}
         )
         
         # If there is already a pending request, inform the user that they're waiting for approval
-        if not created and room_request.status == 'pending':
+        if not created and room_request.status == RoomRequest.Status.PENDING:
             return JsonResponse({"status": "pending_approval", "message": "Already waiting for host approval"}, status=403)
         
         # Otherwise, set the request status to 'pending' and save the request
-        room_request.status = 'pending'
+        room_request.status = RoomRequest.Status.PENDING
         room_request.save()
+        bump_room_version(room_name)
+
+        # Push the new request to the host's connection
+        events.join_request_created(room_name, room_request.id, user.username)
         
         # Inform the user that they are waiting for host approval
         return JsonResponse({"status": "pending_approval", "message": "Waiting for host approval"}, status=403)
     
     # If no host exists, automatically approve the user to join the room
     room.participants.add(user)
+    bump_room_version(room_name)
+    events.participant_joined(room_name, user.username)
     return JsonResponse({"status": "approved", "message": "User approved to join the room"})
 
 
-# Endpoint to check all pending join requests for a room
+# Endpoint to check all pending join requests for a room.
+# Hosts connected to the room's WebSocket get new requests pushed; this is the fallback pull, and it only
+# lists requests for the host.
 @login_required(login_url='/login/')  # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+@replica_reads  # Read-only: may read from the read replica (see base/routers.py)
+@cache_control(no_cache=True)  # Let browsers keep the response, but revalidate it with its ETag on every poll
+@poll_hint  # Tell the client when to poll next (Retry-After), from the room's activity and the server's load
+@condition(etag_func=pending_requests_etag)  # Answer with a 304 when the room hasn't changed since the client's copy
 def check_pending_requests(request, room_name):
     try:
         # Retrieve the room based on its name
         room = Room.objects.get(room_name=room_name)
         
         # Check if the requesting user is the host
-        is_host = request.user == room.current_host
+        is_host = request.user.id == room.current_host_id
 
-        # Get all pending requests for the room
-        pending_requests = RoomRequest.objects.filter(room=room, status='pending')
-        
-        # Prepare the data for the pending requests
-        requests_data = [{"name": req.user.username, "user_id": req.id} for req in pending_requests]
+        # Get all pending requests for the room, with the requesting usernames in the same query
+        requests_data = []
+        if is_host:
+            requests_data = pending_requests_data(room)
 
         # Return the list of pending requests along with whether the user is the host
         return JsonResponse({"status": "success", "pending_requests": requests_data, "is_host": is_host})
@@ -265,6 +468,21 @@ def check_pending_requests(request, room_name):
         return JsonResponse({"status": "error", "message": str(e)})
 
 
+# Pending join requests of a room, as sent to the host ("user_id" holds the id of the request itself).
+def pending_requests_data(room):
+    return format_pending_requests(pending_requests_query(room))
+
+
+# The pending join requests of a room, oldest first, as (request id, username) rows; the async views iterate it
+# with `async for`.
+def pending_requests_query(room):
+    return RoomRequest.objects.filter(room=room, status=RoomRequest.Status.PENDING).order_by('created_at').values_list('id', 'user__username')
+
+
+def format_pending_requests(rows):
+    return [{"name": username, "user_id": request_id} for request_id, username in rows]
+
+
 # Endpoint for the host to approve or deny a join request
 @login_required(login_url='/login/')  # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
 def approve_join_request(request, room_name, request_id):
@@ -279,16 +497,22 @@ def approve_join_request(request, room_name, request_id):
 
         if approve:
             # If approved, change the status of the request and add the user to the room
-            join_request.status = 'approved'
+            join_request.status = RoomRequest.Status.APPROVED
             join_request.save()
             room.participants.add(join_request.user)
+            events.participant_joined(room_name, join_request.user.username)
             message = "Request approved, user added to room."
         else:
             # If denied, change the request status to 'denied'
-            join_request.status = 'denied'
+            join_request.status = RoomRequest.Status.DENIED
             join_request.save()
             message = "Request denied."
 
+        bump_room_version(room_name)
+
+        # Wake up the guest's lobby long-poll so the decision reaches them immediately
+        events.join_request_decided(room_name, join_request.id, join_request.user_id, join_request.status)
+
         # Return a success message indicating the decision
         return JsonResponse({
             "status": "success",
@@ -303,39 +527,34 @@ def approve_join_request(request, room_name, request_id):
         return JsonResponse({"status": "error", "message": str(e)})
 
 
-# Endpoint to check the status of a user's join request
+# Endpoint to check the status of a user's join request.
+# With `?wait=<seconds>` the request is held open while the join request is pending, and answered as soon as
+# the host decides (or when the wait runs out, with the still-pending status). This view holds its thread meanwhile,
+# so it waits at most JOIN_STATUS_MAX_SYNC_WAIT seconds; the async view honors longer waits.
 @login_required(login_url='/login/')  # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+@replica_reads  # Read-only: may read from the read replica (see base/routers.py)
+@cache_control(no_cache=True)  # Let browsers keep the response, but revalidate it with its ETag on every poll
+@poll_hint  # Tell the client when to poll next (Retry-After), from the room's activity and the server's load
+@condition(etag_func=join_request_status_etag)  # Answer with a 304 when the room hasn't changed since the client's copy
 def check_join_request_status(request, room_name, user_id):
+    deadline = time.monotonic() + requested_wait(request, JOIN_STATUS_MAX_SYNC_WAIT)
+
     try:
-        # Fetch the room and the join request for the user
-        room = get_object_or_404(Room, room_name=room_name)
-        join_request = get_object_or_404(RoomRequest, user_id=user_id, room=room)
-
-        # Check the current status of the join request and return an appropriate response
-        if join_request.status == 'approved':
-            # If approved, provide the user with the ability to proceed to the room
-            return JsonResponse({
-                "status": "success",
-                "join_status": "approved",
-                "redirect_url": "/room/",  # Provide a link to the room
-                "message": "Your request to join has been approved!"
-            })
-
-        elif join_request.status == 'denied':
-            # If denied, inform the user that their request was rejected
-            return JsonResponse({
-                "status": "success",
-                "join_status": "denied",
-                "message": "Your request to join was denied."
-            })
+        while True:
+            # Note the room's event sequence before reading, so a decision landing in between isn't missed
+            sequence = events.hub.sequence(room_name)
 
-        else:
-            # If still pending, inform the user that their request is waiting for approval
-            return JsonResponse({
-                "status": "success",
-                "join_status": "pending",
-                "message": "Your request is still pending."
-            })
+            # Fetch the join request for the user in the room
+            join_request = get_object_or_404(RoomRequest, user_id=user_id, room__room_name=room_name)
+
+            remaining = deadline - time.monotonic()
+            if join_request.status != RoomRequest.Status.PENDING or remaining <= 0:
+                break
+
+            # Sleep until something happens in the room, then look again
+            events.hub.wait(room_name, sequence, min(remaining, JOIN_STATUS_RECHECK_INTERVAL))
+
+        return join_status_response(join_request)
     
     except RoomRequest.DoesNotExist:
         return JsonResponse({
@@ -344,34 +563,108 @@ def check_join_request_status(request, room_name, user_id):
         }, status=404)
 
 
-# View to get the list of participants in a room
+# Response telling a guest where their join request stands (shared with base/async_views.py).
+def join_status_response(join_request):
+    # Check the current status of the join request and return an appropriate response
+    if join_request.status == RoomRequest.Status.APPROVED:
+        # If approved, provide the user with the ability to proceed to the room
+        return JsonResponse({
+            "status": "success",
+            "join_status": "approved",
+            "redirect_url": "/room/",  # Provide a link to the room
+            "message": "Your request to join has been approved!"
+        })
+
+    elif join_request.status == RoomRequest.Status.DENIED:
+        # If denied, inform the user that their request was rejected
+        return JsonResponse({
+            "status": "success",
+            "join_status": "denied",
+            "message": "Your request to join was denied."
+        })
+
+    else:
+        # If still pending, inform the user that their request is waiting for approval
+        return JsonResponse({
+            "status": "success",
+            "join_status": "pending",
+            "message": "Your request is still pending."
+        })
+
+
+# View to get the list of participants in a room.
+# Clients connected to the room's WebSocket receive these changes as pushes; this endpoint stays as a
+# fallback for clients that can't hold a connection (e.g. when served through WSGI).
 @login_required(login_url='/login/')  # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+@replica_reads  # Read-only: may read from the read replica (see base/routers.py)
+@cache_control(no_cache=True)  # Let browsers keep the response, but revalidate it with its ETag on every poll
+@poll_hint  # Tell the client when to poll next (Retry-After), from the room's activity and the server's load
+@condition(etag_func=participants_etag)  # Answer with a 304 when the room hasn't changed since the client's copy
 def get_participants(request, room_name):
     try:
         # Fetch the room by its name
         room = Room.objects.get(room_name=room_name)
 
-        # Get all participants of the room
-        participants = room.participants.all()
-
-        # Prepare the data for all participants with "is_host" field
-        participants_data = [
-            {
-                "username": participant.username,
-                "is_host": participant == room.current_host  # Check if the participant is the current host
-            }
-            for participant in participants
-        ]
-
         # Return the list of participants
-        return JsonResponse({"status": "success", "participants": participants_data})
+        return JsonResponse({"status": "success", "participants": participants_data(room)})
 
     except Room.DoesNotExist:
         return JsonResponse({"status": "error", "message": "Room not found"}, status=404)
 
 
+# Participants of a room, each with an "is_host" field.
+def participants_data(room):
+    return format_participants(room, ((participant.id, participant.username) for participant in room.participants.all()))
+
+
+# Participants of a room from (user id, username) rows (shared with base/async_views.py).
+def format_participants(room, rows):
+    return [
+        {
+            "username": username,
+            "is_host": user_id == room.current_host_id  # Check if the participant is the current host
+        }
+        for user_id, username in rows
+    ]
+
+
+# View returning everything a room client polls for in one response: the participants (with host flags),
+# the members' UID -> name map, the pending join requests (host only) and the room's version.
+# It runs a fixed number of queries (room, participants, members, and pending requests for the host)
+# however large the room is, and answers unchanged polls with a 304 like the other polling endpoints.
+@login_required(login_url='/login/')  # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+@replica_reads  # Read-only: may read from the read replica (see base/routers.py)
+@cache_control(no_cache=True)  # Let browsers keep the response, but revalidate it with its ETag on every poll
+@poll_hint  # Tell the client when to poll next (Retry-After), from the room's activity and the server's load
+@condition(etag_func=pending_requests_etag)  # Depends on the room's version and on whether the user is the host
+def room_snapshot(request, room_name):
+    room = (
+        Room.objects
+        .prefetch_related(
+            Prefetch('participants', queryset=User.objects.only('id', 'username')),
+            Prefetch('members', queryset=RoomMember.objects.only('room_id', 'uid', 'name')),
+        )
+        .filter(room_name=room_name)
+        .first()
+    )
+    if room is None:
+        return JsonResponse({"status": "error", "message": "Room not found"}, status=404)
+
+    is_host = request.user.id == room.current_host_id
+
+    return JsonResponse({
+        "status": "success",
+        "version": room.version,
+        "is_host": is_host,
+        "participants": participants_data(room),
+        "members": {member.uid: member.name for member in room.members.all()},
+        "pending_requests": pending_requests_data(room) if is_host else [],
+    })
+
+
 # View to fetch a RoomMember's UID based on username and room name.
 @login_required(login_url='/login/')  # Ensure the user is logged in before accessing this view. Redirects to '/login/' if the user is not logged in
+@replica_reads  # Read-only: may read from the read replica (see base/routers.py)
 def getUidByUsername(request):
     # Retrieve the username and room name from the request's query parameters.
     username = request.GET.get('username')
@@ -381,7 +674,7 @@ def getUidByUsername(request):
         # Query the RoomMember model to find the member with the specified username and room name.
         member = RoomMember.objects.get(
             name=username,
-            room_name=room_name,
+            room__room_name=room_name,
         )
 
         # If found, return the member's UID in a JSON response.
@@ -399,45 +692,11 @@ def remove_participant_by_name(request):
     data = json.loads(request.body)
     
     try:
-        # Query the RoomMember model to find the participant to be removed using their name, UID, and room name.
-        member = RoomMember.objects.get(
-            name=data['name'],
-            uid=data['UID'],
-            room_name=data['room_name'],
-        )
-
-        # Remove the member from the RoomMember model.
-        member.delete()
-
-        # Query the Room model to find the corresponding room using the room name.
-        room = Room.objects.get(room_name=data['room_name'])
-
-        # Find the participant to remove from the room's participants list by matching their username (case-insensitively).
-        participant_to_remove = room.participants.filter(username__iexact=member.name).first()
-
-        # If the participant exists in the room, remove them.
-        if participant_to_remove:
-            room.participants.remove(participant_to_remove)
-
-        # If the removed participant was the current host, set the room's host to None.
-        if room.current_host == participant_to_remove:
-            room.current_host = None
-            room.save()
-
-        # If the room no longer has any participants, delete the room from the database.
-        if not room.participants.exists():
-            room.delete()
+        # Remove the member and the matching participant; kicking someone who already left succeeds too.
+        leave_room(data['room_name'], data['name'], data['UID'])
 
         # Return a success response indicating the participant was removed successfully.
-        return JsonResponse({'message': f'Participant {member.name} has been removed successfully.'}, safe=False)
-
-    except RoomMember.DoesNotExist:
-        # Return a 404 error if the specified member does not exist.
-        return JsonResponse({'error': 'Member not found.'}, status=404)
-
-    except Room.DoesNotExist:
-        # Return a 404 error if the specified room does not exist.
-        return JsonResponse({'error': 'Room not found.'}, status=404)
+        return JsonResponse({'message': f'Participant {data["name"]} has been removed successfully.'}, safe=False)
 
     except Exception as e:
         # Catch any unexpected errors and return a 500 response with the error message.
@@ -467,7 +726,9 @@ def change_host(request):
 
         # Update the room's current host to the new host
         room.current_host = new_host
-        room.save()
+        room.save(update_fields=['current_host'])
+        bump_room_version(data['room_name'])
+        events.host_changed(data['room_name'], new_host.username)
 
         # Return a success response indicating the host was changed successfully
         return JsonResponse({'message': f'{new_host.username} is now the host of the room.'}, safe=False)
@@ -479,3 +740,14 @@ def change_host(request):
     except Exception as e:
         # Catch any unexpected errors and return a 500 response with the error message
         return JsonResponse({'error': f'An unexpected error occurred: {str(e)}'}, status=500)
+
+
+# Per-route request metrics of this worker, in the Prometheus text format (see base/metrics.py).
+# Only served once METRICS_TOKEN is set, to scrapers sending it.
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        raise Http404
+    if request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
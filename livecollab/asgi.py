@@ -3,6 +3,10 @@ ASGI config for mychat project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+HTTP requests go to Django, with the polling endpoints served by their async
+versions (``base.async_views``); WebSocket connections (the room push channel)
+are handled by ``base.consumers``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
 """
@@ -12,5 +16,15 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'livecollab.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')  # Serve the polling endpoints without holding a thread each.
+
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since the consumers use the ORM.
+from base.consumers import websocket_application  # noqa: E402
+
 
-application = get_asgi_application()
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -14,6 +14,7 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Load environment variables from .env file
 load_dotenv()
@@ -74,8 +75,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'base.middleware.InstrumentationMiddleware',    # First, so its timings cover the whole request (see base/metrics.py).
+    'base.middleware.ReplicaPinMiddleware',   # Around the session middleware, so session writes pin the client to the primary too.
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',   # WhiteNoiseMiddleware is added to handle static file serving in production environments.
+    'base.middleware.StaticFilesMiddleware',   # WhiteNoise's static file serving in production environments, also usable by async views.
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -88,7 +91,7 @@ ROOT_URLCONF = 'livecollab.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'base.metrics.TimedDjangoTemplates',   # Django templates, timed for the Server-Timing header and /metrics/.
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -123,6 +126,48 @@ DATABASES = {
     )
 }
 
+# Read replica for the polling endpoints (see base/routers.py), e.g. `postgres://...` for a streaming replica, or
+# `sqlite:///replica.sqlite3` locally, refreshed with `manage.py sync_replica`. Clients that just wrote something
+# read from the primary for REPLICA_PIN_SECONDS (keep it above the replica's usual lag).
+if os.environ.get('DATABASE_REPLICA_URL'):
+    DATABASES['replica'] = dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'], conn_max_age=600, conn_health_checks=True)
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}  # Tests read what they just wrote.
+REPLICA_DATABASE = 'replica' if 'replica' in DATABASES else None
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+DATABASE_ROUTERS = ['base.routers.ReplicaRouter']
+
+# Connection pool per worker for PostgreSQL (see base/dbpool.py): DB_POOL_SIZE connections kept open (0 turns the
+# pool off and keeps Django's persistent connections), up to DB_POOL_MAX_OVERFLOW more during bursts, and requests
+# waiting up to DB_POOL_TIMEOUT seconds for one before failing. Idle connections are closed after DB_POOL_MAX_IDLE seconds.
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+
+for database in DATABASES.values():
+    if database['ENGINE'] == 'django.db.backends.sqlite3':
+        database['OPTIONS'] = {
+            # Take SQLite's write lock when a transaction starts, so transactions that read a row and then write it
+            # (leaving a room) queue up instead of failing halfway. SQLite has no SELECT ... FOR UPDATE.
+            # This is the production choice, and it serializes every write transaction (reads outside transactions
+            # aren't affected): fine for a single-node deployment, use PostgreSQL past that.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,  # SQLite's busy timeout: seconds a write waits for the lock before "database is locked".
+        }
+        # Tuned profile for single-node deployments (SQLITE_TUNED=False keeps SQLite's defaults): write-ahead logging,
+        # so polls keep reading while members are created and deleted, fsync only at checkpoints (a power loss can
+        # lose the last transactions, but never corrupts the database), and reads through a 256 MB memory map.
+        if os.environ.get('SQLITE_TUNED', 'True') == 'True':
+            database['OPTIONS']['init_command'] = (
+                'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL; PRAGMA mmap_size=268435456'
+            )
+    elif database['ENGINE'] == 'django.db.backends.postgresql' and DB_POOL_SIZE:
+        database['ENGINE'] = 'base.backends.postgresql'
+        database['CONN_MAX_AGE'] = 0  # Connections go back to the pool at the end of each request.
+        database['POOL'] = {
+            'size': DB_POOL_SIZE,
+            'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', DB_POOL_SIZE)),
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'max_idle': float(os.environ.get('DB_POOL_MAX_IDLE', 300)),
+        }
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -168,19 +213,100 @@ STATICFILES_DIRS = [
 # 
 # - `STATIC_ROOT` is defined to collect all static files into a directory (`staticfiles`),
 #   which is required for serving static assets in production.
-# - The WhiteNoise storage backend (`STATICFILES_STORAGE`) is enabled to compress static files 
-#   (using gzip or Brotli) and append unique version identifiers to filenames. This ensures
-#   efficient file serving, reduces load times, and enables long-term caching.
-# - These settings are applied only in production (when DEBUG is False) to ensure compatibility
-#   with deployment requirements, as the development server handles static files differently.
-
+# - The static files storage (`base.storage.StaticFilesStorage`, built on WhiteNoise's) gives the collected files
+#   unique names for each version and builds gzip and Brotli variants of them at `collectstatic`. WhiteNoise then
+#   serves them with far-future immutable caching, and the smallest variant each browser accepts.
+# - This static pipeline is on by default in production (when DEBUG is False); STATIC_PIPELINE turns it on or off
+#   explicitly, e.g. to check a production build locally.
+STATIC_PIPELINE = os.environ.get('STATIC_PIPELINE', str(not DEBUG)) == 'True'
 
 # This production code might break development mode, so we check whether we're in DEBUG mode
-if not DEBUG:    # Tell Django to copy static assets into a path called `staticfiles` (this is specific to Render)
+if STATIC_PIPELINE:    # Tell Django to copy static assets into a path called `staticfiles` (this is specific to Render)
     STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
-    # Enable the WhiteNoise storage backend, which compresses static files to reduce disk use
-    # and renames the files with unique names for each version to support long-term caching
-    STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+    # Enable the compressing, versioning storage backend (STATICFILES_STORAGE is no longer read since Django 5.1)
+    STORAGES = {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'base.storage.StaticFilesStorage'},
+    }
+
+
+# Agora token cache (see base/tokens.py): how many tokens each worker keeps, and how long before its
+# expiry (in seconds) a cached token stops being handed out.
+AGORA_TOKEN_CACHE_SIZE = int(os.environ.get('AGORA_TOKEN_CACHE_SIZE', 1024))
+AGORA_TOKEN_REFRESH_MARGIN = int(os.environ.get('AGORA_TOKEN_REFRESH_MARGIN', 3600))
+
+# Presence (see base/presence.py), all in seconds: how long a member may go without a heartbeat before the reaper
+# removes them (room pages send one every 15 seconds), how long an empty room is kept before it is deleted,
+# and how long a join request may stay pending.
+PRESENCE_MEMBER_TIMEOUT = int(os.environ.get('PRESENCE_MEMBER_TIMEOUT', 60))
+PRESENCE_EMPTY_ROOM_GRACE = int(os.environ.get('PRESENCE_EMPTY_ROOM_GRACE', 300))
+PRESENCE_REQUEST_TIMEOUT = int(os.environ.get('PRESENCE_REQUEST_TIMEOUT', 900))
+# Heartbeats are written to the database at most once per this many seconds per member (see base/roomstate.py).
+PRESENCE_WRITE_INTERVAL = int(os.environ.get('PRESENCE_WRITE_INTERVAL', PRESENCE_MEMBER_TIMEOUT // 3))
+
+# Event bus carrying room events between worker processes (see base/eventbus.py): unset for a single process,
+# `relay://127.0.0.1:7390` for workers on one machine (with `manage.py event_relay`), or a Redis URL.
+# `local://` also runs without a bus, but states that there is a single process, whose hub sees every event.
+EVENT_BUS_URL = os.environ.get('EVENT_BUS_URL', '')
+# Events a push connection may fall behind by before it is told to reload the room's state instead.
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 100))
+
+# Poll-interval hints sent to polling clients (see base/polling.py), in seconds: the interval for active rooms,
+# the longest one (for idle rooms, or when shedding load), and the fraction of a room's idle time that idle rooms
+# are polled at instead (once it is longer than the minimum).
+POLL_INTERVAL_MIN = int(os.environ.get('POLL_INTERVAL_MIN', 3))
+POLL_INTERVAL_MAX = int(os.environ.get('POLL_INTERVAL_MAX', 30))
+POLL_IDLE_BACKOFF = float(os.environ.get('POLL_IDLE_BACKOFF', 0.25))
+# Requests per second a worker handles before it stretches the hints in proportion to its load.
+POLL_LOAD_CAPACITY = int(os.environ.get('POLL_LOAD_CAPACITY', 200))
+
+# Shared room state (see base/roomstate.py): unset to read everything from the database, `memory://` for a
+# single-process deployment, or a Redis URL (`redis://host:6379/0`, needs the redis package) for several workers.
+ROOM_STATE_URL = os.environ.get('ROOM_STATE_URL', '')
+# How long (in seconds) the store trusts a room name to still belong to the same room.
+ROOM_STATE_TTL = int(os.environ.get('ROOM_STATE_TTL', 300))
+
+# Cache shared by the worker processes: a Redis URL (`redis://host:6379/0`, needs the redis package) or a
+# Memcached one (`memcached://host:11211`, needs pymemcache). Unset, each process keeps its own in-memory cache.
+CACHE_URL = os.environ.get('CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif CACHE_URL.startswith('memcached://'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache', 'LOCATION': CACHE_URL[len('memcached://'):]}}
+elif CACHE_URL:
+    raise ImproperlyConfigured(f'Unsupported CACHE_URL scheme: {CACHE_URL.split(":")[0]!r}')
+
+# Fast-path authentication for polling requests: sessions are read from the cache (falling back to the database)
+# and users are cached for AUTH_USER_CACHE_TTL seconds (see base/auth.py). FAST_AUTH=False reads both from the
+# database on every request. CachedModelBackend stays listed either way, so logins survive switching modes.
+# It needs the shared cache (CACHE_URL): with a cache per process, a logout or password change handled by one
+# worker would not reach the sessions and users cached by the others. So it is on by default with CACHE_URL only,
+# and refused without it.
+FAST_AUTH = os.environ.get('FAST_AUTH', str(bool(CACHE_URL))) == 'True'
+if FAST_AUTH and not CACHE_URL:
+    raise ImproperlyConfigured('FAST_AUTH needs a cache shared by the workers: set CACHE_URL.')
+AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 30))
+AUTHENTICATION_BACKENDS = [
+    'base.auth.CachedModelBackend',
+    'django.contrib.auth.backends.ModelBackend',  # Sessions started before the fast path existed.
+]
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db' if FAST_AUTH else 'django.contrib.sessions.backends.db'
+
+# Seconds the home, about, contact, login and sign-up pages are served from the page cache (see base/pagecache.py).
+# 0 renders them on every request.
+PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 300))
+
+# Serve the polling endpoints with their async versions (see base/async_views.py). Turned on by livecollab/asgi.py,
+# since under WSGI async views would each need an event loop of their own.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+# Bearer token required to read /metrics/ (Prometheus format); when unset, the endpoint answers 404.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Send each request's timings and query count to the client in a Server-Timing header (see base/middleware.py).
+# On under DEBUG only, since it tells anyone how the server spends its time; SERVER_TIMING=True turns it on
+# elsewhere (`manage.py loadgen` does, for the servers it starts).
+SERVER_TIMING = os.environ.get('SERVER_TIMING', str(DEBUG)) == 'True'
 
 
 # Default primary key field type
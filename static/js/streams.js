@@ -15,6 +15,11 @@ const client = AgoraRTC.createClient({ mode: 'rtc', codec: 'vp8' })
 let localTracks = []
 let remoteUsers = {}
 
+// Names of the room's members keyed by UID, loaded once on join and kept up to date by the push channel.
+let memberNames = {}
+let memberLookup = null  // Batch of UIDs waiting to be looked up together, if any
+let heartbeatInterval = null  // Timer sending the member's heartbeats to the server
+
 
 // Function to join the channel, create and display the local stream, and subscribe to remote users.
 let joinAndDisplayLocalStream = async () => {
@@ -32,9 +37,13 @@ let joinAndDisplayLocalStream = async () => {
         window.open('/', '_self'); // Redirect to home if joining fails.
     }
 
+    // Load the names of everyone already in the room, so remote videos can be labelled without a lookup each.
+    await loadMemberMap();
+
     // Create the local media tracks (audio and video).
     localTracks = await AgoraRTC.createMicrophoneAndCameraTracks();
     let member = await createMember(); // Create a new member for the server.
+    heartbeatInterval = setInterval(sendHeartbeat, 15000); // Keep the member from being reaped while the page is open.
 
     // Generate the HTML to display the local video feed.
     let player = `<div class="video-container" id="user-container-${UID}">
@@ -182,12 +191,63 @@ let createMember = async () => {
 }
 
 
-// Function to retrieve member details from the server based on UID.
+// Function to tell the server the local member is still here; members that stop sending heartbeats are removed.
+let sendHeartbeat = async () => {
+    try {
+        let response = await fetch('/heartbeat/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                "X-CSRFToken": getCookie('csrftoken')  // CSRF token for security
+            },
+            body: JSON.stringify({ 'name': NAME, 'room_name': CHANNEL, 'UID': UID })
+        })
+
+        // The member was removed while the page was unreachable: leave, as when removed by the host.
+        if (response.status === 404) {
+            clearInterval(heartbeatInterval);
+            await leaveAndRemoveLocalStream();
+        }
+    } catch (error) {
+        console.error("Error sending heartbeat:", error);  // Try again on the next beat.
+    }
+}
+
+
+// Function to load the names of all the room's members from the server.
+let loadMemberMap = async () => {
+    try {
+        let response = await fetch(`/get_member_map/${CHANNEL}/`)
+        let data = await response.json()
+        Object.assign(memberNames, data.members)
+    } catch (error) {
+        console.error("Error loading room members:", error);
+    }
+}
+
+
+// Function to retrieve member details based on UID, from the local map or else from the server.
+// Lookups made at the same time are sent together in a single request.
 let getMember = async (user) => {
-    let response = await fetch(`/get_member/?UID=${user.uid}&room_name=${CHANNEL}`)
-    let member = await response.json()
+    if (!(user.uid in memberNames)) {
+        if (memberLookup === null) {
+            const newBatch = { uids: new Set() }
+            newBatch.done = new Promise(resolve => setTimeout(resolve, 0)).then(async () => {
+                memberLookup = null
+                const query = [...newBatch.uids].map(uid => `UID=${encodeURIComponent(uid)}`).join('&')
+                let response = await fetch(`/get_members/?${query}&room_name=${CHANNEL}`)
+                let data = await response.json()
+                Object.assign(memberNames, data.members)
+            })
+            memberLookup = newBatch
+        }
 
-    return member
+        const batch = memberLookup
+        batch.uids.add(user.uid)
+        await batch.done
+    }
+
+    return { 'name': memberNames[user.uid] ?? '' }
 }
 
 
@@ -231,68 +291,94 @@ let getUidByUsername = async (username) => {
 // Variable to track the previous host
 let previousHost = null;
 
-// Function to fetch and update the list of participants in the room.
-async function updateParticipants() {
-    try {
-        // Fetch the list of participants for the current room from the server.
-        const response = await fetch(`/get_participants/${CHANNEL}/`);
-        const data = await response.json();
+// Current roster of the room, kept up to date by the push channel or by polling.
+let roster = [];
 
-        if (data.status === "success") {
-            const participantsList = document.getElementById("participants-list");
-
-            // Clear the existing participants list from the UI.
-            participantsList.innerHTML = "";
-
-            let localUserInRoom = false;
-            let currentHost = null; // Track the current host during this update
-
-            // Iterate over the list of participants returned by the server.
-            data.participants.forEach(participant => {
-                // Check if the local user is in the room by comparing usernames (case-insensitive).
-                if (participant.username.toLowerCase() === NAME.toLowerCase()) {
-                    localUserInRoom = true;
-                }
-
-                // Identify the current host
-                if (participant.is_host) {
-                    currentHost = participant.username;
-                }
-                
-                // Generate the HTML for each participant.
-                const participantItem = `
-                    <div class="participant-item">
-                        <div class="participant-details">
-                            <p class="participant-name">${participant.username}</p>
-                            ${participant.is_host ? `<span class="host-label">Host</span>` : ""}
-                        </div>
-
-                        <!-- Buttons go on the next line -->
-                        ${isHost && !participant.is_host ? `
-                            <div class="participant-actions">
-                                <button class="host-btn" onclick="changeHost('${participant.username}')">Make Host</button>
-                                <button class="remove-btn" onclick="removeParticipant('${participant.username}')">Remove</button>
-                            </div>
-                        ` : ""}
+// Function to render the list of participants in the room.
+async function renderParticipants(participants) {
+    roster = participants;
+    const participantsList = document.getElementById("participants-list");
+
+    // Clear the existing participants list from the UI.
+    participantsList.innerHTML = "";
+
+    let localUserInRoom = false;
+
+    // Identify the current host, and whether it is the local user
+    const currentHost = participants.find(participant => participant.is_host)?.username ?? null;
+    isHost = currentHost !== null && currentHost.toLowerCase() === NAME.toLowerCase();
+
+    // Iterate over the list of participants.
+    participants.forEach(participant => {
+        // Check if the local user is in the room by comparing usernames (case-insensitive).
+        if (participant.username.toLowerCase() === NAME.toLowerCase()) {
+            localUserInRoom = true;
+        }
+
+        // Generate the HTML for each participant.
+        const participantItem = `
+            <div class="participant-item">
+                <div class="participant-details">
+                    <p class="participant-name">${participant.username}</p>
+                    ${participant.is_host ? `<span class="host-label">Host</span>` : ""}
+                </div>
+
+                <!-- Buttons go on the next line -->
+                ${isHost && !participant.is_host ? `
+                    <div class="participant-actions">
+                        <button class="host-btn" onclick="changeHost('${participant.username}')">Make Host</button>
+                        <button class="remove-btn" onclick="removeParticipant('${participant.username}')">Remove</button>
                     </div>
-                `;
+                ` : ""}
+            </div>
+        `;
+
+        // Add the participant's HTML to the list in the UI.
+        participantsList.insertAdjacentHTML("beforeend", participantItem);
+    });
+
+    // If the local user is not found in the participants list, leave the channel and clean up.
+    if (!localUserInRoom) {
+        console.log("Local user is no longer in the participants list. Leaving the channel...");
+        await leaveAndRemoveLocalStream();
+    }
 
-                // Add the participant's HTML to the list in the UI.
-                participantsList.insertAdjacentHTML("beforeend", participantItem);
-            });
+    // Check if the host has changed
+    if (currentHost !== previousHost) {
+        console.log(`Host has changed from ${previousHost || "None"} to ${currentHost || "None"}`);
+        previousHost = currentHost; // Update the previous host
 
-            // If the local user is not found in the participants list, leave the channel and clean up.
-            if (!localUserInRoom) {
-                console.log("Local user is no longer in the participants list. Leaving the channel...");
-                await leaveAndRemoveLocalStream();
-            }
+        // The new host gets the queue from the push channel or the next snapshot; everyone else drops whatever was shown.
+        if (!isHost) {
+            showPendingRequests([]);
+        }
+    }
+}
 
-            // Check if the host has changed
-            if (currentHost !== previousHost) {
-                console.log(`Host has changed from ${previousHost || "None"} to ${currentHost || "None"}`);
-                previousHost = currentHost; // Update the previous host
-                checkPendingRequests(); // Call the function when the host changes
-            }
+
+// Delay (in milliseconds) before the next poll, from the Retry-After header of the server's polling endpoints:
+// longer for idle rooms and while the server is busy. Jittered so the room's clients don't all poll at once.
+function nextPollDelay(response, fallback) {
+    const seconds = parseInt(response ? response.headers.get("Retry-After") : "", 10);
+    const delay = Number.isNaN(seconds) ? fallback : seconds * 1000;
+    return delay * (0.9 + Math.random() * 0.2);
+}
+
+
+// Function to fetch the room's state in one request and update the participants, member names and,
+// for the host, the pending join requests (fallback when the push channel is unavailable).
+// Returns the delay before the next poll.
+async function updateParticipants() {
+    let response = null;
+    try {
+        // Fetch the snapshot of the current room from the server.
+        response = await fetch(`/room_snapshot/${CHANNEL}/`);
+        const data = await response.json();
+
+        if (data.status === "success") {
+            Object.assign(memberNames, data.members);
+            await renderParticipants(data.participants);
+            showPendingRequests(data.is_host ? data.pending_requests : []);
         } else {
             // Log any errors returned by the server.
             console.log("Error fetching participants: " + data.message);
@@ -301,6 +387,79 @@ async function updateParticipants() {
         // Log any errors that occur during the fetch operation.
         console.error("Error fetching participants:", error);
     }
+    return nextPollDelay(response, 3000);
+}
+
+
+// Function to apply a change pushed by the server: roster diffs for everyone, join requests for the host.
+async function applyRosterEvent(event) {
+    if (event.type === "member") {
+        memberNames[event.uid] = event.name;
+    } else if (event.type === "pending_requests") {
+        showPendingRequests(event.pending_requests);
+    } else if (event.type === "join_request") {
+        showPendingRequests([...pendingRequests.filter(request => request.user_id !== event.request_id), { name: event.name, user_id: event.request_id }]);
+    } else if (event.type === "join_request_decided") {
+        showPendingRequests(pendingRequests.filter(request => request.user_id !== event.request_id));
+    } else if (event.type === "roster") {
+        await renderParticipants(event.participants);
+    } else if (event.type === "join") {
+        if (!roster.some(participant => participant.username === event.username)) {
+            await renderParticipants([...roster, { username: event.username, is_host: event.is_host }]);
+        }
+    } else if (event.type === "leave") {
+        await renderParticipants(roster.filter(participant => participant.username !== event.username));
+    } else if (event.type === "host") {
+        await renderParticipants(roster.map(participant => ({ ...participant, is_host: participant.username === event.username })));
+    }
+}
+
+
+let participantsPolling = null;  // The running fallback polling loop ({ timer }), if any
+let roomSocketOpen = false;  // Whether the push channel is currently connected
+
+
+// Start polling the room snapshot (used while the push channel is down), each poll waiting as long as the
+// previous response asked for.
+function startParticipantsPolling() {
+    if (participantsPolling === null) {
+        const polling = participantsPolling = { timer: null };
+        const poll = async () => {
+            const delay = await updateParticipants();
+            if (participantsPolling === polling) {  // Not stopped (or restarted) in the meantime
+                polling.timer = setTimeout(poll, delay);
+            }
+        };
+        poll();
+    }
+}
+
+
+// Stop the fallback polling loop once the push channel is connected.
+function stopParticipantsPolling() {
+    if (participantsPolling !== null) {
+        clearTimeout(participantsPolling.timer);
+        participantsPolling = null;
+    }
+}
+
+
+// Function to connect to the room's push channel, falling back to polling whenever it is unavailable.
+function connectRoomSocket() {
+    const scheme = window.location.protocol === "https:" ? "wss" : "ws";
+    const socket = new WebSocket(`${scheme}://${window.location.host}/ws/rooms/${encodeURIComponent(CHANNEL)}/`);
+
+    socket.onopen = () => {
+        roomSocketOpen = true;
+        stopParticipantsPolling();
+    };
+    socket.onmessage = (message) => applyRosterEvent(JSON.parse(message.data));
+    socket.onclose = () => {
+        // Keep the list fresh by polling, and try to reconnect after a short delay.
+        roomSocketOpen = false;
+        startParticipantsPolling();
+        setTimeout(connectRoomSocket, 10000);
+    };
 }
 
 
@@ -428,11 +587,10 @@ function getCookie(name) {
 joinAndDisplayLocalStream()
 
 
-// Call the updateParticipants function on page load to populate the participants list
-updateParticipants(); 
-
-// Periodically update the participants list every 3 seconds
-setInterval(updateParticipants, 3000);
+// Populate the participants list on page load, and keep it updated through the push channel
+// (or by polling every 3 seconds when the server can't hold a WebSocket open).
+startParticipantsPolling();
+connectRoomSocket();
 
 
 // Add event listener to delete the member when the window is about to unload (user leaves the page).